@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Latency of logged-in users during a login storm, with admission control
+(lib/admission.py) on and off. Attacker threads POST /api/auth/login with a
+wrong password in a loop (a full PBKDF2 each, never cached) while one
+logged-in client lists its apps through its session cookie.
+
+Without admission control the storm holds every web thread in PBKDF2 and
+the logged-in client queues behind it; with it, surplus logins are turned
+away at once with 429 / 503 and the logged-in client keeps its latency.
+
+Each run is serve.py with one worker in a scratch directory on its own port.
+
+Usage: python3 benchmarks/bench_admission.py [attackers] [requests]
+"""
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def prepare(scratch):
+    code = "from lib import auth; auth.register_user('bench', 'bench-password')"
+    subprocess.run([sys.executable, "-c", code], cwd=scratch, check=True,
+                   env={**os.environ, "PYTHONPATH": ROOT})
+
+def start_server(scratch, port, admission):
+    args = [sys.executable, os.path.join(ROOT, "serve.py"), "--port", str(port), "--workers", "1"]
+    env = {**os.environ, "PYTHONPATH": ROOT, "PAYLOAD_ADMISSION_CONTROL": "1" if admission else "0"}
+    proc = subprocess.Popen(args, cwd=scratch, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def post(connection, path, body, headers=None):
+    connection.request("POST", path, body=json.dumps(body),
+                       headers={"Content-Type": "application/json", **(headers or {})})
+    response = connection.getresponse()
+    response.read()
+    return response
+
+def login(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    response = post(connection, "/api/auth/login", {"username": "bench", "password": "bench-password"})
+    cookie = response.getheader("Set-Cookie").split(";", 1)[0]
+    return connection, cookie
+
+def run(port, attackers, requests):
+    stop = threading.Event()
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def attacker():
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        while not stop.is_set():
+            try:
+                status = post(connection, "/api/auth/login", {"username": "bench", "password": "wrong"}).status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = "error"
+            with lock:
+                statuses[status] += 1
+
+    connection, cookie = login(port)
+    threads = [threading.Thread(target=attacker) for _ in range(attackers)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)  # let the storm fill the server
+
+    latencies = []
+    errors = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        connection.request("GET", "/api/apps", headers={"Cookie": cookie})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors += 1
+
+    stop.set()
+    for t in threads:
+        t.join()
+    connection.close()
+    latencies.sort()
+    return latencies, errors, statuses
+
+if __name__ == "__main__":
+    attackers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    scratch = tempfile.mkdtemp(prefix="bench-admission-")
+    try:
+        prepare(scratch)
+        print(f"{attackers} attacker threads, {requests} requests by a logged-in client")
+        for label, admission in (("admission off", False), ("admission on", True)):
+            port = free_port()
+            proc = start_server(scratch, port, admission)
+            try:
+                latencies, errors, statuses = run(port, attackers, requests)
+            finally:
+                proc.terminate()
+                proc.wait()
+            total = len(latencies)
+            p50 = latencies[total // 2] * 1000
+            p99 = latencies[min(total - 1, int(total * 0.99))] * 1000
+            storm = " ".join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str))
+            print(f"  {label:<14}: p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  errors {errors}  logins {storm}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compares per-call cost of lib.crypto against the old path that built a
+fresh gnupg.GPG handle for every encrypt/decrypt, and the gpg backend
+against the in-process AEAD backend.
+
+Usage: python3 benchmarks/bench_crypto.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import crypto
+
+SECRET = '{"password": "hunter2", "api_key": "0123456789abcdef"}'
+PASSPHRASE = "benchmark-passphrase"
+
+def run_fresh_handle(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encrypted = crypto._new_gpg().encrypt(SECRET, recipients=None, symmetric=True, passphrase=PASSPHRASE)
+        crypto._new_gpg().decrypt(str(encrypted), passphrase=PASSPHRASE)
+    return time.perf_counter() - start
+
+def run_engine(iterations, backend):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encrypted = crypto.encrypt_secret(SECRET, PASSPHRASE, backend=backend)
+        crypto.decrypt_secret(str(encrypted), PASSPHRASE)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    crypto.init_engine()
+
+    fresh = run_fresh_handle(iterations)
+    engine = run_engine(iterations, "gpg")
+    in_process = run_engine(iterations, "aead")
+
+    print(f"{iterations} encrypt+decrypt round trips")
+    print(f"  fresh gnupg.GPG per call : {fresh * 1000 / iterations:8.2f} ms/round trip")
+    print(f"  shared engine (gpg)      : {engine * 1000 / iterations:8.2f} ms/round trip")
+    print(f"  in-process AEAD          : {in_process * 1000 / iterations:8.2f} ms/round trip")
+    for op, stats in sorted(crypto.timing_stats().items()):
+        print(f"  {op:<14} avg {stats['avg'] * 1000:7.2f} ms  max {stats['max'] * 1000:7.2f} ms")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Throughput of concurrent store_payload calls on the fs backend with plain
+per-write fsync versus group commit (lib.durable).
+
+Runs in a scratch directory under the given path, which must be on the
+filesystem you care about (tmpfs makes fsync free and the numbers useless).
+
+Usage: python3 benchmarks/bench_durable_writes.py [threads] [writes_per_thread] [scratch_parent]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import config, durable, fs_backend, protocol
+
+def run(threads, writes, group_commit):
+    config.GROUP_COMMIT = group_commit
+    payload = protocol.create_payload("bench", "x" * 512)
+
+    def worker(n):
+        for i in range(writes):
+            fs_backend.write(f"bench{n}", [(f"app{i % 16}", payload)])
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    before = durable.stats()
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    after = durable.stats()
+    return elapsed, after["flushes"] - before["flushes"]
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    parent = sys.argv[3] if len(sys.argv) > 3 else os.getcwd()
+
+    scratch = tempfile.mkdtemp(prefix="bench-durable-", dir=parent)
+    os.chdir(scratch)
+    try:
+        total = threads * writes
+        print(f"{threads} threads x {writes} writes in {scratch}")
+        for label, group_commit in (("fsync per write", False), ("group commit", True)):
+            elapsed, flushes = run(threads, writes, group_commit)
+            print(f"  {label:<16}: {total / elapsed:8.1f} writes/s  {flushes:6d} flushes")
+        print(f"  group commit window {config.GROUP_COMMIT_WINDOW_MS} ms, syncfs "
+              f"{'available' if durable._syncfs else 'unavailable (per-file fsync)'}")
+    finally:
+        os.chdir(parent)
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Requests/second and latency of server.py under many concurrent clients:
+the asyncio server against the original blocking accept loop, and the
+asyncio server over framed connections (one per client, kept open).
+
+Each server runs as a subprocess in a scratch directory on its own port.
+Every client thread retrieves a stored payload, opening a connection
+per request unless framed. With --slow, one extra client connects and sits idle for
+a second per connection, which stalls everybody behind it on the blocking
+loop.
+
+Usage: python3 benchmarks/bench_tcp_server.py [clients] [requests_per_client] [--slow]
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from lib import network, protocol
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def prepare(scratch):
+    code = (
+        "from lib import auth, storage, protocol;"
+        "auth.register_user('bench', 'pw');"
+        "storage.store_payload('bench', 'app', 'pw', protocol.create_payload('me', 'x' * 600))"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=scratch, check=True,
+                   env={**os.environ, "PYTHONPATH": ROOT})
+
+def start_server(scratch, port, blocking):
+    args = [sys.executable, os.path.join(ROOT, "server.py")] + (["--blocking"] if blocking else [])
+    proc = subprocess.Popen(args, cwd=scratch, stdout=subprocess.DEVNULL,
+                            env={**os.environ, "PYTHONPATH": ROOT, "PAYLOAD_PORT": str(port)})
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def retrieve(port):
+    request = protocol.create_retrieve_request("bench", "app", "pw").encode("utf-8")
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(request)
+        data = network.receive_all(s)
+    if not data.startswith(b"{"):
+        raise RuntimeError(data[:80])
+
+def retrieve_framed(connection):
+    request = protocol.create_retrieve_request("bench", "app", "pw").encode("utf-8")
+    if not connection.request(request).startswith(b"{"):
+        raise RuntimeError("bad response")
+
+def slow_client(port, stop):
+    while not stop.is_set():
+        try:
+            with socket.create_connection(("127.0.0.1", port)) as s:
+                time.sleep(1.0)
+                s.sendall(protocol.create_retrieve_request("bench", "app", "pw").encode("utf-8"))
+                network.receive_all(s)
+        except OSError:
+            pass
+
+def run(port, clients, requests, slow, framed):
+    latencies = []
+    lock = threading.Lock()
+    errors = []
+
+    def client():
+        mine = []
+        connection = network.Connection(port=port) if framed else None
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                if framed:
+                    retrieve_framed(connection)
+                else:
+                    retrieve(port)
+            except Exception as e:
+                errors.append(e)
+            mine.append(time.perf_counter() - start)
+        if connection:
+            connection.close()
+        with lock:
+            latencies.extend(mine)
+
+    stop = threading.Event()
+    if slow:
+        threading.Thread(target=slow_client, args=(port, stop), daemon=True).start()
+        time.sleep(0.1)
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    latencies.sort()
+    return elapsed, latencies, len(errors)
+
+if __name__ == "__main__":
+    positional = [a for a in sys.argv[1:] if not a.startswith("--")]
+    clients = int(positional[0]) if positional else 100
+    requests = int(positional[1]) if len(positional) > 1 else 20
+    slow = "--slow" in sys.argv
+
+    scratch = tempfile.mkdtemp(prefix="bench-tcp-")
+    try:
+        prepare(scratch)
+        print(f"{clients} clients x {requests} requests{' + 1 slow client' if slow else ''}")
+        for label, blocking, framed in (("blocking loop", True, False), ("asyncio", False, False),
+                                        ("asyncio framed", False, True)):
+            port = free_port()
+            proc = start_server(scratch, port, blocking)
+            try:
+                elapsed, latencies, errors = run(port, clients, requests, slow, framed)
+            finally:
+                proc.terminate()
+                proc.wait()
+            total = len(latencies)
+            p50 = latencies[total // 2] * 1000
+            p99 = latencies[min(total - 1, int(total * 0.99))] * 1000
+            print(f"  {label:<14}: {total / elapsed:8.1f} req/s  p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  errors {errors}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
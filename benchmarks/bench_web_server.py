@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Requests/second of the web interface on a KDF-bound request: POST
+/api/auth/login with a wrong password, which is never served from the
+auth cache, so each one runs a full PBKDF2 verification. The Flask
+development server against serve.py with 1, 2, ... up to the core count
+workers. Each client thread keeps one HTTP/1.1 connection open.
+
+Each server runs as a subprocess in a scratch directory on its own port.
+Throughput should grow with the worker count up to the number of cores,
+but that is untested: the runs so far were on a single-core machine,
+where every row is about the same.
+
+Usage: python3 benchmarks/bench_web_server.py [clients] [requests_per_client]
+"""
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+BODY = json.dumps({"username": "bench", "password": "wrong-password"})
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def prepare(scratch):
+    code = "from lib import auth; auth.register_user('bench', 'bench-password')"
+    subprocess.run([sys.executable, "-c", code], cwd=scratch, check=True,
+                   env={**os.environ, "PYTHONPATH": ROOT})
+
+def start_server(scratch, port, workers):
+    if workers:
+        args = [sys.executable, os.path.join(ROOT, "serve.py"), "--port", str(port), "--workers", str(workers)]
+    else:
+        code = f"import web_server; web_server.app.run(port={port}, threaded=True)"
+        args = [sys.executable, "-c", code]
+    proc = subprocess.Popen(args, cwd=scratch, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            env={**os.environ, "PYTHONPATH": ROOT})
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def run(port, clients, requests):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        mine = []
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                connection.request("POST", "/api/auth/login", body=BODY,
+                                   headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 401:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(e)
+                connection.close()
+            mine.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+
+    run_threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in run_threads:
+        t.start()
+    for t in run_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return elapsed, latencies, len(errors)
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    cores = os.cpu_count() or 1
+
+    scratch = tempfile.mkdtemp(prefix="bench-web-")
+    try:
+        prepare(scratch)
+        print(f"{clients} clients x {requests} logins, {cores} cores")
+        rows = [("flask dev server", 0)]
+        workers = 1
+        while workers <= cores:
+            rows.append((f"serve.py {workers} workers", workers))
+            workers *= 2
+        if rows[-1][1] != cores:
+            rows.append((f"serve.py {cores} workers", cores))
+        for label, workers in rows:
+            port = free_port()
+            proc = start_server(scratch, port, workers)
+            try:
+                run(port, clients, 1)  # warm-up: first request per connection / worker
+                elapsed, latencies, errors = run(port, clients, requests)
+            finally:
+                proc.terminate()
+                proc.wait()
+            total = len(latencies)
+            p50 = latencies[total // 2] * 1000
+            p99 = latencies[min(total - 1, int(total * 0.99))] * 1000
+            print(f"  {label:<20}: {total / elapsed:8.1f} req/s  p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  errors {errors}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
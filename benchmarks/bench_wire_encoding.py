@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Encode / decode cost and bytes on the wire of the JSON and binary message
+encodings (lib.protocol) for a single store, a 100-item STORE_BATCH and a
+100-app batch-retrieve response, with gpg and aead ciphertexts.
+
+Usage: python3 benchmarks/bench_wire_encoding.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import crypto, protocol
+
+SECRET = json.dumps({"password": "hunter2", "api_key": "0123456789abcdef" * 4, "notes": "x" * 200})
+PASSPHRASE = "benchmark-passphrase"
+
+def messages(ciphertext):
+    payload = protocol.create_payload("user@example.com", ciphertext)
+    stored = json.dumps(payload)
+    return {
+        "store": protocol.store_request("bench", "app", "pw", payload),
+        "batch store x100": protocol.batch_store_request("bench", "pw", [(f"app{i}", payload) for i in range(100)]),
+        "apps response x100": {f"app{i}": stored for i in range(100)},
+    }
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def measure(name, message, binary, iterations):
+    if name.startswith("apps response"):
+        body = protocol.encode_apps(message, binary)
+        encode = lambda: protocol.encode_apps(message, binary)
+        decode = lambda: protocol.parse_response(body)
+    else:
+        body = protocol.encode_request(message, binary)
+        encode = lambda: protocol.encode_request(message, binary)
+        decode = lambda: protocol.parse_message(body)
+    return len(body), timed(encode, iterations), timed(decode, iterations)
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    crypto.init_engine()
+    ciphertexts = {
+        "gpg": str(crypto.encrypt_secret(SECRET, PASSPHRASE, backend="gpg")),
+        "aead": str(crypto.encrypt_secret(SECRET, PASSPHRASE, backend="aead")),
+    }
+    for backend, ciphertext in ciphertexts.items():
+        print(f"{backend} ciphertext ({len(ciphertext)} chars)")
+        for name, message in messages(ciphertext).items():
+            for label, binary in (("json", False), ("binary", True)):
+                size, encode_us, decode_us = measure(name, message, binary, iterations)
+                print(f"  {name:<19} {label:<7} {size:8d} bytes  encode {encode_us:9.1f} us  decode {decode_us:9.1f} us")
@@ -1,7 +1,20 @@
 #!/usr/bin/env python3
 import sys
+import os
+import csv
 import json
-from lib import crypto, network, protocol, utils
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from lib import config, crypto, protocol, tcp_client, utils
+
+_client = None
+
+def get_client():
+    """One pooled client per process, so consecutive calls reuse connections."""
+    global _client
+    if _client is None:
+        _client = tcp_client.Client()
+    return _client
 
 def store_secret(username, user_password, app_name, app_username, secret_text, passphrase):
     # Encrypt secret
@@ -10,29 +23,24 @@ def store_secret(username, user_password, app_name, app_username, secret_text, p
         print("Encryption failed:", encrypted_data.status)
         return
 
-    message = protocol.create_store_payload(username, app_name, app_username, user_password, encrypted_data)
-
-    with network.create_connection() as s:
-        network.send_message(s, message.encode("utf-8"))
-        ack = network.receive_message(s, 1024)
-        print(f"Server response: {ack.decode()}")
+    payload = protocol.create_payload(app_username, encrypted_data)
+    try:
+        ack = get_client().store(username, user_password, app_name, payload)
+    except (PermissionError, tcp_client.ServerError) as e:
+        ack = e
+    print(f"Server response: {ack}")
 
 def retrieve_secret(username, user_password, app_name, passphrase):
-    request = protocol.create_retrieve_request(username, app_name, user_password)
-    with network.create_connection() as s:
-        network.send_message(s, request.encode("utf-8"))
-        data = network.receive_message(s)
-
-    if not data:
-        print("No payload received.")
+    try:
+        payload = get_client().retrieve(username, user_password, app_name)
+    except (PermissionError, tcp_client.ServerError) as e:
+        print(f"Server error: {e}")
         return None
 
-    decoded_data = data.decode("utf-8")
-    if decoded_data.startswith("ERR:"):
-        print(f"Server error: {decoded_data}")
+    if not payload:
+        print("No payload received.")
         return None
 
-    payload = json.loads(decoded_data)
     encrypted_text = payload["password"]
     app_username = payload.get("app_username", "N/A")
 
@@ -44,6 +52,124 @@ def retrieve_secret(username, user_password, app_name, passphrase):
         print("Decryption failed:", decrypted_data.status)
         return None
 
+def batch_retrieve(username, user_password, passphrase, app_names):
+    try:
+        payloads = get_client().retrieve_many(username, user_password, app_names)
+    except (PermissionError, tcp_client.ServerError) as e:
+        print(f"Server error: {e}")
+        return None
+
+    def decrypt(app_name):
+        payload = payloads.get(app_name)
+        if not payload:
+            return app_name, None, "No secret found"
+        decrypted_data = crypto.decrypt_secret(payload["password"], passphrase)
+        if not decrypted_data.ok:
+            return app_name, None, f"Decryption failed: {decrypted_data.status}"
+        return app_name, (decrypted_data.data.decode(), payload.get("app_username", "N/A")), None
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=config.BATCH_WORKERS) as pool:
+        for app_name, result, error in pool.map(decrypt, app_names):
+            if error:
+                print(f"{app_name}: {error}")
+            else:
+                print(f"{app_name}: Retrieved secret for {result[1]}:", result[0])
+            results[app_name] = result
+    return results
+
+def _read_records(path):
+    """Yields (app_name, app_username, secret_text) from a JSONL or CSV export."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield row["app_name"], row.get("app_username", ""), row["secret"]
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            secret = record["secret"]
+            if not isinstance(secret, str):
+                secret = json.dumps(secret, indent=2)
+            yield record["app_name"], record.get("app_username", ""), secret
+
+_import_passphrase = None
+
+def _init_import_worker(passphrase):
+    global _import_passphrase
+    _import_passphrase = passphrase
+    # Worker-local cache: each process derives the (aead) key once, not once per record
+    config.KEY_CACHE_ENABLED = True
+
+def _encrypt_record(record):
+    app_name, app_username, secret_text = record
+    encrypted_data = crypto.encrypt_secret(secret_text, _import_passphrase, scope="import")
+    if not encrypted_data.ok:
+        raise ValueError(f"{app_name}: encryption failed: {encrypted_data.status}")
+    return app_name, protocol.create_payload(app_username, encrypted_data)
+
+def _save_import_state(state_path, done):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"done": done}, f)
+    os.replace(tmp_path, state_path)
+
+def import_secrets(username, user_password, passphrase, path, batch_size=100):
+    """
+    Streams records from a JSONL/CSV file, encrypts them on all cores and
+    sends them in pipelined batches over one connection. Progress is checkpointed to
+    <path>.import-state so an interrupted import resumes where it stopped.
+    """
+    state_path = path + ".import-state"
+    done = 0
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            done = json.load(f)["done"]
+        print(f"Resuming import after {done} records")
+
+    records = itertools.islice(_read_records(path), done, None)
+
+    def submit_next_batch(pool):
+        return [pool.submit(_encrypt_record, record) for record in itertools.islice(records, batch_size)]
+
+    with ProcessPoolExecutor(initializer=_init_import_worker, initargs=(passphrase,)) as pool, \
+            get_client().connection() as connection:
+        pending = submit_next_batch(pool)
+        in_flight = None  # (request id, record count) of the batch awaiting its response
+        while pending or in_flight:
+            sent = None
+            if pending:
+                items = [future.result() for future in pending]
+                # Encrypt the next batch while this one is on the wire
+                pending = submit_next_batch(pool)
+                request = protocol.batch_store_request(username, user_password, items)
+                # Pipelined: this batch goes out before the previous one is acknowledged
+                sent = (connection.send(request), len(items))
+            if in_flight:
+                request_id, count = in_flight
+                response = protocol.parse_response(connection.receive(request_id)) or {"error": "Connection closed"}
+                if isinstance(response, str):
+                    response = {"error": response}
+                if "error" in response:
+                    print(f"\nServer error: {response['error']}")
+                    return False
+                for error in response["errors"]:
+                    print(f"\n{error['app']}: {error['error']}")
+
+                done += count
+                _save_import_state(state_path, done)
+                print(f"\rImported {done} records", end="", flush=True)
+            in_flight = sent
+
+    print()
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"Import complete: {done} records")
+    return True
+
 def update_secret(username, user_password, app_name, passphrase, key_path, value):
     # 1. Retrieve existing secret
     print("Retrieving existing secret...")
@@ -76,6 +202,38 @@ def update_secret(username, user_password, app_name, passphrase, key_path, value
     print("Storing updated secret...")
     store_secret(username, user_password, app_name, app_username, new_json_str, passphrase)
 
+def _load_operations(arg):
+    # Inline JSON, @file, or - for stdin
+    if arg == "-":
+        return json.load(sys.stdin)
+    if arg.startswith("@"):
+        with open(arg[1:]) as f:
+            return json.load(f)
+    return json.loads(arg)
+
+def patch_secret(username, user_password, app_name, passphrase, operations):
+    """Applies several update operations with one retrieve/decrypt and one encrypt/store."""
+    result = retrieve_secret(username, user_password, app_name, passphrase)
+    if not result:
+        print("Cannot patch: Failed to retrieve or decrypt existing secret.")
+        return
+
+    current_json_str, app_username = result
+    try:
+        data = json.loads(current_json_str)
+    except json.JSONDecodeError:
+        data = {"raw_content": current_json_str}
+
+    try:
+        data = utils.apply_operations(data, operations)
+    except utils.PatchError as e:
+        print(f"Patch failed, secret unchanged: {e}")
+        return
+
+    new_json_str = json.dumps(data, indent=2)
+    print(f"Updated secret structure:\n{new_json_str}")
+    print("Storing updated secret...")
+    store_secret(username, user_password, app_name, app_username, new_json_str, passphrase)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -83,6 +241,9 @@ if __name__ == "__main__":
         print("  ./client.py store <username> <user_password> <app_name> <app_username> <passphrase> <secret_text>")
         print("  ./client.py retrieve <username> <user_password> <app_name> <passphrase>")
         print("  ./client.py update <username> <user_password> <app_name> <passphrase> <key_path> <value>")
+        print("  ./client.py patch <username> <user_password> <app_name> <passphrase> <operations_json|@file|->")
+        print("  ./client.py batch_retrieve <username> <user_password> <passphrase> <app_name> [<app_name> ...]")
+        print("  ./client.py import <username> <user_password> <passphrase> <file.jsonl|file.csv> [batch_size]")
         sys.exit(1)
 
     command = sys.argv[1].lower()
@@ -121,6 +282,43 @@ if __name__ == "__main__":
         value = sys.argv[7]
         update_secret(username, user_password, app_name, passphrase, key_path, value)
 
+    elif command == "patch":
+        if len(sys.argv) < 7:
+            print("Usage: ./client.py patch <username> <user_password> <app_name> <passphrase> <operations_json|@file|->")
+            print('  e.g. \'[{"op": "set", "path": "db.port", "value": 5432}, {"op": "delete", "path": "old"}]\'')
+            sys.exit(1)
+        username = sys.argv[2]
+        user_password = sys.argv[3]
+        app_name = sys.argv[4]
+        passphrase = sys.argv[5]
+        try:
+            operations = _load_operations(sys.argv[6])
+        except (OSError, ValueError) as e:
+            print(f"Cannot read operations: {e}")
+            sys.exit(1)
+        patch_secret(username, user_password, app_name, passphrase, operations)
+
+    elif command == "batch_retrieve":
+        if len(sys.argv) < 6:
+            print("Usage: ./client.py batch_retrieve <username> <user_password> <passphrase> <app_name> [<app_name> ...]")
+            sys.exit(1)
+        username = sys.argv[2]
+        user_password = sys.argv[3]
+        passphrase = sys.argv[4]
+        app_names = sys.argv[5:]
+        batch_retrieve(username, user_password, passphrase, app_names)
+
+    elif command == "import":
+        if len(sys.argv) < 6:
+            print("Usage: ./client.py import <username> <user_password> <passphrase> <file.jsonl|file.csv> [batch_size]")
+            sys.exit(1)
+        username = sys.argv[2]
+        user_password = sys.argv[3]
+        passphrase = sys.argv[4]
+        path = sys.argv[5]
+        batch_size = int(sys.argv[6]) if len(sys.argv) > 6 else 100
+        import_secrets(username, user_password, passphrase, path, batch_size)
+
     else:
-        print("Unknown command. Use 'store', 'retrieve', or 'update'.")
+        print("Unknown command. Use 'store', 'retrieve', 'update', 'patch', 'batch_retrieve', or 'import'.")
 
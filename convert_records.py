@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Rewrites fs-backend secrets in the given record format.
+
+Usage:
+  ./convert_records.py <bin|json> [username ...]
+
+"bin" turns every db/<user>/<app>/secret.json into a compact secret.bin
+(see lib/record.py); "json" converts back. Payloads are not decrypted.
+Set RECORD_FORMAT in lib/config.py (or PAYLOAD_RECORD_FORMAT) to match
+afterwards, or new writes will use the other format again.
+"""
+import json
+import os
+import sys
+from lib import fs_backend
+
+BATCH_SIZE = 500
+
+def convert_user(username, record_format):
+    target_name = fs_backend.FILENAMES[record_format]
+    names = [
+        entry["name"] for entry in fs_backend.list_apps(username)
+        if not os.path.exists(os.path.join("db", username, entry["name"], target_name))
+    ]
+    converted = 0
+    before = after = 0
+    for i in range(0, len(names), BATCH_SIZE):
+        items = []
+        for app_name in names[i:i + BATCH_SIZE]:
+            result = fs_backend.read(username, app_name)
+            if result is None:
+                continue
+            data, location = result
+            before += os.path.getsize(location)
+            items.append((app_name, json.loads(data)))
+        for app_name, location, error in fs_backend.write(username, items, record_format):
+            if error:
+                print(f"  {username}/{app_name}: {error}")
+            else:
+                after += os.path.getsize(location)
+                converted += 1
+    return converted, before, after
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in fs_backend.FILENAMES:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    record_format = sys.argv[1]
+    total = 0
+    for username in sys.argv[2:] or fs_backend.list_users():
+        converted, before, after = convert_user(username, record_format)
+        if converted:
+            print(f"{username}: {converted} apps, {before} -> {after} bytes")
+        total += converted
+    print(f"Converted {total} apps to {fs_backend.FILENAMES[record_format]}")
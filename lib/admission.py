@@ -0,0 +1,148 @@
+"""
+Admission control for CPU-heavy work: login password checks (PBKDF2),
+passphrase KDFs (scrypt) and gpg runs.
+
+Each kind of work has its own bounded pool: at most `workers` calls run at
+once and at most `queue` more wait for a slot. A call that finds the queue
+full, or waits longer than ADMISSION_QUEUE_TIMEOUT, raises Overloaded at
+once instead of tying up a server thread, and one client address may hold
+at most `per_peer` of a pool's slots and queue places (TooManyRequests).
+The web server answers these with 503 / 429 and Retry-After. A login storm
+thus fills the auth pool's few slots and is turned away, while requests of
+logged-in users (no PBKDF2, see lib.sessions) keep their threads and their
+scrypt work keeps its own pool.
+
+Work runs on the calling thread once admitted, so there is no hand-off
+cost. Limits are per process; pre-fork workers each have their own.
+Only threads serving a web request are subject to it: the web server
+tags them with the client address (set_peer()). Command-line tools, the
+TCP server (loopback, bounded by its own thread pool) and helper threads
+are not; work a request hands to helper threads is admitted by the
+request thread holding the slot for it.
+
+    with admission.KDF.slot():
+        key = kdf.derive(password)
+"""
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from . import config
+
+_local = threading.local()
+
+class Overloaded(Exception):
+    """The pool's queue is full; try again after `retry_after` seconds."""
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TooManyRequests(Overloaded):
+    """This client already holds its share of the pool."""
+    status = 429
+
+def set_peer(address):
+    """
+    Subjects this thread's KDF / gpg work to admission control on behalf of
+    a client address (None: no per-peer cap).
+    """
+    _local.admitted = True
+    _local.peer = address
+
+class Pool:
+    def __init__(self, name, workers, queue, per_peer):
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self.per_peer = per_peer
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._peers = Counter()
+        self._active = 0
+        self._waiting = 0
+        self._held = threading.local()  # nested slots on one thread don't count twice
+        self._service_time = 0.0        # moving average, seconds
+        self._stats = {"admitted": 0, "rejected": 0, "rejected_peer": 0, "timeouts": 0}
+        self._max_waiting = 0
+
+    def _retry_after(self):
+        # Seconds until the current backlog would have drained, at least 1
+        backlog = (self._active + self._waiting) / self.workers
+        return max(1, math.ceil(backlog * self._service_time))
+
+    @contextmanager
+    def slot(self):
+        """Holds one of the pool's slots for the block; raises Overloaded / TooManyRequests."""
+        if (not config.ADMISSION_CONTROL or not getattr(_local, "admitted", False)
+                or getattr(self._held, "depth", 0)):
+            yield
+            return
+
+        address = _local.peer
+        with self._lock:
+            if address is not None and self._peers[address] >= self.per_peer:
+                self._stats["rejected_peer"] += 1
+                raise TooManyRequests(f"Too many concurrent {self.name} requests from {address}",
+                                      self._retry_after())
+            if self._active + self._waiting >= self.workers + self.queue:
+                self._stats["rejected"] += 1
+                raise Overloaded(f"Server busy ({self.name} queue full)", self._retry_after())
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+            if address is not None:
+                self._peers[address] += 1
+
+        acquired = self._slots.acquire(timeout=config.ADMISSION_QUEUE_TIMEOUT)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._active += 1
+                self._stats["admitted"] += 1
+            else:
+                self._stats["timeouts"] += 1
+                self._release_peer(address)
+        if not acquired:
+            raise Overloaded(f"Server busy ({self.name} queue timed out)", self._retry_after())
+
+        start = time.perf_counter()
+        self._held.depth = 1
+        try:
+            yield
+        finally:
+            self._held.depth = 0
+            elapsed = time.perf_counter() - start
+            self._slots.release()
+            with self._lock:
+                self._active -= 1
+                self._release_peer(address)
+                self._service_time += (elapsed - self._service_time) * 0.2
+
+    def _release_peer(self, address):
+        if address is not None:
+            self._peers[address] -= 1
+            if not self._peers[address]:
+                del self._peers[address]
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                workers=self.workers,
+                queue_limit=self.queue,
+                active=self._active,
+                waiting=self._waiting,
+                max_waiting=self._max_waiting,
+                peers=len(self._peers),
+                avg_ms=round(self._service_time * 1000, 3),
+            )
+
+AUTH = Pool("auth", config.AUTH_WORKERS, config.AUTH_QUEUE, config.AUTH_PER_PEER)
+KDF = Pool("kdf", config.KDF_WORKERS, config.KDF_QUEUE, config.KDF_PER_PEER)
+GPG = Pool("gpg", config.GPG_WORKERS, config.GPG_QUEUE, config.GPG_PER_PEER)
+
+def stats():
+    """Per-pool queue depths and admission counters."""
+    return {pool.name: pool.stats() for pool in (AUTH, KDF, GPG)}
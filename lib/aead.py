@@ -0,0 +1,189 @@
+"""
+In-process authenticated encryption for secrets.
+
+Ciphertext layout (all integers big-endian):
+
+    magic "PPS" | version | alg | kdf | log2(N) | r | p | salt[16] | nonce[12] | ciphertext+tag
+
+The whole header is bound to the ciphertext as associated data, so the
+KDF parameters cannot be tampered with. Stored as text with TEXT_PREFIX.
+
+Derived keys can be cached per session scope (config.KEY_CACHE_ENABLED).
+A key belongs to one salt, so unlocking several secrets costs one scrypt
+per distinct salt among them: while a key is cached, new encryptions in
+the same scope reuse its salt (every ciphertext still gets a fresh random
+nonce), so secrets written during one session share a single scrypt, but
+secrets written in different sessions each need their own. Callers get
+copies of cached keys; the cached bytearray is zeroed when it is dropped.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from . import admission, config, metrics
+
+MAGIC = b"PPS"
+VERSION = 1
+TEXT_PREFIX = "pps1:"
+
+ALG_CHACHA20_POLY1305 = 1
+ALG_AES_256_GCM = 2
+KDF_SCRYPT = 1
+
+_HEADER = struct.Struct(">3sBBBBBB16s12s")
+HEADER_SIZE = _HEADER.size
+
+# Bounds on scrypt parameters read from stored data, so a corrupt or
+# hostile header can't ask for 2**255 iterations or terabytes of memory
+MAX_SCRYPT_MEMORY = 256 * 1024 * 1024   # 128 * r * N bytes
+MAX_SCRYPT_P = 16
+
+_CIPHERS = {
+    ALG_CHACHA20_POLY1305: ChaCha20Poly1305,
+    ALG_AES_256_GCM: AESGCM,
+}
+_ALG_NAMES = {
+    "chacha20-poly1305": ALG_CHACHA20_POLY1305,
+    "aes-256-gcm": ALG_AES_256_GCM,
+}
+
+# (scope, passphrase fingerprint, salt, params) -> (key, expiry)
+_fingerprint_key = os.urandom(32)
+_key_cache = OrderedDict()
+# (scope, passphrase fingerprint, params) -> salt of the newest cached key
+_encrypt_salts = {}
+_key_cache_lock = threading.Lock()
+_key_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+class DecryptionError(Exception):
+    pass
+
+def check_params(log_n, r, p):
+    """Raises DecryptionError unless (log_n, r, p) are scrypt parameters within the bounds above."""
+    if not (1 <= log_n < 64 and r >= 1 and 1 <= p <= MAX_SCRYPT_P
+            and 128 * r * 2 ** log_n <= MAX_SCRYPT_MEMORY):
+        raise DecryptionError(f"scrypt parameters out of range (log2 N={log_n}, r={r}, p={p})")
+
+def derive_key(passphrase, salt, log_n, r, p):
+    kdf = Scrypt(salt=salt, length=32, n=2 ** log_n, r=r, p=p)
+    with admission.KDF.slot(), metrics.stage("aead_kdf"):
+        return kdf.derive(passphrase.encode("utf-8"))
+
+def _caching(scope):
+    return config.KEY_CACHE_ENABLED and scope is not None
+
+def _fingerprint(passphrase):
+    return hmac.new(_fingerprint_key, passphrase.encode("utf-8"), hashlib.sha256).digest()
+
+def _wipe(key):
+    key[:] = bytes(len(key))
+
+def _drop(cache_key):
+    key, _ = _key_cache.pop(cache_key)
+    _wipe(key)
+    salt_key = (cache_key[0], cache_key[1], cache_key[3])
+    if _encrypt_salts.get(salt_key) == cache_key[2]:
+        del _encrypt_salts[salt_key]
+
+def _get_key(scope, passphrase, salt, params):
+    if not _caching(scope):
+        return derive_key(passphrase, salt, *params)
+
+    cache_key = (scope, _fingerprint(passphrase), salt, params)
+    now = time.monotonic()
+    with _key_cache_lock:
+        entry = _key_cache.get(cache_key)
+        if entry is not None:
+            if entry[1] > now:
+                _key_cache.move_to_end(cache_key)
+                _key_cache_stats["hits"] += 1
+                # A copy: eviction or logout zeroes the cached key in place
+                return bytes(entry[0])
+            _drop(cache_key)
+        _key_cache_stats["misses"] += 1
+
+    key = derive_key(passphrase, salt, *params)
+    with _key_cache_lock:
+        if cache_key in _key_cache:
+            _drop(cache_key)
+        _key_cache[cache_key] = (bytearray(key), now + config.KEY_CACHE_TTL)
+        _encrypt_salts[(scope, cache_key[1], params)] = salt
+        while len(_key_cache) > config.KEY_CACHE_SIZE:
+            _drop(next(iter(_key_cache)))
+            _key_cache_stats["evictions"] += 1
+    return key
+
+def _encrypt_salt(scope, passphrase, params):
+    if _caching(scope):
+        with _key_cache_lock:
+            salt = _encrypt_salts.get((scope, _fingerprint(passphrase), params))
+        if salt is not None:
+            return salt
+    return os.urandom(16)
+
+def cached_key(passphrase, salt, params, scope=None):
+    """
+    scrypt key for (passphrase, salt, (log_n, r, p)), via the session key
+    cache when enabled. Raises DecryptionError for out-of-range parameters.
+    """
+    check_params(*params)
+    return _get_key(scope, passphrase, salt, params)
+
+def wipe_keys(scope=None):
+    """Zeroes and forgets cached keys for one scope (e.g. on logout), or all of them."""
+    with _key_cache_lock:
+        for cache_key in [k for k in _key_cache if scope is None or k[0] == scope]:
+            _drop(cache_key)
+
+def key_cache_stats():
+    with _key_cache_lock:
+        stats = dict(_key_cache_stats)
+        stats["size"] = len(_key_cache)
+    return stats
+
+def is_aead_text(text):
+    return text.startswith(TEXT_PREFIX)
+
+def encrypt(plaintext, passphrase, scope=None):
+    alg = _ALG_NAMES[config.AEAD_CIPHER]
+    params = (config.AEAD_SCRYPT_LOG_N, config.AEAD_SCRYPT_R, config.AEAD_SCRYPT_P)
+    salt = _encrypt_salt(scope, passphrase, params)
+    nonce = os.urandom(12)
+    header = _HEADER.pack(MAGIC, VERSION, alg, KDF_SCRYPT, *params, salt, nonce)
+    key = _get_key(scope, passphrase, salt, params)
+    return header + _CIPHERS[alg](key).encrypt(nonce, plaintext, header)
+
+def parse_header(blob):
+    if len(blob) < HEADER_SIZE:
+        raise DecryptionError("ciphertext too short")
+    magic, version, alg, kdf, log_n, r, p, salt, nonce = _HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise DecryptionError("unknown ciphertext format")
+    if alg not in _CIPHERS or kdf != KDF_SCRYPT:
+        raise DecryptionError("unsupported cipher or KDF")
+    check_params(log_n, r, p)
+    return alg, log_n, r, p, salt, nonce
+
+def decrypt(blob, passphrase, scope=None):
+    alg, log_n, r, p, salt, nonce = parse_header(blob)
+    key = _get_key(scope, passphrase, salt, (log_n, r, p))
+    try:
+        return _CIPHERS[alg](key).decrypt(nonce, blob[HEADER_SIZE:], blob[:HEADER_SIZE])
+    except InvalidTag:
+        raise DecryptionError("bad passphrase or corrupted ciphertext")
+
+def to_text(blob):
+    return TEXT_PREFIX + base64.b64encode(blob).decode("ascii")
+
+def from_text(text):
+    try:
+        return base64.b64decode(text[len(TEXT_PREFIX):], validate=True)
+    except ValueError:
+        raise DecryptionError("malformed ciphertext encoding")
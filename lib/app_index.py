@@ -0,0 +1,101 @@
+"""
+Sorted, paginated views over a user's app metadata for /api/apps.
+
+One sorted list of (sort key, name) per (user, sort field) is kept in
+memory and rebuilt only when the storage snapshot version changes. Pages are
+addressed by an opaque cursor holding the last (sort key, name) served,
+so paging is stable while apps are added or removed.
+"""
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from . import config, storage
+
+SORT_KEYS = {
+    "name": lambda entry: entry["name"],
+    "modified": lambda entry: entry["modified"],
+    "size": lambda entry: entry["size"],
+}
+
+_lock = threading.Lock()
+# (username, sort) -> (snapshot version, sorted [(key, name), ...])
+_indexes = OrderedDict()
+
+def _sorted_keys(username, sort):
+    version, apps = storage.snapshot(username)
+    cache_key = (username, sort)
+    with _lock:
+        cached = _indexes.get(cache_key)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(cache_key)
+            return cached[1], apps
+
+    keys = sorted((SORT_KEYS[sort](entry), name) for name, entry in apps.items())
+    with _lock:
+        _indexes[cache_key] = (version, keys)
+        _indexes.move_to_end(cache_key)
+        while len(_indexes) > config.APP_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return keys, apps
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        key, name = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return key, name
+
+def query(username, sort="name", order="asc", prefix=None, contains=None, cursor=None, limit=None):
+    """
+    Returns (entries, next_cursor, total). `prefix` matches the start of the
+    app name (case-sensitive), `contains` a case-insensitive substring.
+    A limit of None returns every match.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort field: {sort}")
+    keys, apps = _sorted_keys(username, sort)
+
+    lo, hi = 0, len(keys)
+    if prefix and sort == "name":
+        # Names sharing a prefix are contiguous in the name index
+        lo = bisect_left(keys, (prefix,))
+        hi = bisect_left(keys, (prefix + "\U0010ffff",))
+    needle = contains.lower() if contains else None
+
+    def matches(name):
+        if prefix and not name.startswith(prefix):
+            return False
+        return needle is None or needle in name.lower()
+
+    filtered = bool(needle or (prefix and sort != "name"))
+    total = sum(1 for _, name in keys[lo:hi] if matches(name)) if filtered else hi - lo
+
+    descending = order == "desc"
+    if cursor:
+        position = tuple(decode_cursor(cursor))
+        try:
+            start = bisect_left(keys, position) - 1 if descending else bisect_right(keys, position)
+        except TypeError:
+            raise ValueError("Cursor does not match sort field")
+    else:
+        start = hi - 1 if descending else lo
+    step = -1 if descending else 1
+    start = min(max(start, lo - 1), hi)
+
+    page = []
+    next_cursor = None
+    i = start
+    while lo <= i < hi:
+        key, name = keys[i]
+        if matches(name):
+            if limit is not None and len(page) == limit:
+                next_cursor = encode_cursor(keys[i - step])
+                break
+            page.append(apps[name])
+        i += step
+    return page, next_cursor, total
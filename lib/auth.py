@@ -1,8 +1,21 @@
 import os
 import json
 import base64
+import hmac
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from . import admission, config, durable, metrics
+
+# Cache of successful verifications: (username, password tag) -> (auth.json signature, expiry).
+# The tag is an HMAC under a per-process key, so plaintext passwords never sit in the cache.
+_cache_key = os.urandom(32)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
 def hash_password(password, salt=None):
     if salt is None:
@@ -14,48 +27,146 @@ def hash_password(password, salt=None):
         salt=salt,
         iterations=100000,
     )
-    key = kdf.derive(password.encode())
+    with admission.AUTH.slot(), metrics.stage("auth_kdf"):
+        key = kdf.derive(password.encode())
     return key, salt
 
 def verify_password(stored_hash_b64, stored_salt_b64, password_input):
     salt = base64.b64decode(stored_salt_b64)
     derived_key, _ = hash_password(password_input, salt)
     stored_key = base64.b64decode(stored_hash_b64)
-    return derived_key == stored_key
+    return hmac.compare_digest(derived_key, stored_key)
 
-def save_auth(username, password):
-    auth_dir = os.path.join("db", username)
-    os.makedirs(auth_dir, exist_ok=True)
-    
-    auth_file = os.path.join(auth_dir, "auth.json")
-    
-    # Generate new hash
+def _password_tag(password):
+    return hmac.new(_cache_key, password.encode(), hashlib.sha256).digest()
+
+def _file_signature(st):
+    # Any rewrite of auth.json (new salt, new password) changes at least one of these
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _cache_lookup(key, signature):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            cached_signature, expires = entry
+            if cached_signature == signature and expires > time.monotonic():
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return True
+            del _cache[key]
+        _cache_stats["misses"] += 1
+        return False
+
+def _cache_store(key, signature):
+    with _cache_lock:
+        _cache[key] = (signature, time.monotonic() + config.AUTH_CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > config.AUTH_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _cache_stats["evictions"] += 1
+
+def invalidate_cache(username=None):
+    """Drops cached verifications for one user, or for everyone if username is None."""
+    with _cache_lock:
+        if username is None:
+            _cache.clear()
+            return
+        for key in [k for k in _cache if k[0] == username]:
+            del _cache[key]
+
+def cache_stats():
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["size"] = len(_cache)
+    return stats
+
+def _auth_path(username):
+    return os.path.join("db", username, "auth.json")
+
+def _auth_record(password):
     key, salt = hash_password(password)
-    
     # Store as base64
-    data = {
+    return {
         "hash": base64.b64encode(key).decode('utf-8'),
         "salt": base64.b64encode(salt).decode('utf-8'),
         "method": "pbkdf2:sha256:100000"
     }
-    
-    with open(auth_file, "w") as f:
-        json.dump(data, f)
+
+def save_auth(username, password):
+    """Unconditionally (re)writes the user's credentials. Prefer register_user/change_password."""
+    auth_dir = os.path.join("db", username)
+    os.makedirs(auth_dir, exist_ok=True)
+
+    data = _auth_record(password)
+    durable.atomic_write(_auth_path(username), json.dumps(data))
+    invalidate_cache(username)
+    return True
+
+def credentials_signature(username):
+    """Changes whenever the user's password (auth.json) is rewritten; None if there is no such user."""
+    try:
+        return _file_signature(os.stat(_auth_path(username)))
+    except OSError:
+        return None
+
+def user_exists(username):
+    return os.path.exists(_auth_path(username))
+
+def register_user(username, password):
+    """Creates a new account. Returns False if the user already exists."""
+    auth_dir = os.path.join("db", username)
+    os.makedirs(auth_dir, exist_ok=True)
+
+    data = _auth_record(password)
+    # Exclusive create so two concurrent registrations can't overwrite each other
+    if not durable.atomic_create(_auth_path(username), json.dumps(data)):
+        return False
+    invalidate_cache(username)
     return True
 
+def _verify_legacy(data, password):
+    # Pre-PBKDF2 accounts stored a bare, unsalted SHA-256 hex digest
+    digest = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(digest, data.get("hash", ""))
+
 def check_auth(username, password):
-    auth_file = os.path.join("db", username, "auth.json")
-    if not os.path.exists(auth_file):
+    auth_file = _auth_path(username)
+    try:
+        st = os.stat(auth_file)
+    except OSError:
         return False # User does not exist
-        
+
+    key = (username, _password_tag(password))
+    signature = _file_signature(st)
+    if _cache_lookup(key, signature):
+        return True
+
     try:
         with open(auth_file, "r") as f:
             data = json.load(f)
-        
-        # Backward compatibility check (migrating old users could go here, but for now we just fail safe)
+
         if "salt" not in data:
-            return False 
-            
-        return verify_password(data["hash"], data["salt"], password)
+            # One-time migration: the first successful login of a legacy account
+            # rewrites auth.json in the salted PBKDF2 format.
+            if not _verify_legacy(data, password):
+                return False
+            save_auth(username, password)
+            signature = _file_signature(os.stat(auth_file))
+        elif not verify_password(data["hash"], data["salt"], password):
+            return False
+    except admission.Overloaded:
+        raise
     except Exception:
         return False
+
+    _cache_store(key, signature)
+    return True
+
+def verify_user(username, password):
+    return check_auth(username, password)
+
+def change_password(username, old_password, new_password):
+    """Replaces the password after verifying the old one. Returns False on bad credentials."""
+    if not check_auth(username, old_password):
+        return False
+    return save_auth(username, new_password)
@@ -1,5 +1,132 @@
 import os
 
 HOST = "127.0.0.1"
-PORT = 65432
+PORT = int(os.environ.get("PAYLOAD_PORT", "65432"))
 GNUPG_HOME = os.path.expanduser("~/.gnupg")
+
+# Verified-credential cache (lib.auth)
+AUTH_CACHE_SIZE = 256       # max cached (user, password) verifications
+AUTH_CACHE_TTL = 300        # seconds a successful verification is trusted
+
+# Web sessions (lib.sessions): server-side, the browser only holds a token
+SESSIONS_PATH = os.path.join("db", "sessions.sqlite3")
+SESSION_IDLE_TIMEOUT = 30 * 60      # seconds without a request before logout
+SESSION_MAX_AGE = 12 * 3600         # seconds after login, however active
+SESSION_MAX_COUNT = 256             # least recently used sessions beyond this are dropped
+SESSION_TOUCH_INTERVAL = 60         # seconds between last-use writes to the table
+SESSION_COOKIE = "payload_session"
+
+# Admission control for web requests (lib.admission), per process. Every
+# waiting call holds a server thread, so keep workers + queue of the auth
+# and KDF pools below WEB_THREADS: a login storm then can't take the threads
+# logged-in users need. Logins and secret passphrases have separate pools,
+# so a login storm can't shed logged-in users' scrypt work either.
+# PAYLOAD_ADMISSION_CONTROL=0 turns it off (benchmarks).
+ADMISSION_CONTROL = os.environ.get("PAYLOAD_ADMISSION_CONTROL", "1") == "1"
+AUTH_WORKERS = 1            # concurrent PBKDF2 password checks (login, registration)
+AUTH_QUEUE = 1              # more that may wait; beyond this: 503
+AUTH_PER_PEER = 1           # slots + queue places one client address may hold (429)
+KDF_WORKERS = 1             # concurrent scrypt derivations of secret passphrases (aead)
+KDF_QUEUE = 1
+KDF_PER_PEER = 1
+GPG_WORKERS = 2             # concurrent gpg encrypt/decrypt runs
+GPG_QUEUE = 8
+GPG_PER_PEER = 4
+ADMISSION_QUEUE_TIMEOUT = 5 # seconds a call may wait for a slot before 503
+
+# Metrics (lib.metrics): latency histograms per route / TCP command and per
+# internal stage, served at /api/metrics. Numbers are per process, labelled
+# worker=<pid>; serve.py's workers share theirs through METRICS_SHARED_DIR,
+# so any worker's /api/metrics reports all of them.
+METRICS_ENABLED = os.environ.get("PAYLOAD_METRICS", "1") == "1"
+METRICS_SLOW_REQUEST = 2.0      # seconds; slower requests print their stage breakdown (0 = never)
+METRICS_SHARED_DIR = os.path.join("db", ".metrics")
+METRICS_SHARE_INTERVAL = 2      # seconds between a worker's publications (scrapes lag by this much)
+
+# Crypto backend for new ciphertexts: "gpg" (armored PGP via the gpg binary)
+# or "aead" (in-process scrypt + AEAD, see lib.aead). Existing ciphertexts of
+# either kind always decrypt; secrets move to the configured backend when
+# they are next updated.
+CRYPTO_BACKEND = os.environ.get("PAYLOAD_CRYPTO_BACKEND", "gpg")
+AEAD_CIPHER = "chacha20-poly1305"   # or "aes-256-gcm"
+AEAD_SCRYPT_LOG_N = 15              # N = 2**15, r = 8 -> 32 MiB per derivation (at most
+                                    # aead.MAX_SCRYPT_MEMORY: larger ones won't decrypt)
+AEAD_SCRYPT_R = 8
+AEAD_SCRYPT_P = 1
+
+# Session-scoped cache of passphrase-derived keys (aead backend only).
+# Opt-in: cached keys live in server memory until TTL, eviction or logout.
+# Keys are per salt: secrets encrypted during one session share a salt (one
+# scrypt unlocks them all), secrets from different sessions need one each.
+KEY_CACHE_ENABLED = False
+KEY_CACHE_TTL = 120         # seconds
+KEY_CACHE_SIZE = 32         # max derived keys held across all sessions
+
+# TCP server (server.py)
+SERVER_WORKERS = 8              # threads for storage / KDF work
+SERVER_MAX_PENDING = 64         # requests running or queued on those threads
+SERVER_BACKLOG = 128            # listen() backlog
+SERVER_READ_TIMEOUT = 30        # seconds to receive a request
+SERVER_WRITE_TIMEOUT = 30       # seconds to flush a response
+SERVER_SHUTDOWN_TIMEOUT = 10    # seconds in-flight requests get on shutdown
+SERVER_IDLE_TIMEOUT = 300       # seconds a framed connection may sit between requests
+SERVER_MAX_INFLIGHT = 32        # pipelined requests per framed connection
+SERVER_MAX_REQUEST = 64 * 1024 * 1024
+SERVER_METRICS_PORT = 0         # loopback HTTP port for the TCP server's /metrics; 0 = off
+
+# Client message encoding on framed connections: "json", or "binary" (used
+# when the server supports it): 30-45% fewer bytes, raw ciphertext, but more
+# CPU per message than the C json module (benchmarks/bench_wire_encoding.py)
+WIRE_ENCODING = os.environ.get("PAYLOAD_WIRE_ENCODING", "json")
+
+# Client library (lib.tcp_client)
+CLIENT_POOL_SIZE = 4            # idle connections kept per client
+CLIENT_IDLE_TIMEOUT = 240       # drop pooled connections idle this long (< SERVER_IDLE_TIMEOUT)
+CLIENT_CONNECT_TIMEOUT = 10     # seconds
+CLIENT_RETRIES = 1              # resends of a retrieve after a pooled connection turns out to be stale
+
+# Pre-fork web server (serve.py, lib.prefork). Scaling across cores is the
+# goal of WEB_WORKERS but has not been measured yet (single-core test box).
+WEB_WORKERS = int(os.environ.get("PAYLOAD_WEB_WORKERS", "0"))  # processes; 0 = one per core
+WEB_THREADS = 4                 # request threads per worker (gpg runs outside the GIL)
+WEB_KEEPALIVE = 5               # seconds an idle keep-alive connection is kept
+WEB_IO_TIMEOUT = 30             # seconds to receive a request / send a response block
+WEB_BACKLOG = 128               # listen() backlog
+WEB_GRACEFUL_TIMEOUT = 30       # seconds workers get to finish requests on stop/reload
+WEB_ACCESS_LOG = False          # print one line per request
+
+# Batch retrieval
+BATCH_WORKERS = 4           # concurrent decrypts per batch request
+BATCH_MAX_APPS = 200        # max apps accepted in one batch
+
+# Peer allowlist (web_server.restrict_access)
+PEER_CACHE_TTL = 2.0        # seconds before the ARP table is re-checked
+ALLOWED_CIDRS = []          # extra always-allowed ranges, e.g. ["192.168.43.0/24"]
+
+# /api/apps pagination
+APP_PAGE_MAX = 500          # largest page a client may request
+APP_INDEX_CACHE_SIZE = 64   # (user, sort field) indexes kept in memory
+
+# Storage backend: "fs" (db/<user>/<app>/secret.bin), "sqlite" (one WAL database)
+# or "log" (append-only per-user segments with version history)
+STORAGE_BACKEND = os.environ.get("PAYLOAD_STORAGE_BACKEND", "fs")
+SQLITE_PATH = os.path.join("db", "vault.sqlite3")
+# fs backend file format for new writes: "bin" (compact secret.bin, see
+# lib.record) or "json" (legacy secret.json). Both are always readable.
+RECORD_FORMAT = os.environ.get("PAYLOAD_RECORD_FORMAT", "bin")
+
+# Streaming blobs (lib.stream): plaintext bytes per authenticated chunk.
+# Memory per upload/download is about one chunk.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Log-structured backend
+LOG_SEGMENT_SIZE = 4 * 1024 * 1024  # roll to a new segment past this size
+LOG_RETENTION = 5                   # versions kept per app by compaction
+LOG_COMPACT_INTERVAL = 300          # seconds between compaction checks
+LOG_COMPACT_MIN_GARBAGE = 0.5       # compact once this fraction of the log is dead
+
+# Durable writes (lib.durable). Every write is atomic and fsynced; group commit
+# additionally batches concurrent writers into one syncfs() per window. syncfs
+# flushes the whole filesystem, so leave it off where other apps write heavily.
+GROUP_COMMIT = os.environ.get("PAYLOAD_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = 2  # how long the first writer waits for others
@@ -1,18 +1,129 @@
+import subprocess
+import threading
+import time
 import gnupg
-from . import config
+from . import admission, aead, config, metrics
 
-def get_gpg():
+# One GPG handle per process. Constructing gnupg.GPG runs `gpg --list-config`,
+# so building it per call doubled the number of subprocesses per operation.
+_gpg = None
+_gpg_lock = threading.Lock()
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+def _new_gpg():
     return gnupg.GPG(gnupghome=config.GNUPG_HOME)
 
-def encrypt_secret(secret_text, passphrase):
-    gpg = get_gpg()
-    return gpg.encrypt(
-        secret_text,
-        recipients=None,
-        symmetric=True,
-        passphrase=passphrase
-    )
-
-def decrypt_secret(encrypted_text, passphrase):
-    gpg = get_gpg()
-    return gpg.decrypt(encrypted_text, passphrase=passphrase)
+def init_engine():
+    """Probes gpg once and starts gpg-agent so the first real request doesn't pay for it."""
+    global _gpg
+    with _gpg_lock:
+        if _gpg is None:
+            _gpg = _new_gpg()
+            try:
+                subprocess.run(
+                    ["gpgconf", "--homedir", config.GNUPG_HOME, "--launch", "gpg-agent"],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10
+                )
+            except (OSError, subprocess.SubprocessError):
+                pass  # the agent is started on demand by gpg anyway
+    return _gpg
+
+def get_gpg():
+    if _gpg is None:
+        return init_engine()
+    return _gpg
+
+def _record(op, elapsed):
+    with _timings_lock:
+        stats = _timings.setdefault(op, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+    metrics.observe_stage(op.replace(".", "_"), elapsed)
+
+def timing_stats():
+    """Per-operation call counts and latencies (seconds) since startup."""
+    with _timings_lock:
+        return {
+            op: dict(stats, avg=stats["total"] / stats["count"])
+            for op, stats in _timings.items()
+        }
+
+class CryptResult:
+    """Result of the in-process backend, shaped like gnupg's Crypt (ok, status, data, str())."""
+
+    def __init__(self, ok, status, data=b"", text=""):
+        self.ok = ok
+        self.status = status
+        self.data = data
+        self._text = text
+
+    def __str__(self):
+        return self._text
+
+# The gpg backend derives its keys inside the gpg process (S2K), so the
+# session key cache only applies to the aead backend; gpg ignores `scope`.
+def _gpg_encrypt(secret_text, passphrase, scope=None):
+    with admission.GPG.slot():
+        return get_gpg().encrypt(
+            secret_text,
+            recipients=None,
+            symmetric=True,
+            passphrase=passphrase
+        )
+
+def _gpg_decrypt(encrypted_text, passphrase, scope=None):
+    with admission.GPG.slot():
+        return get_gpg().decrypt(encrypted_text, passphrase=passphrase)
+
+def _aead_encrypt(secret_text, passphrase, scope=None):
+    if isinstance(secret_text, str):
+        secret_text = secret_text.encode("utf-8")
+    blob = aead.encrypt(secret_text, passphrase, scope)
+    return CryptResult(True, "encryption ok", text=aead.to_text(blob))
+
+def _aead_decrypt(encrypted_text, passphrase, scope=None):
+    try:
+        data = aead.decrypt(aead.from_text(encrypted_text), passphrase, scope)
+    except aead.DecryptionError as e:
+        return CryptResult(False, f"decryption failed: {e}")
+    return CryptResult(True, "decryption ok", data=data)
+
+_BACKENDS = {
+    "gpg": (_gpg_encrypt, _gpg_decrypt),
+    "aead": (_aead_encrypt, _aead_decrypt),
+}
+
+def backend_for(encrypted_text):
+    """Names the backend that produced a stored ciphertext."""
+    return "aead" if aead.is_aead_text(encrypted_text) else "gpg"
+
+def admission_pool(backend):
+    """The admission pool whose slot a backend's encrypt / decrypt takes."""
+    return admission.KDF if backend == "aead" else admission.GPG
+
+def encrypt_secret(secret_text, passphrase, backend=None, scope=None):
+    """`scope` names the session whose derived keys may be cached (see config.KEY_CACHE_ENABLED)."""
+    backend = backend or config.CRYPTO_BACKEND
+    encrypt, _ = _BACKENDS[backend]
+    start = time.perf_counter()
+    result = encrypt(secret_text, passphrase, scope)
+    _record(f"{backend}.encrypt", time.perf_counter() - start)
+    return result
+
+def decrypt_secret(encrypted_text, passphrase, scope=None):
+    # Dispatch on the ciphertext itself so old PGP-armored secrets keep working
+    backend = backend_for(encrypted_text)
+    _, decrypt = _BACKENDS[backend]
+    start = time.perf_counter()
+    result = decrypt(encrypted_text, passphrase, scope)
+    _record(f"{backend}.decrypt", time.perf_counter() - start)
+    return result
+
+def wipe_key_cache(scope=None):
+    aead.wipe_keys(scope)
+
+def key_cache_stats():
+    return aead.key_cache_stats()
@@ -0,0 +1,115 @@
+"""
+Filesystem storage backend: one file per app, indexed by lib.manifest.
+New writes use config.RECORD_FORMAT: db/<user>/<app>/secret.bin (lib.record)
+or the legacy pretty-printed secret.json. Reads accept either. See
+lib.storage for the backend interface.
+"""
+import json
+import os
+from . import config, durable, manifest, record
+
+FILENAMES = {"bin": "secret.bin", "json": "secret.json"}
+
+def _secret_path(username, app_name, record_format):
+    return os.path.join("db", username, app_name, FILENAMES[record_format])
+
+def _serialize(payload, record_format):
+    if record_format == "bin":
+        return record.encode(payload)
+    return json.dumps(payload, indent=2)
+
+def _remove_other_formats(username, app_name, record_format):
+    for other in FILENAMES:
+        if other != record_format:
+            try:
+                os.remove(_secret_path(username, app_name, other))
+            except FileNotFoundError:
+                pass
+
+def write(username, items, record_format=None):
+    record_format = record_format or config.RECORD_FORMAT
+    dir_mtime = manifest.user_dir_mtime(username)
+    results = {}
+    staged = []
+    for app_name, payload in items:
+        # Ensure directory exists: db/username/app_name
+        dir_path = os.path.join("db", username, app_name)
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+        except OSError as e:
+            results[app_name] = (None, str(e))
+            continue
+        staged.append((app_name, payload, _secret_path(username, app_name, record_format)))
+
+    if staged:
+        # Temp file + rename, committed together: readers never see a partial file
+        try:
+            durable.atomic_write_many(
+                [(filename, _serialize(payload, record_format)) for _, payload, filename in staged]
+            )
+        except (OSError, record.RecordError) as e:
+            for app_name, _, _ in staged:
+                results[app_name] = (None, str(e))
+            staged = []
+        for app_name, _, filename in staged:
+            _remove_other_formats(username, app_name, record_format)
+            results[app_name] = (filename, None)
+        if staged:
+            manifest.record(username, staged, dir_mtime)
+    return [(app_name,) + results[app_name] for app_name, _ in items]
+
+def read(username, app_name):
+    file_path = _secret_path(username, app_name, "bin")
+    try:
+        with open(file_path, "rb") as f:
+            return json.dumps(record.decode(f.read())), file_path
+    except FileNotFoundError:
+        pass
+    file_path = _secret_path(username, app_name, "json")
+    try:
+        with open(file_path, "r") as f:
+            return f.read(), file_path
+    except FileNotFoundError:
+        return None
+
+def read_many(username, app_names):
+    results = {}
+    for app_name in app_names:
+        result = read(username, app_name)
+        results[app_name] = result[0] if result else None
+    return results
+
+def delete(username, app_name):
+    dir_mtime = manifest.user_dir_mtime(username)
+    removed = False
+    for record_format in FILENAMES:
+        try:
+            os.remove(_secret_path(username, app_name, record_format))
+            removed = True
+        except FileNotFoundError:
+            pass
+    if not removed:
+        return False
+    try:
+        os.rmdir(os.path.join("db", username, app_name))
+    except OSError:
+        pass  # directory holds other files
+    manifest.remove(username, [app_name], dir_mtime)
+    return True
+
+def snapshot(username):
+    return manifest.snapshot(username)
+
+def list_apps(username):
+    return manifest.list_apps(username)
+
+def metadata(username, app_name):
+    return manifest.get_entry(username, app_name)
+
+def list_users():
+    if not os.path.isdir("db"):
+        return []
+    return sorted(
+        name for name in os.listdir("db")
+        if not name.startswith(".") and os.path.isdir(os.path.join("db", name))
+    )
@@ -0,0 +1,536 @@
+"""
+Log-structured storage backend: every store appends a record to the
+user's active segment in db/<user>/log/, nothing is overwritten in place.
+See lib.storage for the backend interface.
+
+Record layout (big-endian):
+
+    magic "PPL1" | kind | version | time | app_len | data_len | crc32 | app | data
+
+kind is PUT (data = payload JSON) or DELETE (tombstone, no data). The
+crc covers the header fields and both bodies, so a record torn by a crash
+is detected on recovery and the segment tail is truncated.
+
+An in-memory index keeps, per app, the (segment, offset) of every
+retained version, so reading the latest version is a single pread.
+Concurrent writers share fsyncs (group commit): whoever takes the sync
+lock flushes everything appended so far, and the others find their
+records already durable. A background thread compacts sealed segments,
+dropping deleted apps and versions beyond config.LOG_RETENTION.
+
+Several processes (server.py, serve.py workers, a reload's old and new
+generation) may share a log. Appends and compaction hold an exclusive
+flock on db/<user>/log/.lock and write at the segment's real end after
+indexing whatever other processes appended. Reads hold it shared, and
+two stat()s tell whether the log changed elsewhere; if so the index
+catches up first (reloading it fully after another process compacted).
+"""
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from . import config
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: a single process only
+    fcntl = None
+
+MAGIC = b"PPL1"
+KIND_PUT = 0
+KIND_DELETE = 1
+
+_HEADER = struct.Struct(">4sBIdHII")
+
+_users_lock = threading.Lock()
+_users = {}
+_compactor = None
+
+def _log_dir(username):
+    return os.path.join("db", username, "log")
+
+def _segment_name(segment_id):
+    return f"segment-{segment_id:06d}.log"
+
+def _encode(kind, version, timestamp, app_name, data):
+    app_bytes = app_name.encode("utf-8")
+    header = _HEADER.pack(MAGIC, kind, version, timestamp, len(app_bytes), len(data), 0)
+    crc = zlib.crc32(header[:-4] + app_bytes + data)
+    return header[:-4] + struct.pack(">I", crc) + app_bytes + data
+
+class _Entry:
+    __slots__ = ("version", "segment_id", "offset", "length", "time", "kind", "meta")
+
+    def __init__(self, version, segment_id, offset, length, timestamp, kind, meta=None):
+        self.version = version
+        self.segment_id = segment_id
+        self.offset = offset          # offset of the payload data, not the header
+        self.length = length
+        self.time = timestamp
+        self.kind = kind
+        self.meta = meta              # (app_username, timestamp) of PUT records, parsed lazily
+
+class _UserLog:
+    def __init__(self, username):
+        self.username = username
+        self.dir = _log_dir(username)
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+        self.index = {}               # app_name -> [_Entry, ...] in version order
+        self.segment_sizes = {}       # segment_id -> bytes of valid records
+        self.read_fds = {}
+        self.active_id = 0
+        self.active_fd = None
+        self.active_stat = None       # (inode, size) of the active segment as last scanned
+        self.written = 0              # bytes appended (monotonic), for group commit
+        self.synced = 0
+        self.generation = 0           # bumped on every change, used as snapshot version
+        self.snapshot_cache = None
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock_fd = os.open(os.path.join(self.dir, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(exclusive=True):
+            self._recover(repair=True)
+
+    # --- cross-process locking ------------------------------------------
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """flock on the log's lock file. Caller holds self.lock (one flock user per process)."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def _changed(self):
+        """Whether another process appended, rolled or compacted since we last looked."""
+        try:
+            st = os.stat(self._path(self.active_id))
+        except FileNotFoundError:
+            return True
+        if (st.st_ino, st.st_size) != self.active_stat:
+            return True
+        return os.path.exists(self._path(self.active_id + 1))
+
+    @contextmanager
+    def _reading(self):
+        """Holds the log for a read, with the index up to date."""
+        with self.lock, self._locked(exclusive=False):
+            if self._changed():
+                self._catch_up(repair=False)
+            yield
+
+    def _catch_up(self, repair):
+        """Indexes records other processes wrote. Caller holds self.lock and a flock."""
+        segment_ids = self._segment_ids()
+        try:
+            inode = os.stat(self._path(self.active_id)).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self.active_stat[0] or any(sid not in segment_ids for sid in self.segment_sizes):
+            # Compacted elsewhere: segments were replaced or removed
+            self._reset()
+            self._recover(repair)
+            return
+        newer = [sid for sid in segment_ids if sid > self.active_id]
+        before = sum(self.segment_sizes.values())
+        for segment_id in [self.active_id] + newer:
+            self._scan_segment(segment_id, repair and segment_id == segment_ids[-1])
+        if newer:
+            os.close(self.active_fd)
+            self.active_id = newer[-1]
+            self._open_active()
+        self._stat_active()
+        if sum(self.segment_sizes.values()) != before:
+            self.generation += 1
+
+    def _reset(self):
+        for fd in self.read_fds.values():
+            os.close(fd)
+        self.read_fds = {}
+        if self.active_fd is not None:
+            os.close(self.active_fd)
+            self.active_fd = None
+        self.index = {}
+        self.segment_sizes = {}
+        self.generation += 1
+
+    def _stat_active(self):
+        st = os.fstat(self.active_fd)
+        self.active_stat = (st.st_ino, st.st_size)
+
+    # --- recovery -------------------------------------------------------
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.dir):
+            if name.startswith("segment-") and name.endswith(".log"):
+                ids.append(int(name[len("segment-"):-len(".log")]))
+        return sorted(ids)
+
+    def _path(self, segment_id):
+        return os.path.join(self.dir, _segment_name(segment_id))
+
+    def _recover(self, repair):
+        segment_ids = self._segment_ids()
+        for segment_id in segment_ids:
+            self._scan_segment(segment_id, repair and segment_id == segment_ids[-1])
+        for entries in self.index.values():
+            entries.sort(key=lambda e: e.version)
+        self.active_id = segment_ids[-1] if segment_ids else 1
+        self._open_active()
+        self._stat_active()
+
+    def _scan_segment(self, segment_id, repair):
+        """Indexes the records past what we already know of a segment."""
+        path = self._path(segment_id)
+        start = self.segment_sizes.get(segment_id, 0)
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            end = offset + _HEADER.size
+            if end > len(data):
+                break
+            magic, kind, version, timestamp, app_len, data_len, crc = _HEADER.unpack_from(data, offset)
+            body_end = end + app_len + data_len
+            if magic != MAGIC or body_end > len(data):
+                break
+            if zlib.crc32(data[offset:end - 4] + data[end:body_end]) != crc:
+                break
+            app_name = data[end:end + app_len].decode("utf-8")
+            entry = _Entry(version, segment_id, start + end + app_len, data_len, timestamp, kind)
+            self.index.setdefault(app_name, []).append(entry)
+            offset = body_end
+        if offset < len(data):
+            if repair:
+                # Torn write from a crash: drop the partial tail
+                print(f"Warning: truncating torn record in {path} at {start + offset}")
+                with open(path, "r+b") as f:
+                    f.truncate(start + offset)
+            elif segment_id != self.active_id:
+                print(f"Warning: ignoring corrupt tail of sealed segment {path} at {start + offset}")
+        self.segment_sizes[segment_id] = start + offset
+
+    # --- segments -------------------------------------------------------
+
+    def _open_active(self):
+        self.active_fd = os.open(self._path(self.active_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.segment_sizes.setdefault(self.active_id, 0)
+
+    def _roll(self):
+        """Seals the active segment and starts a new one. Caller holds self.lock and the flock."""
+        self._sync_all()
+        os.close(self.active_fd)
+        self.active_id = max(self.segment_sizes) + 1
+        self._open_active()
+
+    def _read_fd(self, segment_id):
+        fd = self.read_fds.get(segment_id)
+        if fd is None:
+            fd = os.open(self._path(segment_id), os.O_RDONLY)
+            self.read_fds[segment_id] = fd
+        return fd
+
+    def _pread(self, entry):
+        return os.pread(self._read_fd(entry.segment_id), entry.length, entry.offset)
+
+    # --- writes ---------------------------------------------------------
+
+    def append(self, records):
+        """records: [(kind, app_name, data bytes)]. Returns the new entries once durable."""
+        with self.lock, self._locked(exclusive=True):
+            self._catch_up(repair=True)
+            if self.segment_sizes[self.active_id] >= config.LOG_SEGMENT_SIZE:
+                self._roll()
+            now = time.time()
+            buffer = bytearray()
+            # The real end of the file: other processes append too
+            base = os.fstat(self.active_fd).st_size
+            new_entries = []
+            next_versions = {}
+            for kind, app_name, data in records:
+                if app_name not in next_versions:
+                    entries = self.index.get(app_name)
+                    next_versions[app_name] = entries[-1].version + 1 if entries else 1
+                version = next_versions[app_name]
+                next_versions[app_name] += 1
+                record = _encode(kind, version, now, app_name, data)
+                data_offset = base + len(buffer) + len(record) - len(data)
+                buffer += record
+                new_entries.append((app_name, _Entry(version, self.active_id, data_offset, len(data), now, kind)))
+            os.write(self.active_fd, buffer)
+            self.segment_sizes[self.active_id] = base + len(buffer)
+            self._stat_active()
+            self.written += len(buffer)
+            target = self.written
+            for app_name, entry in new_entries:
+                self.index.setdefault(app_name, []).append(entry)
+            self.generation += 1
+        self._sync(target)
+        return new_entries
+
+    def _sync(self, target):
+        # Group commit: one fsync covers every append made before it started
+        with self.sync_lock:
+            if self.synced >= target:
+                return
+            with self.lock:
+                # dup so a concurrent roll can close the original safely
+                fd = os.dup(self.active_fd)
+                upto = self.written
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.synced = max(self.synced, upto)
+
+    def _sync_all(self):
+        os.fsync(self.active_fd)
+        self.synced = self.written
+
+    # --- reads ----------------------------------------------------------
+
+    def latest(self, app_name):
+        with self._reading():
+            entries = self.index.get(app_name)
+            if not entries or entries[-1].kind == KIND_DELETE:
+                return None
+            entry = entries[-1]
+            return self._pread(entry), entry
+
+    def versions(self, app_name):
+        with self._reading():
+            return _live_versions(self.index.get(app_name))
+
+    def read_version(self, app_name, version):
+        with self._reading():
+            for entry in _live_versions(self.index.get(app_name)):
+                if entry.version == version:
+                    return self._pread(entry), entry
+            return None
+
+    def _meta(self, entry):
+        if entry.meta is None:
+            payload = json.loads(self._pread(entry))
+            entry.meta = (payload.get("app_username", "N/A"), payload.get("timestamp", "Unknown"))
+        return entry.meta
+
+    def snapshot(self):
+        with self._reading():
+            if self.snapshot_cache and self.snapshot_cache[0] == self.generation:
+                return self.snapshot_cache
+            apps = {}
+            for app_name, entries in self.index.items():
+                entry = entries[-1]
+                if entry.kind == KIND_DELETE:
+                    continue
+                app_username, timestamp = self._meta(entry)
+                apps[app_name] = {
+                    "name": app_name,
+                    "size": entry.length,
+                    "modified": entry.time,
+                    "app_username": app_username,
+                    "timestamp": timestamp,
+                    "version": entry.version
+                }
+            self.snapshot_cache = (self.generation, apps)
+            return self.snapshot_cache
+
+    # --- compaction -----------------------------------------------------
+
+    def garbage_ratio(self):
+        with self._reading():
+            total = sum(self.segment_sizes.values())
+            if not total:
+                return 0.0
+            live = sum(len(app.encode("utf-8")) + _HEADER.size + e.length
+                       for app, entries in self.index.items()
+                       for e in _live_versions(entries)[-config.LOG_RETENTION:])
+            return 1.0 - live / total
+
+    def compact(self):
+        """Rewrites sealed segments keeping only retained versions. Returns bytes reclaimed."""
+        with self.lock, self._locked(exclusive=True):
+            self._catch_up(repair=True)
+            self._roll()
+            sealed = {sid for sid in self.segment_sizes if sid != self.active_id}
+            if not sealed:
+                return 0
+            # The freshly rolled active segment is still empty: the compacted
+            # records take its id and writes move on to the next one, so the
+            # highest segment id is always the one being appended to.
+            compacted_id = self.active_id
+
+            buffer = bytearray()
+            moved = {}
+            for app_name, entries in self.index.items():
+                for entry in _live_versions(entries)[-config.LOG_RETENTION:]:
+                    if entry.segment_id in sealed:
+                        data = self._pread(entry)
+                        record = _encode(KIND_PUT, entry.version, entry.time, app_name, data)
+                        moved[id(entry)] = len(buffer) + len(record) - len(data)
+                        buffer += record
+
+            path = self._path(compacted_id)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer)
+                f.flush()
+                os.fsync(f.fileno())
+            os.close(self.active_fd)
+            os.replace(tmp_path, path)
+            self.active_id = compacted_id + 1
+            self._open_active()
+            self._stat_active()
+
+            for app_name in list(self.index):
+                kept = []
+                for entry in self.index[app_name]:
+                    if id(entry) in moved:
+                        entry.segment_id = compacted_id
+                        entry.offset = moved[id(entry)]
+                    elif entry.segment_id in sealed:
+                        continue
+                    kept.append(entry)
+                if kept:
+                    self.index[app_name] = kept
+                else:
+                    del self.index[app_name]
+
+            reclaimed = -len(buffer)
+            for segment_id in sealed:
+                fd = self.read_fds.pop(segment_id, None)
+                if fd is not None:
+                    os.close(fd)
+                reclaimed += self.segment_sizes.pop(segment_id)
+                os.remove(self._path(segment_id))
+            self.segment_sizes[compacted_id] = len(buffer)
+            _fsync_dir(self.dir)
+            self.generation += 1
+            return reclaimed
+
+def _live_versions(entries):
+    """PUT entries written after the app's last delete, oldest first."""
+    live = []
+    for entry in entries or ():
+        if entry.kind == KIND_DELETE:
+            live = []
+        else:
+            live.append(entry)
+    if entries and entries[-1].kind == KIND_DELETE:
+        return []
+    return live
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _compact_loop():
+    while True:
+        time.sleep(config.LOG_COMPACT_INTERVAL)
+        with _users_lock:
+            logs = list(_users.values())
+        for user_log in logs:
+            try:
+                if user_log.garbage_ratio() >= config.LOG_COMPACT_MIN_GARBAGE:
+                    reclaimed = user_log.compact()
+                    print(f"Compacted log of {user_log.username}: {reclaimed} bytes reclaimed")
+            except Exception as e:
+                print(f"Warning: compaction failed for {user_log.username}: {e}")
+
+def _user_log(username):
+    global _compactor
+    with _users_lock:
+        user_log = _users.get(username)
+        if user_log is None:
+            user_log = _users[username] = _UserLog(username)
+        if _compactor is None:
+            _compactor = threading.Thread(target=_compact_loop, daemon=True)
+            _compactor.start()
+        return user_log
+
+def _location(user_log, entry):
+    return f"{user_log._path(entry.segment_id)}@{entry.offset}"
+
+def write(username, items):
+    user_log = _user_log(username)
+    records = [(KIND_PUT, app_name, json.dumps(payload).encode("utf-8")) for app_name, payload in items]
+    try:
+        entries = user_log.append(records)
+    except OSError as e:
+        return [(app_name, None, str(e)) for app_name, _ in items]
+    return [(app_name, _location(user_log, entry), None) for app_name, entry in entries]
+
+def read(username, app_name):
+    user_log = _user_log(username)
+    result = user_log.latest(app_name)
+    if result is None:
+        return None
+    data, entry = result
+    return data.decode("utf-8"), _location(user_log, entry)
+
+def read_many(username, app_names):
+    user_log = _user_log(username)
+    results = {}
+    for app_name in app_names:
+        result = user_log.latest(app_name)
+        results[app_name] = result[0].decode("utf-8") if result else None
+    return results
+
+def delete(username, app_name):
+    user_log = _user_log(username)
+    if user_log.latest(app_name) is None:
+        return False
+    user_log.append([(KIND_DELETE, app_name, b"")])
+    return True
+
+def history(username, app_name):
+    """Retained versions of an app, oldest first."""
+    return [
+        {"version": e.version, "modified": e.time, "size": e.length}
+        for e in _user_log(username).versions(app_name)
+    ]
+
+def read_version(username, app_name, version):
+    user_log = _user_log(username)
+    result = user_log.read_version(app_name, version)
+    if result is None:
+        return None
+    data, entry = result
+    return data.decode("utf-8"), _location(user_log, entry)
+
+def compact(username):
+    return _user_log(username).compact()
+
+def snapshot(username):
+    return _user_log(username).snapshot()
+
+def list_apps(username):
+    return list(snapshot(username)[1].values())
+
+def metadata(username, app_name):
+    return snapshot(username)[1].get(app_name)
+
+def list_users():
+    if not os.path.isdir("db"):
+        return []
+    return sorted(
+        name for name in os.listdir("db")
+        if not name.startswith(".") and os.path.isdir(_log_dir(name))
+    )
@@ -0,0 +1,162 @@
+"""
+Per-user app manifest: name, size, mtime, app_username and timestamp of
+every app, so listing a vault doesn't have to walk and parse db/<user>.
+
+Manifests live in db/.manifests/<user>.json, outside the user directory,
+so that the user directory's mtime only changes when apps are added or
+removed. Each manifest records that mtime; a mismatch means the tree was
+changed behind our back and the manifest is rebuilt.
+"""
+import json
+import os
+import threading
+from . import durable
+from . import record as payload_record
+
+MANIFEST_DIR = os.path.join("db", ".manifests")
+
+_lock = threading.Lock()
+# username -> (manifest file signature, user dir mtime, apps dict)
+_cache = {}
+
+def _manifest_path(username):
+    return os.path.join(MANIFEST_DIR, f"{username}.json")
+
+def _writer_lock(username):
+    # _lock covers this process; the file lock other processes writing the
+    # same manifest (read-modify-write must not interleave)
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    return durable.process_lock(os.path.join(MANIFEST_DIR, f"{username}.lock"))
+
+def _user_dir(username):
+    return os.path.join("db", username)
+
+def _signature(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _entry(app_name, payload, st):
+    return {
+        "name": app_name,
+        "size": st.st_size,
+        "modified": st.st_mtime,
+        "app_username": payload.get("app_username", "N/A"),
+        "timestamp": payload.get("timestamp", "Unknown")
+    }
+
+def _scan(username):
+    user_dir = _user_dir(username)
+    apps = {}
+    for item in os.listdir(user_dir):
+        # secret.bin carries its metadata in a fixed header: one small pread
+        secret_file = os.path.join(user_dir, item, "secret.bin")
+        try:
+            st = os.stat(secret_file)
+            apps[item] = _entry(item, payload_record.read_metadata(secret_file), st)
+            continue
+        except (OSError, ValueError):
+            pass
+        secret_file = os.path.join(user_dir, item, "secret.json")
+        try:
+            st = os.stat(secret_file)
+            with open(secret_file, "r") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            continue
+        apps[item] = _entry(item, payload, st)
+    return apps
+
+def _write(username, dir_mtime, apps):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = _manifest_path(username)
+    # Rebuildable from the tree, so atomic is enough; no fsync
+    durable.atomic_write(path, json.dumps({"dir_mtime": dir_mtime, "apps": apps}), durable=False)
+    _cache[username] = (_signature(os.stat(path)), dir_mtime, apps)
+
+def user_dir_mtime(username):
+    try:
+        return os.stat(_user_dir(username)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _load(username, dir_mtime=None):
+    """
+    Returns the apps dict for a user, from memory when nothing changed on
+    disk. `dir_mtime` overrides the user dir mtime the manifest is checked
+    against (writers pass the value from before their own changes).
+    Caller holds _lock.
+    """
+    if dir_mtime is None:
+        dir_mtime = user_dir_mtime(username)
+    if dir_mtime is None:
+        _cache.pop(username, None)
+        return {}
+
+    try:
+        signature = _signature(os.stat(_manifest_path(username)))
+    except FileNotFoundError:
+        signature = None
+
+    cached = _cache.get(username)
+    if cached and signature and cached[0] == signature and cached[1] == dir_mtime:
+        return cached[2]
+
+    if signature:
+        try:
+            with open(_manifest_path(username), "r") as f:
+                data = json.load(f)
+            if data.get("dir_mtime") == dir_mtime:
+                _cache[username] = (signature, dir_mtime, data["apps"])
+                return data["apps"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Missing, unreadable or stale: rebuild from the tree
+    apps = _scan(username)
+    _write(username, dir_mtime, apps)
+    return apps
+
+def snapshot(username):
+    """Returns (version, apps dict). `version` changes whenever the manifest does."""
+    with _lock:
+        apps = _load(username)
+        cached = _cache.get(username)
+        return (cached[:2] if cached else None), apps
+
+def list_apps(username):
+    with _lock:
+        return list(_load(username).values())
+
+def get_entry(username, app_name):
+    with _lock:
+        return _load(username).get(app_name)
+
+def record(username, entries, dir_mtime_before):
+    """
+    Updates the manifest after the storage layer wrote secrets.
+    `entries` is a list of (app_name, payload, secret_file_path) and
+    `dir_mtime_before` the user dir mtime from before those writes.
+    """
+    with _lock, _writer_lock(username):
+        apps = dict(_load(username, dir_mtime_before))
+        for app_name, payload, file_path in entries:
+            apps[app_name] = _entry(app_name, payload, os.stat(file_path))
+        # Re-read after the writes: new app directories bump the user dir mtime
+        _write(username, os.stat(_user_dir(username)).st_mtime_ns, apps)
+
+def remove(username, app_names, dir_mtime_before):
+    with _lock, _writer_lock(username):
+        apps = dict(_load(username, dir_mtime_before))
+        for app_name in app_names:
+            apps.pop(app_name, None)
+        dir_mtime = user_dir_mtime(username)
+        if dir_mtime is not None:
+            _write(username, dir_mtime, apps)
+
+def rebuild(username):
+    with _lock:
+        _cache.pop(username, None)
+        try:
+            os.remove(_manifest_path(username))
+        except FileNotFoundError:
+            pass
+        return list(_load(username).values())
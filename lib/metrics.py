@@ -0,0 +1,271 @@
+"""
+Latency histograms for the web interface and the TCP server.
+
+Every request is timed by route (HTTP) or command (TCP) and outcome, and so
+is each internal stage it passes through: allowlist check, KDFs, storage
+read / write, gpg or AEAD encrypt / decrypt, JSON parsing. Stage timings
+are kept per request name, so the stage histograms of the update route
+show where a slow update spends its time; a request slower than
+config.METRICS_SLOW_REQUEST is also printed with its own breakdown.
+
+    metrics.begin("http", "/api/secrets/update")
+    with metrics.stage("read"):
+        ...
+    metrics.end(200)
+
+Stages run outside a request (command-line tools, helper threads) are
+filed under the request name "-". Stages may nest: an aead_decrypt
+includes its aead_kdf. Histograms use fixed buckets, so recording is a
+bisect and a few additions under one lock.
+
+Numbers are kept per process. prometheus() renders them in the
+Prometheus text format, every series labelled with its worker's pid;
+snapshot() returns this process's as a JSON-friendly dict. Processes that
+call share() (serve.py's workers) also publish their histograms to a
+directory every METRICS_SHARE_INTERVAL seconds, so a scrape reaching any
+worker reports all of them, each under its own worker label.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from . import config
+
+# Upper bounds in seconds; one more bucket takes everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_requests = {}  # (transport, name, status) -> Histogram
+_stages = {}    # (transport, name, stage) -> Histogram
+_started = time.time()
+_shared_dir = None
+
+class Histogram:
+    __slots__ = ("counts", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max for the last one)."""
+        total = sum(self.counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+class _Request:
+    __slots__ = ("transport", "name", "start", "stages")
+
+    def __init__(self, transport, name):
+        self.transport = transport
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages = {}
+
+def _observe(table, key, seconds):
+    with _lock:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram()
+        histogram.observe(seconds)
+
+def begin(transport, name):
+    """Starts timing the request this thread is about to serve."""
+    if config.METRICS_ENABLED:
+        _local.request = _Request(transport, name)
+
+def rename(name):
+    """Names the current request once it is known (TCP: after parsing)."""
+    request = getattr(_local, "request", None)
+    if request is not None:
+        request.name = name
+
+def end(status):
+    """Records the current request with its outcome (HTTP status, "ok", "error")."""
+    request = getattr(_local, "request", None)
+    if request is None:
+        return
+    _local.request = None
+    elapsed = time.perf_counter() - request.start
+    _observe(_requests, (request.transport, request.name, str(status)), elapsed)
+    if config.METRICS_SLOW_REQUEST and elapsed >= config.METRICS_SLOW_REQUEST:
+        breakdown = ", ".join(
+            f"{name} {seconds * 1000:.0f} ms"
+            for name, seconds in sorted(request.stages.items(), key=lambda item: -item[1])
+        )
+        print(f"Slow request: {request.transport} {request.name} {status} "
+              f"{elapsed * 1000:.0f} ms ({breakdown or 'no stages'})")
+
+def observe_stage(name, seconds):
+    """Records a stage that was timed elsewhere."""
+    if not config.METRICS_ENABLED:
+        return
+    request = getattr(_local, "request", None)
+    if request is None:
+        _observe(_stages, ("-", "-", name), seconds)
+        return
+    request.stages[name] = request.stages.get(name, 0.0) + seconds
+    _observe(_stages, (request.transport, request.name, name), seconds)
+
+@contextmanager
+def stage(name):
+    """Times the block as one pass through stage `name`."""
+    if not config.METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+def _copy(table):
+    with _lock:
+        return [(key, list(h.counts), h.sum, h.max) for key, h in sorted(table.items())]
+
+def _summary(counts, total, maximum):
+    histogram = Histogram()
+    histogram.counts, histogram.sum, histogram.max = counts, total, maximum
+    count = sum(counts)
+    return {
+        "count": count,
+        "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(histogram.quantile(0.5) * 1000, 3),
+        "p99_ms": round(histogram.quantile(0.99) * 1000, 3),
+        "max_ms": round(maximum * 1000, 3),
+    }
+
+def snapshot():
+    """Request and stage latencies (bucket-resolution percentiles) as a dict."""
+    requests = [
+        dict(transport=transport, name=name, status=status, **_summary(counts, total, maximum))
+        for (transport, name, status), counts, total, maximum in _copy(_requests)
+    ]
+    stages = [
+        dict(transport=transport, name=name, stage=stage_name, **_summary(counts, total, maximum))
+        for (transport, name, stage_name), counts, total, maximum in _copy(_stages)
+    ]
+    return {"uptime": round(time.time() - _started, 1), "requests": requests, "stages": stages}
+
+def share(directory):
+    """Publishes this process's histograms to `directory` for the other processes' prometheus()."""
+    global _shared_dir
+    os.makedirs(directory, exist_ok=True)
+    _shared_dir = directory
+    _publish()
+    threading.Thread(target=_publish_loop, name="metrics-share", daemon=True).start()
+
+def _publish():
+    path = os.path.join(_shared_dir, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"started": _started, "requests": _copy(_requests), "stages": _copy(_stages)}, f)
+    os.replace(path + ".tmp", path)
+
+def _publish_loop():
+    while True:
+        time.sleep(config.METRICS_SHARE_INTERVAL)
+        try:
+            _publish()
+        except OSError as e:
+            print(f"Could not publish metrics: {e}")
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _rows(table):
+    return [(tuple(key), counts, total, maximum) for key, counts, total, maximum in table]
+
+def _workers():
+    """(pid, started, request rows, stage rows) of this process and, when shared, the others."""
+    pid = os.getpid()
+    workers = [(pid, _started, _copy(_requests), _copy(_stages))]
+    if _shared_dir is None:
+        return workers
+    for name in sorted(os.listdir(_shared_dir)):
+        if not name.endswith(".json") or not name[:-5].isdigit() or int(name[:-5]) == pid:
+            continue
+        path = os.path.join(_shared_dir, name)
+        other = int(name[:-5])
+        try:
+            if not _alive(other):
+                os.remove(path)  # an exited worker (or an earlier run)
+                continue
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        workers.append((other, data["started"], _rows(data["requests"]), _rows(data["stages"])))
+    return workers
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+def _histogram_lines(metric, help_text, rows):
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+    for labels, counts, total, _ in rows:
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{_labels(**labels, le=bound)}}} {cumulative}')
+        lines.append(f"{metric}_sum{{{_labels(**labels)}}} {total}")
+        lines.append(f"{metric}_count{{{_labels(**labels)}}} {cumulative}")
+    return lines
+
+def _flatten(prefix, value):
+    if isinstance(value, dict):
+        for key, item in sorted(value.items()):
+            yield from _flatten(f"{prefix}_{key}", item)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def prometheus(gauges=None):
+    """
+    The histograms of every worker in the Prometheus text format (label
+    worker=<pid>), followed by `gauges`: a (nested) dict of numbers of this
+    process, such as the cache stats, exported as payload_<key>_<key>...
+    Non-numeric values are skipped.
+    """
+    workers = _workers()
+    lines = _histogram_lines(
+        "payload_request_seconds", "Request latency by transport, route or command, and status.",
+        [(dict(worker=w, transport=t, name=n, status=s), c, total, m)
+         for w, _, requests, _ in workers for (t, n, s), c, total, m in requests]
+    )
+    lines += _histogram_lines(
+        "payload_stage_seconds", "Time spent per internal stage, by the request it served.",
+        [(dict(worker=w, transport=t, name=n, stage=s), c, total, m)
+         for w, _, _, stages in workers for (t, n, s), c, total, m in stages]
+    )
+    now = time.time()
+    lines.append("# TYPE payload_uptime_seconds gauge")
+    lines += [f'payload_uptime_seconds{{{_labels(worker=w)}}} {now - started:.1f}' for w, started, _, _ in workers]
+    this = _labels(worker=os.getpid())
+    for name, value in _flatten("payload", gauges or {}):
+        name = "".join(ch if ch.isalnum() or ch == "_" else "_" for ch in name)
+        lines += [f"# TYPE {name} untyped", f"{name}{{{this}}} {value}"]
+    return "\n".join(lines) + "\n"
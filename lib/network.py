@@ -1,19 +1,277 @@
+import ipaddress
+import itertools
+import re
+import select
 import socket
-from . import config
+import threading
+import time
+from . import config, protocol
+
+ARP_TABLE = "/proc/net/arp"
+
+# Bytes that matter when finding the end of a bare JSON request
+_JSON_STRUCTURE = re.compile(rb'[\\"{}\[\]]')
+
+# Peer allowlist state: raw ARP line -> IP, plus the resulting set of IPs.
+# Rebuilt incrementally when the table's content changes.
+_peer_lock = threading.Lock()
+_arp_lines = {}
+_peers = frozenset()
+_last_refresh = 0.0
+_allowed_networks = ((), [])  # (config.ALLOWED_CIDRS as parsed, networks)
 
 def create_connection():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((config.HOST, config.PORT))
     return s
 
+def receive_exactly(sock, size):
+    """Reads exactly `size` bytes. Raises ConnectionError if the peer closes first."""
+    parts = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connection closed mid-message")
+        parts.append(chunk)
+        size -= len(chunk)
+    return b"".join(parts)
+
+def receive_frame(sock):
+    """Returns (request id, body) of the next frame."""
+    length, request_id = protocol.FRAME_HEADER.unpack(receive_exactly(sock, protocol.FRAME_HEADER.size))
+    return request_id, receive_exactly(sock, length)
+
+class Connection:
+    """
+    A long-lived client connection. Framed servers get every request over
+    one socket, pipelined: send() returns a request id at once and
+    receive(id) waits for that response, keeping any others that arrive
+    first. Servers that only speak the legacy protocol get one connection
+    per request instead, behind the same interface.
+
+    Requests may be bytes (sent as they are) or message dicts, which go out
+    binary when the server speaks protocol version 2 and
+    config.WIRE_ENCODING is "binary", and as JSON otherwise.
+    """
+
+    def __init__(self, host=None, port=None):
+        self.host = host or config.HOST
+        self.port = port or config.PORT
+        self.sock = None
+        self.framed = None  # unknown until the first connect
+        self.version = None
+        self.last_used = None
+        self._ids = itertools.count(1)
+        self._pending = set()   # sent, response not read yet
+        self._responses = {}    # read, not claimed yet
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=config.CLIENT_CONNECT_TIMEOUT)
+        sock.settimeout(None)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.sendall(protocol.hello())
+        reply = b""
+        while len(reply) < protocol.HELLO_SIZE:
+            chunk = sock.recv(protocol.HELLO_SIZE - len(reply))
+            if not chunk:
+                break
+            reply += chunk
+        version = protocol.parse_hello(reply)
+        if version is None:
+            # Legacy server: it answered the hello with an error and closed
+            sock.close()
+            self.framed = False
+            return
+        if not 1 <= version <= protocol.FRAME_VERSION:
+            sock.close()
+            raise ConnectionError(f"Server speaks protocol version {version}")
+        self.framed = True
+        self.version = version
+        self.sock = sock
+        self.last_used = time.monotonic()
+
+    def _usable(self):
+        # An idle socket has nothing to read; if it is readable the server
+        # has closed it (e.g. idle timeout) and we reconnect
+        if self.sock is None:
+            return False
+        return bool(self._pending) or not select.select([self.sock], [], [], 0)[0]
+
+    def send(self, body):
+        """Sends one request and returns its id."""
+        with self._send_lock:
+            request_id = next(self._ids)
+            if self.framed is not False and not self._usable():
+                self.close()
+                self._connect()
+            if isinstance(body, dict):
+                body = protocol.encode_request(body, binary=self.binary)
+            if not self.framed:
+                self._responses[request_id] = self._legacy_request(body)
+                return request_id
+            self._pending.add(request_id)
+            try:
+                self.sock.sendall(protocol.encode_frame(request_id, body))
+            except OSError:
+                self.close()
+                raise
+        return request_id
+
+    def receive(self, request_id):
+        """Waits for the response to `request_id`."""
+        with self._recv_lock:
+            while request_id not in self._responses:
+                if request_id not in self._pending or self.sock is None:
+                    raise ConnectionError("Connection lost before the response arrived")
+                try:
+                    response_id, body = receive_frame(self.sock)
+                except OSError:
+                    self.close()
+                    raise ConnectionError("Connection lost before the response arrived")
+                self._pending.discard(response_id)
+                self._responses[response_id] = body
+            self.last_used = time.monotonic()
+            return self._responses.pop(request_id)
+
+    def request(self, body):
+        return self.receive(self.send(body))
+
+    def pipeline(self, bodies):
+        """Sends every request before reading any response. Returns responses in order."""
+        return [self.receive(request_id) for request_id in [self.send(body) for body in bodies]]
+
+    @property
+    def idle(self):
+        """No responses outstanding or unclaimed."""
+        return not self._pending and not self._responses
+
+    @property
+    def binary(self):
+        return bool(self.framed) and self.version >= 2 and config.WIRE_ENCODING == "binary"
+
+    def _legacy_request(self, body):
+        with socket.create_connection((self.host, self.port), timeout=config.CLIENT_CONNECT_TIMEOUT) as sock:
+            sock.settimeout(None)
+            sock.sendall(body)
+            # Half-closing marks the end of the request; a STORE_BATCH
+            # connection then ends after its one batch
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass  # the server already answered and closed
+            return receive_all(sock)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._pending.clear()
+
 def send_message(sock, message_bytes):
     sock.sendall(message_bytes)
 
 def receive_message(sock, buffer_size=8192):
     return sock.recv(buffer_size)
 
+def receive_all(sock, buffer_size=8192):
+    """Reads until the peer closes the connection (for responses larger than one recv)."""
+    chunks = []
+    while True:
+        chunk = sock.recv(buffer_size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+class RequestScanner:
+    """
+    Finds where one request ends while its chunks arrive, in time linear in
+    its size. Newer clients terminate requests with a newline; older ones
+    send a bare JSON document, which ends where its outermost object, array
+    or string closes. Only quotes, backslashes and brackets are looked at,
+    so nothing is parsed (or re-parsed) until the request is complete.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.complete = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Adds received bytes; returns whether the request is now complete."""
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if chunk.endswith(b"\n"):
+            self.complete = True
+        if not self.complete:
+            self._scan(chunk)
+        return self.complete
+
+    def _scan(self, chunk):
+        pos = 0
+        if self._escaped and chunk:
+            self._escaped = False
+            pos = 1
+        while True:
+            match = _JSON_STRUCTURE.search(chunk, pos)
+            if match is None:
+                return
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == b"\\":
+                    if pos == len(chunk):
+                        self._escaped = True
+                    pos += 1
+                elif char == b'"':
+                    self._in_string = False
+                    if self._depth == 0:
+                        self.complete = True
+                        return
+            elif char == b'"':
+                self._in_string = True
+            elif char in b"{[":
+                self._depth += 1
+            elif char in b"}]":
+                self._depth -= 1
+                if self._depth <= 0:
+                    self.complete = True
+                    return
+
+    def data(self):
+        return b"".join(self.chunks)
+
+def receive_request(sock, buffer_size=8192):
+    """
+    Reads one complete request (see RequestScanner). Returns b"" when the
+    peer has closed the connection.
+    """
+    scanner = RequestScanner()
+    while not scanner.complete:
+        chunk = sock.recv(buffer_size)
+        if not chunk:
+            break
+        scanner.feed(chunk)
+    return scanner.data()
+
+def receive_line(sock, buffer_size=8192):
+    """Reads one newline-terminated response (without the newline)."""
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(buffer_size)
+        if not chunk:
+            break
+        data += chunk
+    return data.rstrip(b"\n")
+
 def start_server_socket():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((config.HOST, config.PORT))
     s.listen()
     return s
@@ -42,3 +300,69 @@ def get_connected_peers():
         print(f"Warning: Could not read ARP table: {e}")
         
     return peers
+
+def _parse_arp_line(line):
+    parts = line.split()
+    if len(parts) >= 1:
+        ip = parts[0]
+        # Filter out header garbage if any, basic validity check
+        if ip.count('.') == 3:
+            return ip
+    return None
+
+def refresh_peers(force=False):
+    """
+    Re-reads the ARP table if the cached view is older than PEER_CACHE_TTL
+    (or when forced). Only lines that appeared or disappeared are parsed.
+    """
+    global _peers, _last_refresh
+    with _peer_lock:
+        now = time.monotonic()
+        if not force and now - _last_refresh < config.PEER_CACHE_TTL:
+            return _peers
+        _last_refresh = now
+        try:
+            with open(ARP_TABLE, 'r') as f:
+                # Skip header line
+                lines = set(f.read().splitlines()[1:])
+        except FileNotFoundError:
+            # Fallback for systems without /proc/net/arp (e.g., non-Linux dev)
+            lines = set()
+        except Exception as e:
+            print(f"Warning: Could not read ARP table: {e}")
+            return _peers
+
+        if lines == _arp_lines.keys():
+            return _peers
+        for line in _arp_lines.keys() - lines:
+            del _arp_lines[line]
+        for line in lines - _arp_lines.keys():
+            _arp_lines[line] = _parse_arp_line(line)
+        _peers = frozenset(ip for ip in _arp_lines.values() if ip)
+        return _peers
+
+def _in_allowed_networks(remote_ip):
+    global _allowed_networks
+    cidrs = tuple(config.ALLOWED_CIDRS)
+    if cidrs != _allowed_networks[0]:
+        _allowed_networks = (cidrs, [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs])
+    networks = _allowed_networks[1]
+    if not networks:
+        return False
+    try:
+        address = ipaddress.ip_address(remote_ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+def is_allowed_peer(remote_ip):
+    """
+    True if remote_ip is in a configured CIDR range or in the ARP table.
+    A miss against the cached table forces a fresh read before denying, so
+    a device that just joined the hotspot is never refused because of the cache.
+    """
+    if _in_allowed_networks(remote_ip):
+        return True
+    if remote_ip in refresh_peers():
+        return True
+    return remote_ip in refresh_peers(force=True)
@@ -0,0 +1,645 @@
+"""
+Pre-fork HTTP/1.1 server for the WSGI app in web_server.py (stdlib only).
+
+    prefork.serve("web_server:app", port=5001, workers=4, threads=4)
+
+The master process opens the listening socket and forks `workers`
+processes that accept on it, so the CPU-bound part of a request (PBKDF2,
+scrypt, gpg) runs on every core. The master never imports the app; each
+worker does after the fork. Inside a worker one thread waits on the
+listener and on idle keep-alive connections, and a pool of `threads`
+threads serves requests. A worker whose threads are all busy stops
+accepting, leaving new connections to the others.
+
+Signals to the master:
+  SIGHUP          reload: start a new generation of workers (re-importing
+                  the app and lib.config), then stop the old one once the
+                  new workers are ready
+  SIGTERM/SIGINT  stop: workers finish the requests they are serving,
+                  for at most WEB_GRACEFUL_TIMEOUT seconds
+
+Process-local state that has to change in every worker at once (a logged-out
+session's cached keys) goes through broadcast(); each process registers
+its handler with on_broadcast(). Without the master, broadcast() only runs
+the local handler.
+"""
+import email.utils
+import http.client
+import importlib
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+
+MAX_LINE = 65536
+# Hop-by-hop headers the server sets itself
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding"}
+
+_handlers = {}
+_channel = None           # worker end of the socketpair to the master
+_channel_lock = threading.Lock()
+
+def on_broadcast(name, handler):
+    """Registers handler(arg) for broadcast(name, arg) in this process."""
+    _handlers[name] = handler
+
+def broadcast(name, arg=""):
+    """Runs the handler for `name` here and in every other worker."""
+    if any(c in name + arg for c in " \n"):
+        raise ValueError("Broadcast name and argument must not contain spaces or newlines")
+    _dispatch(name, arg)
+    if _channel is not None:
+        with _channel_lock:
+            _channel.sendall(f"broadcast {name} {arg}\n".encode("utf-8"))
+
+def _dispatch(name, arg):
+    handler = _handlers.get(name)
+    if handler is not None:
+        handler(arg)
+
+def _load(target):
+    # "module:attribute"
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+# --- HTTP ---
+
+class _HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class _Connection:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.rfile = sock.makefile("rb")
+        self.last_active = time.monotonic()
+
+    def pending(self):
+        """True if another request has (partly) arrived already."""
+        self.sock.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.sock.setblocking(True)
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+class _Input:
+    """wsgi.input: the request body, `length` bytes at most."""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b""
+        self.remaining -= len(data)
+        if len(data) < size:
+            self.remaining = 0
+            raise ConnectionError("Client closed the connection mid-body")
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def drain(self):
+        # Skip what the app left unread so the next request starts cleanly
+        while self.remaining:
+            self.read(min(self.remaining, 64 * 1024))
+
+class _Response:
+    def __init__(self, conn, method, keep_alive):
+        self.conn = conn
+        self.method = method
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = None
+        self.headers_sent = False
+        self.chunked = False
+        self.has_body = True
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.headers_sent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("start_response() called twice")
+        self.status = status
+        self.headers = headers
+        return self.write
+
+    def _head(self, body_length=None):
+        code = int(self.status.split(None, 1)[0])
+        self.has_body = self.method != "HEAD" and code >= 200 and code not in (204, 304)
+        lines = [f"HTTP/1.1 {self.status}"]
+        has_length = False
+        for name, value in self.headers:
+            lowered = name.lower()
+            if lowered in _HOP_HEADERS:
+                continue
+            has_length = has_length or lowered == "content-length"
+            lines.append(f"{name}: {value}")
+        if not has_length and code >= 200 and code not in (204, 304):
+            if body_length is not None:
+                lines.append(f"Content-Length: {body_length}")
+            elif self.keep_alive:
+                self.chunked = True
+                lines.append("Transfer-Encoding: chunked")
+        if not self.keep_alive:
+            lines.append("Connection: close")
+        lines.append("Date: " + email.utils.formatdate(usegmt=True))
+        self.headers_sent = True
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def write(self, data):
+        head = b"" if self.headers_sent else self._head()
+        if self.has_body and data:
+            data = b"%x\r\n%b\r\n" % (len(data), data) if self.chunked else data
+        else:
+            data = b""
+        # Headers and the first block in one segment (no Nagle / delayed ACK stall)
+        if head or data:
+            self.conn.sock.sendall(head + data)
+
+    def finish(self, body=None):
+        """`body`: the whole response, when the app returned it in one piece."""
+        if not self.headers_sent:
+            self.conn.sock.sendall(self._head(len(body or b"")) + (body if self.has_body and body else b""))
+        elif self.chunked:
+            self.conn.sock.sendall(b"0\r\n\r\n")
+
+def _environ(conn, method, target, version, headers, body):
+    path, _, query = target.partition("?")
+    server_name, server_port = conn.sock.getsockname()[:2]
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": urllib.parse.unquote(path, "latin-1"),
+        "QUERY_STRING": query,
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": version,
+        "REMOTE_ADDR": conn.address[0],
+        "REMOTE_PORT": str(conn.address[1]),
+        "CONTENT_TYPE": headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": headers.get("Content-Length", ""),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            continue
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+def _send_error(conn, status):
+    body = status.encode("latin-1")
+    conn.sock.sendall(
+        f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode("latin-1") + body
+    )
+
+def _read_request(conn):
+    """Returns (method, target, version, headers), or None if the client closed."""
+    line = conn.rfile.readline(MAX_LINE + 1)
+    if not line:
+        return None
+    if len(line) > MAX_LINE:
+        raise _HTTPError("414 URI Too Long")
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise _HTTPError("400 Bad Request")
+    method, target, version = parts
+    if version not in ("HTTP/1.0", "HTTP/1.1"):
+        raise _HTTPError("505 HTTP Version Not Supported")
+    try:
+        headers = http.client.parse_headers(conn.rfile)
+    except http.client.HTTPException:
+        raise _HTTPError("431 Request Header Fields Too Large")
+    return method, target, version, headers
+
+def _serve_request(app, conn, stopping):
+    """Serves one request on `conn`. Returns True to keep the connection open."""
+    conn.sock.settimeout(config.WEB_IO_TIMEOUT)
+    try:
+        request = _read_request(conn)
+        if request is None:
+            return False
+        method, target, version, headers = request
+        if "Transfer-Encoding" in headers:
+            raise _HTTPError("411 Length Required")
+        try:
+            length = int(headers.get("Content-Length", 0))
+        except ValueError:
+            raise _HTTPError("400 Bad Request")
+        if length < 0:
+            raise _HTTPError("400 Bad Request")
+    except _HTTPError as e:
+        _send_error(conn, e.status)
+        return False
+
+    tokens = {t.strip().lower() for t in headers.get("Connection", "").split(",")}
+    keep_alive = version == "HTTP/1.1" and "close" not in tokens and not stopping.is_set()
+    body = _Input(conn.rfile, length)
+    response = _Response(conn, method, keep_alive)
+    conn.sock.settimeout(config.WEB_IO_TIMEOUT)
+    try:
+        result = app(_environ(conn, method, target, version, headers, body), response.start_response)
+    except Exception:
+        traceback.print_exc()
+        _send_error(conn, "500 Internal Server Error")
+        return False
+    try:
+        if isinstance(result, list) and len(result) == 1 and not response.headers_sent:
+            response.finish(result[0])
+        else:
+            for block in result:
+                response.write(block)
+            response.finish()
+    except OSError:
+        return False
+    except Exception:
+        traceback.print_exc()
+        if not response.headers_sent:
+            _send_error(conn, "500 Internal Server Error")
+        return False
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    if config.WEB_ACCESS_LOG:
+        print(f'{conn.address[0]} "{method} {target} {version}" {response.status.split(None, 1)[0]}')
+    if keep_alive and body.remaining:
+        body.drain()
+    return keep_alive and not stopping.is_set()
+
+# --- worker ---
+
+class _Worker:
+    def __init__(self, listener, channel, app, threads):
+        self.listener = listener
+        self.channel = channel
+        self.app = app
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.returned = []  # connections handed back to the selector by pool threads
+        self.idle = {}      # socket -> _Connection waiting for its next request
+        self.accepting = False
+        self.inbox = b""
+
+    def wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass  # buffer full: the loop is awake anyway
+
+    def stop(self, *_):
+        self.stopping.set()
+        self.wake()
+
+    def _handle(self, conn):
+        keep = False
+        try:
+            while _serve_request(self.app, conn, self.stopping):
+                conn.last_active = time.monotonic()
+                if not conn.pending():
+                    keep = True
+                    break
+        except OSError:
+            pass
+        except Exception:
+            traceback.print_exc()
+        if not keep:
+            conn.close()
+        with self.lock:
+            self.busy -= 1
+            if keep:
+                self.returned.append(conn)
+        self.wake()
+
+    def _submit(self, conn):
+        with self.lock:
+            self.busy += 1
+        self.pool.submit(self._handle, conn)
+
+    def _set_accepting(self, accepting):
+        # A worker with every thread busy leaves new connections to the others
+        if accepting != self.accepting:
+            if accepting:
+                self.selector.register(self.listener, selectors.EVENT_READ)
+            else:
+                self.selector.unregister(self.listener)
+            self.accepting = accepting
+
+    def _read_channel(self):
+        data = self.channel.recv(65536)
+        if not data:
+            self.stop()  # the master is gone
+            return
+        self.inbox += data
+        *lines, self.inbox = self.inbox.split(b"\n")
+        for line in lines:
+            kind, _, rest = line.decode("utf-8").partition(" ")
+            if kind == "broadcast":
+                name, _, arg = rest.partition(" ")
+                try:
+                    _dispatch(name, arg)
+                except Exception:
+                    traceback.print_exc()
+
+    def run(self):
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.selector.register(self.channel, selectors.EVENT_READ)
+        while not self.stopping.is_set():
+            with self.lock:
+                returned, self.returned = self.returned, []
+                busy = self.busy
+            for conn in returned:
+                self.idle[conn.sock] = conn
+                self.selector.register(conn.sock, selectors.EVENT_READ)
+            self._set_accepting(busy < self.threads)
+
+            for key, _ in self.selector.select(timeout=1.0):
+                sock = key.fileobj
+                if sock is self.listener:
+                    try:
+                        client, address = self.listener.accept()
+                    except (BlockingIOError, InterruptedError):
+                        continue  # another worker took it
+                    client.setblocking(True)
+                    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    # Wait for the request line here, not on a pool thread
+                    conn = _Connection(client, address)
+                    self.idle[client] = conn
+                    self.selector.register(client, selectors.EVENT_READ)
+                elif sock is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif sock is self.channel:
+                    self._read_channel()
+                else:
+                    self.selector.unregister(sock)
+                    self._submit(self.idle.pop(sock))
+
+            deadline = time.monotonic() - config.WEB_KEEPALIVE
+            for sock, conn in list(self.idle.items()):
+                if conn.last_active < deadline:
+                    self.selector.unregister(sock)
+                    del self.idle[sock]
+                    conn.close()
+
+        # Graceful stop: no new connections, idle ones closed, busy ones
+        # finish their current request (they are not kept alive)
+        self.listener.close()
+        for conn in self.idle.values():
+            conn.close()
+        self.pool.shutdown(wait=True)
+
+def _run_worker(listener, channel, app_target, init_target, threads):
+    global _channel
+    signal.set_wakeup_fd(-1)
+    for signum in (signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_IGN)  # the master handles these
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    importlib.reload(config)
+    if init_target:
+        _load(init_target)()
+    app = _load(app_target)
+    _channel = channel
+    worker = _Worker(listener, channel, app, threads)
+    signal.signal(signal.SIGTERM, worker.stop)
+    channel.sendall(b"ready\n")
+    worker.run()
+
+# --- master ---
+
+class _Process:
+    def __init__(self, pid, channel, generation):
+        self.pid = pid
+        self.channel = channel
+        self.generation = generation
+        self.ready = False
+        self.deadline = None  # SIGKILL after this, once asked to stop
+        self.inbox = b""
+
+class _Master:
+    def __init__(self, listener, app_target, init_target, workers, threads):
+        self.listener = listener
+        self.app_target = app_target
+        self.init_target = init_target
+        self.workers = workers
+        self.threads = threads
+        self.generation = 0
+        self.processes = {}  # pid -> _Process
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.stopping = False
+
+    def spawn(self):
+        parent, child = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                parent.close()
+                self.selector.close()
+                self.wake_r.close()
+                self.wake_w.close()
+                for process in self.processes.values():
+                    process.channel.close()
+                _run_worker(self.listener, child, self.app_target, self.init_target, self.threads)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        child.close()
+        process = _Process(pid, parent, self.generation)
+        self.processes[pid] = process
+        self.selector.register(parent, selectors.EVENT_READ, process)
+
+    def terminate(self, process):
+        if process.deadline is None:
+            process.deadline = time.monotonic() + config.WEB_GRACEFUL_TIMEOUT
+            try:
+                os.kill(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(self):
+        print("Reloading: starting new workers")
+        self.generation += 1
+        for _ in range(self.workers):
+            self.spawn()
+
+    def stop(self):
+        if not self.stopping:
+            print("Shutting down: waiting for in-flight requests")
+            self.stopping = True
+        for process in self.processes.values():
+            self.terminate(process)
+
+    def relay(self, process):
+        try:
+            data = process.channel.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            self.selector.unregister(process.channel)
+            return
+        process.inbox += data
+        *lines, process.inbox = process.inbox.split(b"\n")
+        for line in lines:
+            if line == b"ready":
+                process.ready = True
+                self.retire_old()
+            elif line.startswith(b"broadcast "):
+                for other in self.processes.values():
+                    if other is not process and other.deadline is None:
+                        try:
+                            other.channel.sendall(line + b"\n")
+                        except OSError:
+                            pass
+
+    def retire_old(self):
+        # Once the whole new generation is ready, the previous one stops
+        current = [p for p in self.processes.values()
+                   if p.generation == self.generation and p.deadline is None]
+        if len(current) >= self.workers and all(p.ready for p in current):
+            for process in self.processes.values():
+                if process.generation < self.generation:
+                    self.terminate(process)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            process = self.processes.pop(pid, None)
+            if process is None:
+                continue
+            try:
+                self.selector.unregister(process.channel)
+            except (KeyError, ValueError):
+                pass
+            process.channel.close()
+            if self.stopping or process.deadline is not None:
+                continue
+            if not process.ready:
+                # Failed to start (bad code or config): don't respawn in a loop
+                print(f"Worker {pid} failed to start (exit status {os.waitstatus_to_exitcode(status)})")
+                if process.generation == self.generation and self.generation > 0:
+                    # A reload that doesn't come up: keep serving with the old workers
+                    self.generation -= 1
+                    for other in list(self.processes.values()):
+                        if other.generation > self.generation:
+                            self.terminate(other)
+                elif not any(p.ready for p in self.processes.values()):
+                    self.stop()
+                continue
+            if process.generation == self.generation:
+                print(f"Worker {pid} exited (status {os.waitstatus_to_exitcode(status)}), restarting")
+                self.spawn()
+
+    def run(self):
+        wake_r = self.wake_r
+        wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        signal.set_wakeup_fd(self.wake_w.fileno())
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, lambda *_: None)  # handled below via the wakeup fd
+        self.selector.register(wake_r, selectors.EVENT_READ)
+
+        for _ in range(self.workers):
+            self.spawn()
+        while self.processes:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.fileobj is wake_r:
+                    try:
+                        signums = wake_r.recv(64)
+                    except BlockingIOError:
+                        signums = b""
+                    for signum in signums:
+                        if signum == signal.SIGHUP and not self.stopping:
+                            self.reload()
+                        elif signum in (signal.SIGTERM, signal.SIGINT):
+                            self.stop()
+                else:
+                    self.relay(key.data)
+            self.reap()
+            now = time.monotonic()
+            for process in self.processes.values():
+                if process.deadline is not None and now > process.deadline:
+                    try:
+                        os.kill(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        signal.set_wakeup_fd(-1)
+        self.listener.close()
+
+def serve(app, host="0.0.0.0", port=5001, workers=None, threads=None, init=None):
+    """
+    Serves the WSGI app named by `app` ("module:attribute") until SIGTERM.
+    `init` ("module:function") runs in each worker before the app is imported.
+    """
+    workers = workers or config.WEB_WORKERS or os.cpu_count() or 1
+    threads = threads or config.WEB_THREADS
+    listener = socket.create_server((host, port), backlog=config.WEB_BACKLOG)
+    listener.setblocking(False)  # every worker wakes up; one wins the accept()
+    print(f"Serving {app} on http://{host}:{port} ({workers} workers x {threads} threads, pid {os.getpid()})")
+    _Master(listener, app, init, workers, threads).run()
@@ -1,28 +1,264 @@
 import json
 import datetime
+import struct
+from . import record
 
-def create_store_payload(username, app_name, app_username, user_password, encrypted_secret):
-    payload = {
+# Framed protocol: a connection opens with HELLO (magic, highest version,
+# newline) and the server answers with the version it picked. Then every
+# request and response is FRAME_HEADER (body length, request id) + body,
+# where bodies are the same JSON requests / responses as the legacy
+# protocol, or from version 2 on optionally binary (see below). Responses
+# carry the request's id and may arrive out of order. Legacy requests
+# always start with "{", so servers tell the two apart from the first
+# byte; a legacy server answers HELLO with "ERR: ...".
+FRAME_MAGIC = b"PPF"
+FRAME_VERSION = 2
+FRAME_HEADER = struct.Struct(">II")
+HELLO_SIZE = len(FRAME_MAGIC) + 2
+
+def create_payload(app_username, encrypted_secret):
+    return {
         "app_username": app_username,
         "password": str(encrypted_secret),
         "timestamp": datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     }
-    return json.dumps({
+
+def store_request(username, app_name, user_password, payload):
+    return {
         "username": username,
         "user_password": user_password,
         "app": app_name,
         "payload": payload
-    })
+    }
 
-def create_retrieve_request(username, app_name, user_password):
-    return json.dumps({
+def retrieve_request(username, app_name, user_password):
+    return {
         "command": "REQUEST_SECRET",
         "username": username,
         "user_password": user_password,
         "app": app_name
-    })
+    }
+
+def batch_retrieve_request(username, app_names, user_password):
+    return {
+        "command": "REQUEST_SECRETS",
+        "username": username,
+        "user_password": user_password,
+        "apps": list(app_names)
+    }
+
+def batch_store_request(username, user_password, items):
+    """`items` is a list of (app_name, payload) pairs."""
+    return {
+        "command": "STORE_BATCH",
+        "username": username,
+        "user_password": user_password,
+        "items": [{"app": app_name, "payload": payload} for app_name, payload in items]
+    }
+
+def create_store_payload(username, app_name, app_username, user_password, encrypted_secret):
+    payload = create_payload(app_username, encrypted_secret)
+    return json.dumps(store_request(username, app_name, user_password, payload))
+
+def create_retrieve_request(username, app_name, user_password):
+    return json.dumps(retrieve_request(username, app_name, user_password))
+
+def create_batch_retrieve_request(username, app_names, user_password):
+    return json.dumps(batch_retrieve_request(username, app_names, user_password))
+
+def create_batch_store_request(username, user_password, items):
+    """Newline-terminated for streaming."""
+    return json.dumps(batch_store_request(username, user_password, items)) + "\n"
 
 def parse_message(data_bytes):
     if not data_bytes:
         return None
-    return json.loads(data_bytes.decode("utf-8"))
+    if is_binary(data_bytes):
+        return decode_binary_request(data_bytes)
+    return json.loads(data_bytes)
+
+# Binary encoding (framed protocol version 2). A body starting with a NUL
+# byte is a sequence of FIELD (tag, length) + value. Strings are utf-8;
+# payloads travel as lib.record blobs, so ciphertext is raw bytes rather
+# than armored / base64 text. Decoding slices a memoryview of the body and
+# only materializes the final values.
+#
+#   request   [F_COMMAND] F_USERNAME F_USER_PASSWORD (F_APP [F_PAYLOAD])*
+#   response  F_TEXT | F_PAYLOAD | (F_APP (F_PAYLOAD | F_NONE))+ | F_NO_APPS | F_JSON
+#
+# An empty body means "no payload" in both encodings; an apps response for
+# no apps at all is F_NO_APPS.
+BINARY_MARK = b"\0"
+FIELD = struct.Struct(">BI")
+
+F_COMMAND = 1
+F_USERNAME = 2
+F_USER_PASSWORD = 3
+F_APP = 4
+F_PAYLOAD = 5
+F_NONE = 6
+F_TEXT = 7
+F_JSON = 8
+F_NO_APPS = 9
+
+def is_binary(data):
+    return data[:1] == BINARY_MARK
+
+def _field(tag, value):
+    return FIELD.pack(tag, len(value)) + value
+
+def _fields(data):
+    """Yields (tag, memoryview of the value) for each field of a binary body."""
+    view = memoryview(data)
+    offset = 1
+    end = len(view)
+    while offset < end:
+        if end - offset < FIELD.size:
+            raise ValueError("truncated field header")
+        tag, length = FIELD.unpack_from(view, offset)
+        offset += FIELD.size
+        if length > end - offset:
+            raise ValueError("truncated field")
+        yield tag, view[offset:offset + length]
+        offset += length
+
+def _pairs(fields):
+    """Groups F_APP fields with the F_PAYLOAD / F_NONE that follows each."""
+    pairs = []
+    for tag, value in fields:
+        if tag == F_APP:
+            pairs.append([str(value, "utf-8"), None])
+        elif tag == F_PAYLOAD:
+            if not pairs:
+                pairs.append([None, None])
+            pairs[-1][1] = record.decode(value)
+    return pairs
+
+def encode_binary_request(message):
+    parts = [BINARY_MARK]
+    if message.get("command"):
+        parts.append(_field(F_COMMAND, message["command"].encode("ascii")))
+    parts.append(_field(F_USERNAME, message["username"].encode("utf-8")))
+    parts.append(_field(F_USER_PASSWORD, message["user_password"].encode("utf-8")))
+    if "items" in message:
+        for item in message["items"]:
+            parts.append(_field(F_APP, item["app"].encode("utf-8")))
+            parts.append(_field(F_PAYLOAD, record.encode(item["payload"])))
+    elif "apps" in message:
+        parts.extend(_field(F_APP, app_name.encode("utf-8")) for app_name in message["apps"])
+    else:
+        parts.append(_field(F_APP, message["app"].encode("utf-8")))
+        if "payload" in message:
+            parts.append(_field(F_PAYLOAD, record.encode(message["payload"])))
+    return b"".join(parts)
+
+def decode_binary_request(data):
+    """Binary request -> the same dict the JSON request decodes to."""
+    message = {}
+    rest = []
+    for tag, value in _fields(data):
+        if tag == F_COMMAND:
+            message["command"] = str(value, "ascii")
+        elif tag == F_USERNAME:
+            message["username"] = str(value, "utf-8")
+        elif tag == F_USER_PASSWORD:
+            message["user_password"] = str(value, "utf-8")
+        else:
+            rest.append((tag, value))
+    pairs = _pairs(rest)
+    command = message.get("command")
+    if command == "STORE_BATCH":
+        message["items"] = [{"app": app_name, "payload": payload} for app_name, payload in pairs]
+    elif command == "REQUEST_SECRETS":
+        message["apps"] = [app_name for app_name, _ in pairs]
+    elif pairs:
+        message["app"] = pairs[0][0]
+        if pairs[0][1] is not None:
+            message["payload"] = pairs[0][1]
+    return message
+
+def encode_request(message, binary=False):
+    if binary:
+        return encode_binary_request(message)
+    body = json.dumps(message)
+    return (body + "\n" if message.get("command") == "STORE_BATCH" else body).encode("utf-8")
+
+# Server responses. `binary` follows the encoding of the request; the JSON
+# forms are exactly what the legacy protocol sends.
+
+def encode_text(text, binary=False):
+    """ACK / ERR responses."""
+    if binary:
+        return BINARY_MARK + _field(F_TEXT, text.encode("utf-8"))
+    return text.encode("utf-8")
+
+def encode_payload(data, binary=False):
+    """`data` is a stored payload as JSON text, or None."""
+    if not data:
+        return b""
+    if binary:
+        return BINARY_MARK + _field(F_PAYLOAD, record.encode(json.loads(data)))
+    return data.encode("utf-8")
+
+def encode_apps(results, binary=False):
+    """`results` maps app names to stored payload JSON text or None."""
+    if not binary:
+        return json.dumps({"apps": results}).encode("utf-8")
+    if not results:
+        return BINARY_MARK + _field(F_NO_APPS, b"")
+    parts = [BINARY_MARK]
+    for app_name, data in results.items():
+        parts.append(_field(F_APP, app_name.encode("utf-8")))
+        if data:
+            parts.append(_field(F_PAYLOAD, record.encode(json.loads(data))))
+        else:
+            parts.append(_field(F_NONE, b""))
+    return b"".join(parts)
+
+def encode_summary(summary, binary=False):
+    """STORE_BATCH results (newline-terminated JSON in the legacy protocol)."""
+    body = json.dumps(summary).encode("utf-8")
+    if binary:
+        return BINARY_MARK + _field(F_JSON, body)
+    return body + b"\n"
+
+def parse_response(data):
+    """
+    Response body in either encoding -> None (no payload), str (ACK / ERR),
+    a payload dict, {"apps": {app: payload dict or None}}, or a summary dict.
+    """
+    if not data:
+        return None
+    if not is_binary(data):
+        if not data.startswith(b"{"):
+            return data.decode("utf-8")
+        response = json.loads(data)
+        if isinstance(response.get("apps"), dict):
+            response["apps"] = {app_name: json.loads(payload) if payload else None
+                                for app_name, payload in response["apps"].items()}
+        return response
+    fields = list(_fields(data))
+    tag, value = fields[0] if fields else (F_NONE, b"")
+    if tag == F_TEXT:
+        return str(value, "utf-8")
+    if tag == F_JSON:
+        return json.loads(bytes(value))
+    if tag == F_PAYLOAD:
+        return record.decode(value)
+    if tag == F_APP:
+        return {"apps": dict(_pairs(fields))}
+    if tag == F_NO_APPS:
+        return {"apps": {}}
+    return None
+
+def hello(version=FRAME_VERSION):
+    return FRAME_MAGIC + bytes([version]) + b"\n"
+
+def parse_hello(data):
+    """Returns the version in a HELLO, or None if `data` isn't one."""
+    if len(data) != HELLO_SIZE or not data.startswith(FRAME_MAGIC) or not data.endswith(b"\n"):
+        return None
+    return data[len(FRAME_MAGIC)]
+
+def encode_frame(request_id, body):
+    return FRAME_HEADER.pack(len(body), request_id) + body
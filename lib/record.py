@@ -0,0 +1,215 @@
+"""
+Compact on-disk record for one stored payload (db/<user>/<app>/secret.bin).
+
+    header   ">3sBBBHII16s": magic "PPR", version, flags, encoding,
+             app_username length, extra length, ciphertext length, timestamp
+    body     app_username (utf-8) | extra fields (JSON) | ciphertext bytes
+
+Version 2 added ENC_PGP_CHECKSUM. A record is written with the lowest
+version that knows its encoding, so readers of version 1 still read
+everything else and reject (rather than misread) the new encoding.
+
+The ciphertext is kept as raw bytes: PGP armor and the AEAD base64 text
+form are stripped on write and rebuilt on read. PGP keeps the armor's
+CRC24 next to the packets so neither direction has to recompute it. A
+ciphertext that would not round-trip byte for byte is stored as its text
+instead. Everything metadata
+needs sits in the first few hundred bytes, so read_metadata() is one pread.
+"""
+import base64
+import json
+import os
+import re
+import struct
+from . import aead
+
+MAGIC = b"PPR"
+VERSION = 2
+HEADER = struct.Struct(">3sBBBHII16s")
+METADATA_READ = 512  # one pread covers the header and any sane app_username
+
+# flags: which of the standard payload fields are present
+HAS_APP_USERNAME = 0x01
+HAS_TIMESTAMP = 0x02
+HAS_PASSWORD = 0x04
+
+# encoding of the ciphertext bytes
+ENC_TEXT = 0
+ENC_PGP = 1             # packets only; the checksum is recomputed on read
+ENC_AEAD = 2
+ENC_PGP_CHECKSUM = 3    # armor checksum (3 bytes) + packets (version 2)
+
+# version -> highest encoding it may use
+_LAST_ENCODING = {1: ENC_AEAD, 2: ENC_PGP_CHECKSUM}
+
+PGP_BEGIN = "-----BEGIN PGP MESSAGE-----"
+PGP_END = "-----END PGP MESSAGE-----"
+_PGP_ARMOR = re.compile(
+    r"-----BEGIN PGP MESSAGE-----\n\n([A-Za-z0-9+/=\n]+?)\n=([A-Za-z0-9+/]{4})\n-----END PGP MESSAGE-----\n?\Z"
+)
+
+class RecordError(ValueError):
+    pass
+
+def _crc24_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+_CRC24_TABLE = _crc24_table()
+
+def _crc24(data):
+    # RFC 4880 section 6.1, table-driven
+    crc = 0xB704CE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ _CRC24_TABLE[((crc >> 16) ^ byte) & 0xFF]
+    return crc
+
+def armor_pgp(raw, checksum=None):
+    """`checksum` is the 3-byte CRC24 if already known."""
+    body = base64.b64encode(raw).decode("ascii")
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    checksum = base64.b64encode(checksum or _crc24(raw).to_bytes(3, "big")).decode("ascii")
+    return "\n".join([PGP_BEGIN, ""] + lines + ["=" + checksum, PGP_END]) + "\n"
+
+def _dearmor_pgp(text):
+    """Returns (checksum, packets), or None unless armor_pgp would rebuild `text` exactly."""
+    match = _PGP_ARMOR.match(text)
+    if not match:
+        return None
+    try:
+        raw = base64.b64decode(match.group(1).replace("\n", ""), validate=True)
+        checksum = base64.b64decode(match.group(2), validate=True)
+    except ValueError:
+        return None
+    return (checksum, raw) if armor_pgp(raw, checksum) == text else None
+
+def _pack_ciphertext(text):
+    if text.startswith(PGP_BEGIN):
+        dearmored = _dearmor_pgp(text)
+        if dearmored is not None:
+            checksum, raw = dearmored
+            return ENC_PGP_CHECKSUM, checksum + raw
+    elif aead.is_aead_text(text):
+        try:
+            raw = aead.from_text(text)
+        except aead.DecryptionError:
+            raw = None
+        if raw is not None and aead.to_text(raw) == text:
+            return ENC_AEAD, raw
+    return ENC_TEXT, text.encode("utf-8")
+
+def _unpack_ciphertext(encoding, raw):
+    if encoding == ENC_PGP_CHECKSUM:
+        return armor_pgp(raw[3:], raw[:3])
+    if encoding == ENC_PGP:
+        return armor_pgp(raw)
+    if encoding == ENC_AEAD:
+        return aead.to_text(raw)
+    return raw.decode("utf-8")
+
+def encode(payload):
+    """Serializes a payload dict (see protocol.create_payload) to record bytes."""
+    extra = dict(payload)
+    flags = 0
+
+    app_username = extra.pop("app_username", None)
+    if isinstance(app_username, str):
+        flags |= HAS_APP_USERNAME
+        app_bytes = app_username.encode("utf-8")
+    else:
+        if "app_username" in payload:
+            extra["app_username"] = app_username
+        app_bytes = b""
+
+    timestamp = extra.pop("timestamp", None)
+    ts_bytes = timestamp.encode("utf-8") if isinstance(timestamp, str) else None
+    if ts_bytes is not None and len(ts_bytes) <= 16 and b"\0" not in ts_bytes:
+        flags |= HAS_TIMESTAMP
+    else:
+        if "timestamp" in payload:
+            extra["timestamp"] = timestamp
+        ts_bytes = b""
+
+    password = extra.pop("password", None)
+    if isinstance(password, str):
+        flags |= HAS_PASSWORD
+        encoding, data = _pack_ciphertext(password)
+    else:
+        if "password" in payload:
+            extra["password"] = password
+        encoding, data = ENC_TEXT, b""
+
+    extra_bytes = json.dumps(extra, separators=(",", ":")).encode("utf-8") if extra else b""
+    if len(app_bytes) > 0xFFFF:
+        raise RecordError("app_username too long")
+    version = 1 if encoding <= _LAST_ENCODING[1] else VERSION
+    header = HEADER.pack(MAGIC, version, flags, encoding, len(app_bytes),
+                         len(extra_bytes), len(data), ts_bytes)
+    return header + app_bytes + extra_bytes + data
+
+def _parse_header(buf):
+    if len(buf) < HEADER.size:
+        raise RecordError("truncated record header")
+    magic, version, flags, encoding, app_len, extra_len, data_len, ts = HEADER.unpack_from(buf)
+    if magic != MAGIC or version not in _LAST_ENCODING:
+        raise RecordError("not a payload record")
+    if encoding > _LAST_ENCODING[version]:
+        raise RecordError(f"unknown ciphertext encoding {encoding}")
+    return flags, encoding, app_len, extra_len, data_len, ts.rstrip(b"\0")
+
+def decode(buf):
+    """Record bytes -> payload dict, with the ciphertext back in its text form."""
+    flags, encoding, app_len, extra_len, data_len, ts = _parse_header(buf)
+    offset = HEADER.size
+    if len(buf) != offset + app_len + extra_len + data_len:
+        raise RecordError("record length mismatch")
+    app_bytes = buf[offset:offset + app_len]
+    offset += app_len
+    extra_bytes = buf[offset:offset + extra_len]
+    offset += extra_len
+
+    payload = {}
+    if flags & HAS_APP_USERNAME:
+        payload["app_username"] = bytes(app_bytes).decode("utf-8")
+    if flags & HAS_PASSWORD:
+        payload["password"] = _unpack_ciphertext(encoding, bytes(buf[offset:]))
+    if flags & HAS_TIMESTAMP:
+        payload["timestamp"] = ts.decode("utf-8")
+    if extra_bytes:
+        payload.update(json.loads(bytes(extra_bytes)))
+    return payload
+
+def read_metadata(path):
+    """
+    Returns {"app_username", "timestamp", "length"} from the record header
+    without reading the ciphertext. Fields kept in the extra JSON (unusual
+    payloads only) cost a second pread.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        buf = os.pread(fd, METADATA_READ, 0)
+        flags, _, app_len, extra_len, data_len, ts = _parse_header(buf)
+        needed = HEADER.size + app_len + extra_len
+        if len(buf) < needed:
+            buf += os.pread(fd, needed - len(buf), len(buf))
+    finally:
+        os.close(fd)
+
+    meta = {"length": data_len}
+    if flags & HAS_APP_USERNAME:
+        meta["app_username"] = buf[HEADER.size:HEADER.size + app_len].decode("utf-8")
+    if flags & HAS_TIMESTAMP:
+        meta["timestamp"] = ts.decode("utf-8")
+    if extra_len:
+        extra = json.loads(buf[HEADER.size + app_len:needed])
+        for key in ("app_username", "timestamp"):
+            if key in extra:
+                meta[key] = extra[key]
+    return meta
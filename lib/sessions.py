@@ -0,0 +1,191 @@
+"""
+Server-side login sessions for the web interface.
+
+The browser holds only an opaque random token. The session behind it records
+the username that passed auth.check_auth() at login, so later requests don't
+run PBKDF2 again; lib.storage accepts a Session in place of the password.
+
+A session ends on logout, after SESSION_IDLE_TIMEOUT without a request,
+SESSION_MAX_AGE after login, or when the user's auth.json is rewritten (a
+password change anywhere). Beyond SESSION_MAX_COUNT sessions the least
+recently used one is dropped.
+
+Sessions are rows of one SQLite table (config.SESSIONS_PATH), keyed by a
+hash of the token, so every pre-fork worker sees them. Each process keeps
+the sessions it serves in memory: a request costs a dict lookup and a stat()
+of auth.json, and the table is read on a miss and written at login, logout
+and at most every SESSION_TOUCH_INTERVAL per session.
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from . import auth, config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id        TEXT PRIMARY KEY,
+    username  TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_seen REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_cache = OrderedDict()  # id -> Session, least recently used first
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+class Session:
+    """An authenticated login. `id` doubles as the scope of its cached keys."""
+
+    __slots__ = ("id", "username", "signature", "created", "last_seen", "touched")
+
+    def __init__(self, id, username, signature, created, last_seen):
+        self.id = id
+        self.username = username
+        self.signature = signature
+        self.created = created
+        self.last_seen = last_seen
+        self.touched = last_seen  # last_seen as stored in the table
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != config.SESSIONS_PATH:
+        directory = os.path.dirname(config.SESSIONS_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(config.SESSIONS_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.path = config.SESSIONS_PATH
+    return conn
+
+def _session_id(token):
+    # The table never holds a usable token
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _auth_signature(username):
+    signature = auth.credentials_signature(username)
+    return ":".join(map(str, signature)) if signature else None
+
+def _expired(session, now):
+    return (now - session.last_seen > config.SESSION_IDLE_TIMEOUT
+            or now - session.created > config.SESSION_MAX_AGE)
+
+def _remember(session):
+    with _lock:
+        _cache[session.id] = session
+        _cache.move_to_end(session.id)
+        while len(_cache) > config.SESSION_MAX_COUNT:
+            _cache.popitem(last=False)
+
+def _load(session_id):
+    row = _connect().execute(
+        "SELECT username, signature, created, last_seen FROM sessions WHERE id = ?", (session_id,)
+    ).fetchone()
+    return Session(session_id, *row) if row else None
+
+def _delete(session_id):
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+def create(username):
+    """
+    Starts a session for a user whose password was just verified.
+    Returns (token, Session); the token goes to the client, never to disk.
+    """
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    session = Session(_session_id(token), username, _auth_signature(username), now, now)
+    conn = _connect()
+    with conn:
+        conn.execute(
+            "DELETE FROM sessions WHERE last_seen < ? OR created < ?",
+            (now - config.SESSION_IDLE_TIMEOUT, now - config.SESSION_MAX_AGE)
+        )
+        conn.execute(
+            "INSERT INTO sessions (id, username, signature, created, last_seen) VALUES (?, ?, ?, ?, ?)",
+            (session.id, username, session.signature, now, now)
+        )
+        evicted = conn.execute(
+            "DELETE FROM sessions WHERE id IN "
+            "(SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (config.SESSION_MAX_COUNT,)
+        ).rowcount
+    with _lock:
+        _stats["evictions"] += evicted
+    _remember(session)
+    return token, session
+
+def get(token):
+    """Returns the live Session for a token, or None."""
+    if not token:
+        return None
+    session_id = _session_id(token)
+    now = time.time()
+    with _lock:
+        session = _cache.get(session_id)
+        if session is not None:
+            _cache.move_to_end(session_id)
+            _stats["hits"] += 1
+        else:
+            _stats["misses"] += 1
+
+    if session is not None and (_expired(session, now) or session.signature != _auth_signature(session.username)):
+        # Another worker may have kept it alive since, or re-keyed it after a
+        # password change made there: the table decides
+        forget(session_id)
+        session = None
+    if session is None:
+        session = _load(session_id)
+        if session is None:
+            return None
+        if _expired(session, now) or session.signature != _auth_signature(session.username):
+            _delete(session_id)
+            with _lock:
+                _stats["expired"] += 1
+            return None
+        _remember(session)
+
+    session.last_seen = now
+    if now - session.touched > config.SESSION_TOUCH_INTERVAL:
+        conn = _connect()
+        with conn:
+            found = conn.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (now, session_id)).rowcount
+        if not found:
+            # Evicted or logged out through another process since we cached it
+            forget(session_id)
+            return None
+        session.touched = now
+    return session
+
+def rekey(session):
+    """Keeps `session` valid after its user changed the password through it."""
+    session.signature = _auth_signature(session.username)
+    conn = _connect()
+    with conn:
+        conn.execute("UPDATE sessions SET signature = ? WHERE id = ?", (session.signature, session.id))
+
+def end(session):
+    """Logs a session out here; other processes must forget(session.id)."""
+    _delete(session.id)
+    forget(session.id)
+
+def forget(session_id):
+    """Drops a session from this process's memory (not from the table)."""
+    with _lock:
+        _cache.pop(session_id, None)
+
+def stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["cached"] = len(_cache)
+    return stats
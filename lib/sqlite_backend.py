@@ -0,0 +1,142 @@
+"""
+SQLite storage backend: every payload is a row in one WAL-mode database,
+keyed by (username, app). See lib.storage for the backend interface.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from . import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS secrets (
+    username     TEXT NOT NULL,
+    app          TEXT NOT NULL,
+    app_username TEXT NOT NULL,
+    timestamp    TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    size         INTEGER NOT NULL,
+    modified     REAL NOT NULL,
+    PRIMARY KEY (username, app)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    username TEXT PRIMARY KEY,
+    version  INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+_local = threading.local()
+_cache_lock = threading.Lock()
+# username -> (version, apps dict), same shape as lib.manifest
+_cache = {}
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != config.SQLITE_PATH:
+        directory = os.path.dirname(config.SQLITE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(config.SQLITE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.path = config.SQLITE_PATH
+    return conn
+
+def _bump_version(conn, username):
+    conn.execute(
+        "INSERT INTO versions (username, version) VALUES (?, 1) "
+        "ON CONFLICT(username) DO UPDATE SET version = version + 1",
+        (username,)
+    )
+
+def _location(username, app_name):
+    return f"sqlite:{username}/{app_name}"
+
+def write(username, items):
+    conn = _connect()
+    rows = []
+    now = time.time()
+    for app_name, payload in items:
+        data = json.dumps(payload)
+        rows.append((
+            username, app_name,
+            payload.get("app_username", "N/A"), payload.get("timestamp", "Unknown"),
+            data, len(data.encode("utf-8")), now
+        ))
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO secrets "
+            "(username, app, app_username, timestamp, payload, size, modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        _bump_version(conn, username)
+    return [(app_name, _location(username, app_name), None) for app_name, _ in items]
+
+def read(username, app_name):
+    row = _connect().execute(
+        "SELECT payload FROM secrets WHERE username = ? AND app = ?", (username, app_name)
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], _location(username, app_name)
+
+def read_many(username, app_names):
+    results = dict.fromkeys(app_names)
+    conn = _connect()
+    names = list(results)
+    # Stay well below SQLite's bound-parameter limit
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for app_name, payload in conn.execute(
+            f"SELECT app, payload FROM secrets WHERE username = ? AND app IN ({placeholders})",
+            [username] + chunk
+        ):
+            results[app_name] = payload
+    return results
+
+def delete(username, app_name):
+    conn = _connect()
+    with conn:
+        cursor = conn.execute("DELETE FROM secrets WHERE username = ? AND app = ?", (username, app_name))
+        if cursor.rowcount:
+            _bump_version(conn, username)
+    return cursor.rowcount > 0
+
+def snapshot(username):
+    conn = _connect()
+    row = conn.execute("SELECT version FROM versions WHERE username = ?", (username,)).fetchone()
+    version = row[0] if row else 0
+    with _cache_lock:
+        cached = _cache.get(username)
+        if cached and cached[0] == version:
+            return cached
+    apps = {
+        name: {
+            "name": name,
+            "size": size,
+            "modified": modified,
+            "app_username": app_username,
+            "timestamp": timestamp
+        }
+        for name, size, modified, app_username, timestamp in conn.execute(
+            "SELECT app, size, modified, app_username, timestamp FROM secrets WHERE username = ?",
+            (username,)
+        )
+    }
+    with _cache_lock:
+        _cache[username] = (version, apps)
+    return version, apps
+
+def list_apps(username):
+    return list(snapshot(username)[1].values())
+
+def metadata(username, app_name):
+    return snapshot(username)[1].get(app_name)
+
+def list_users():
+    return [row[0] for row in _connect().execute("SELECT DISTINCT username FROM secrets ORDER BY username")]
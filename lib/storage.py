@@ -1,37 +1,149 @@
-import os
-import json
-from . import auth
+"""
+Storage facade: authentication plus a pluggable backend chosen by
+config.STORAGE_BACKEND. A backend is a module providing:
 
-def store_payload(username, app_name, user_password, payload):
-    # Authenticate / Register
-    if not auth.save_auth(username, user_password):
-        raise PermissionError("Authentication failed")
+    write(username, [(app_name, payload), ...]) -> [(app_name, location, error), ...]
+    read(username, app_name)                    -> (payload_json_str, location) or None
+    read_many(username, app_names)              -> {app_name: payload_json_str or None}
+    delete(username, app_name)                  -> bool
+    snapshot(username)                          -> (version, {app_name: metadata})
+    list_apps(username)                         -> [metadata, ...]
+    metadata(username, app_name)                -> metadata or None
+    list_users()                                -> [username, ...]
 
-    # Ensure directory exists: db/username/app_name
-    dir_path = os.path.join("db", username, app_name)
-    os.makedirs(dir_path, exist_ok=True)
+where metadata is a dict with name, size, modified, app_username, timestamp.
+Backends that keep prior versions also provide:
 
-    # Fixed filename
-    filename = os.path.join(dir_path, "secret.json")
+    history(username, app_name)               -> [{version, modified, size}, ...]
+    read_version(username, app_name, version) -> (payload_json_str, location) or None
 
-    # Save payload
-    with open(filename, "w") as f:
-        json.dump(payload, f, indent=2)
-    
-    return filename
+Credentials (db/<user>/auth.json) are handled by lib.auth for every backend.
+App names are checked here (check_app_name) before any backend sees them,
+so backends may put them into paths.
+Wherever a user_password is taken, a lib.sessions.Session of that user may be
+passed instead: it was verified at login, so no KDF runs.
+"""
+from . import auth, config, fs_backend, log_backend, metrics, sessions, sqlite_backend
 
-def retrieve_latest_payload(username, app_name, user_password):
-    # Authenticate
+BACKENDS = {
+    "fs": fs_backend,
+    "sqlite": sqlite_backend,
+    "log": log_backend,
+}
+
+class InvalidAppName(ValueError):
+    """An app name that is not allowed; nothing was read or written."""
+
+def get_backend(name=None):
+    return BACKENDS[name or config.STORAGE_BACKEND]
+
+def check_app_name(app_name):
+    # Names become directories (db/<user>/<app>): no separators, no ".", ".."
+    # or hidden names, which would leave the user's directory or clash with
+    # its internal entries (.manifests, .trees, .blobs)
+    if (not isinstance(app_name, str) or not app_name or app_name.startswith(".")
+            or any(c in app_name for c in "/\\\0")):
+        raise InvalidAppName("App names must be non-empty, must not start with '.' "
+                             "and must not contain '/', '\\' or NUL")
+
+def _authenticate_session(username, session):
+    if session.username != username:
+        raise PermissionError("Authentication failed")
+
+def _authenticate_writer(username, user_password):
+    if isinstance(user_password, sessions.Session):
+        return _authenticate_session(username, user_password)
+    # Authenticate (first store for an unknown user registers it, as before)
+    if not auth.user_exists(username):
+        auth.register_user(username, user_password)
+    if not auth.check_auth(username, user_password):
+        raise PermissionError("Authentication failed")
+
+def _authenticate(username, user_password):
+    if isinstance(user_password, sessions.Session):
+        return _authenticate_session(username, user_password)
     if not auth.check_auth(username, user_password):
         raise PermissionError("Authentication failed")
 
-    # Path: db/username/app_name/secret.json
-    file_path = os.path.join("db", username, app_name, "secret.json")
-    
-    if not os.path.exists(file_path):
-        return None
+def store_payload(username, app_name, user_password, payload):
+    check_app_name(app_name)
+    _authenticate_writer(username, user_password)
+    with metrics.stage("write"):
+        _, location, error = get_backend().write(username, [(app_name, payload)])[0]
+    if error:
+        raise OSError(error)
+    return location
+
+def store_many_payloads(username, user_password, items):
+    """
+    Authenticates once and stores several (app_name, payload) pairs.
+    Returns a list of (app_name, location, error) in input order; items
+    with invalid names are not stored and get an error.
+    """
+    _authenticate_writer(username, user_password)
+    errors = []
+    for app_name, _ in items:
+        try:
+            check_app_name(app_name)
+            errors.append(None)
+        except InvalidAppName as e:
+            errors.append(str(e))
+    valid = [item for item, error in zip(items, errors) if error is None]
+    with metrics.stage("write"):
+        written = iter(get_backend().write(username, valid) if valid else [])
+    return [
+        next(written) if error is None else (app_name, None, error)
+        for (app_name, _), error in zip(items, errors)
+    ]
+
+def retrieve_latest_payload(username, app_name, user_password):
+    check_app_name(app_name)
+    _authenticate(username, user_password)
+    with metrics.stage("read"):
+        return get_backend().read(username, app_name)
+
+def retrieve_many_payloads(username, app_names, user_password):
+    """Authenticates once and reads several apps. Missing apps map to None."""
+    for app_name in app_names:
+        check_app_name(app_name)
+    _authenticate(username, user_password)
+    with metrics.stage("read"):
+        return get_backend().read_many(username, app_names)
+
+def delete_payload(username, app_name, user_password):
+    check_app_name(app_name)
+    _authenticate(username, user_password)
+    with metrics.stage("delete"):
+        return get_backend().delete(username, app_name)
+
+def supports_history():
+    return hasattr(get_backend(), "history")
+
+def payload_history(username, app_name, user_password):
+    """Retained versions of an app. Raises NotImplementedError if the backend keeps none."""
+    check_app_name(app_name)
+    _authenticate(username, user_password)
+    backend = get_backend()
+    if not hasattr(backend, "history"):
+        raise NotImplementedError(f"Storage backend '{config.STORAGE_BACKEND}' keeps no history")
+    return backend.history(username, app_name)
+
+def retrieve_payload_version(username, app_name, version, user_password):
+    check_app_name(app_name)
+    _authenticate(username, user_password)
+    backend = get_backend()
+    if not hasattr(backend, "read_version"):
+        raise NotImplementedError(f"Storage backend '{config.STORAGE_BACKEND}' keeps no history")
+    with metrics.stage("read"):
+        return backend.read_version(username, app_name, version)
+
+def snapshot(username):
+    return get_backend().snapshot(username)
+
+def list_apps(username):
+    """Metadata (name, size, modified, app_username, timestamp) for every app."""
+    return get_backend().list_apps(username)
 
-    with open(file_path, "r") as f:
-        data = f.read()
-    
-    return data, file_path
+def get_metadata(username, app_name):
+    check_app_name(app_name)
+    return get_backend().metadata(username, app_name)
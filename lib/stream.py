@@ -0,0 +1,321 @@
+"""
+Chunked, streaming encryption for large secrets and attachments ("blobs").
+
+    header   magic "PPB" | version | log2(N) | r | p | chunk size | salt[16]
+             | nonce prefix[7] | key check[16]
+    chunks   ChaCha20-Poly1305(chunk plaintext), each chunk_size + 16 bytes
+             except the last, which is shorter (possibly just its tag)
+
+Chunks use the STREAM construction: chunk i is sealed with nonce
+prefix || i (32-bit) || last-flag, with the header as associated data, so
+chunks cannot be reordered, dropped, or cut off at a chunk boundary. All
+chunks but the last have the same size, so a byte range maps straight to
+the chunks that hold it and reads touch nothing else.
+
+Uploads append whole chunks to db/<user>/.blobs/<name>.blob.part; a final
+request seals the remainder as the last chunk and renames the file into
+place. Plaintext never reaches disk, so bytes that don't fill a chunk in a
+non-final request are dropped and the returned offset tells the client
+where to resume. Memory use is one chunk, whatever the blob size.
+
+Uploads and deletes of one blob take a per-blob flock (<name>.blob.lock),
+so they are serialized across threads and pre-fork workers; a request that
+finds the blob busy fails with UploadInProgress instead of waiting.
+Downloads take no lock: a reader keeps to the file it opened.
+"""
+import hashlib
+import hmac
+import os
+import re
+import struct
+from contextlib import contextmanager
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from . import aead, config, durable, metrics
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+MAGIC = b"PPB"
+VERSION = 1
+TAG_SIZE = 16
+_HEADER = struct.Struct(">3sBBBBI16s7s16s")
+HEADER_SIZE = _HEADER.size
+
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # bound on the chunk size a stored header may claim
+BLOBS_DIR = ".blobs"
+_NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.\-]{0,127}$")
+
+class StreamError(Exception):
+    pass
+
+class OffsetMismatch(StreamError):
+    """An upload continued from somewhere other than the committed offset."""
+    def __init__(self, offset):
+        super().__init__(f"upload is at offset {offset}")
+        self.offset = offset
+
+class UploadInProgress(StreamError):
+    """Another request is uploading or deleting the same blob."""
+
+def check_name(name):
+    if not isinstance(name, str) or not _NAME.match(name):
+        raise ValueError("Blob names are 1-128 letters, digits, '_', '-' or '.', not starting with '.' or '-'")
+
+def _blob_dir(username):
+    return os.path.join("db", username, BLOBS_DIR)
+
+def _blob_path(username, name):
+    return os.path.join(_blob_dir(username), name + ".blob")
+
+def _part_path(username, name):
+    return _blob_path(username, name) + ".part"
+
+@contextmanager
+def _blob_lock(username, name):
+    fd = os.open(_blob_path(username, name) + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadInProgress(f"blob {name} is being written by another request")
+        yield
+    finally:
+        os.close(fd)
+
+def _nonce(prefix, index, last):
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+class _Header:
+    __slots__ = ("raw", "params", "chunk_size", "salt", "prefix", "check")
+
+    @classmethod
+    def parse(cls, raw):
+        if len(raw) != HEADER_SIZE:
+            raise StreamError("truncated blob header")
+        magic, version, log_n, r, p, chunk_size, salt, prefix, check = _HEADER.unpack(raw)
+        if magic != MAGIC or version != VERSION:
+            raise StreamError("not a blob")
+        if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+            raise StreamError(f"bad chunk size {chunk_size}")
+        header = cls()
+        header.raw = raw
+        header.params = (log_n, r, p)
+        header.chunk_size = chunk_size
+        header.salt = salt
+        header.prefix = prefix
+        header.check = check
+        return header
+
+def _stream_key(passphrase, salt, params, scope):
+    master = aead.cached_key(passphrase, salt, params, scope)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"blob stream").derive(master)
+
+def _key_check(key, header_fields):
+    return hmac.new(key, b"key check\0" + header_fields, hashlib.sha256).digest()[:16]
+
+def _new_header(passphrase, scope):
+    params = (config.AEAD_SCRYPT_LOG_N, config.AEAD_SCRYPT_R, config.AEAD_SCRYPT_P)
+    salt = os.urandom(16)
+    prefix = os.urandom(7)
+    key = _stream_key(passphrase, salt, params, scope)
+    fields = _HEADER.pack(MAGIC, VERSION, *params, config.STREAM_CHUNK_SIZE, salt, prefix, bytes(16))[:-16]
+    return _Header.parse(fields + _key_check(key, fields)), key
+
+def _unlock(header, passphrase, scope):
+    key = _stream_key(passphrase, header.salt, header.params, scope)
+    if not hmac.compare_digest(_key_check(key, header.raw[:-16]), header.check):
+        raise aead.DecryptionError("wrong passphrase")
+    return key
+
+def _read_full(source, size):
+    """Reads exactly `size` bytes unless the source ends first."""
+    parts = []
+    remaining = size
+    while remaining:
+        data = source.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+def _plain_size(file_size, chunk_size):
+    body = file_size - HEADER_SIZE
+    chunks = -(-body // (chunk_size + TAG_SIZE))
+    return body - chunks * TAG_SIZE, chunks
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        return _Header.parse(f.read(HEADER_SIZE))
+
+def upload_status(username, name):
+    """
+    {"offset": bytes committed so far, "complete": bool, "size": plaintext size or None}.
+    An upload cut off before its header was complete restarts at offset 0;
+    a finished blob with an unreadable header raises StreamError.
+    """
+    blob_path = _blob_path(username, name)
+    if os.path.exists(blob_path):
+        header = _read_header(blob_path)
+        size, _ = _plain_size(os.path.getsize(blob_path), header.chunk_size)
+        if not os.path.exists(_part_path(username, name)):
+            return {"offset": size, "complete": True, "size": size}
+    part_path = _part_path(username, name)
+    try:
+        header = _read_header(part_path)
+    except (FileNotFoundError, StreamError):
+        return {"offset": 0, "complete": False, "size": None}
+    full_chunks = (os.path.getsize(part_path) - HEADER_SIZE) // (header.chunk_size + TAG_SIZE)
+    return {"offset": full_chunks * header.chunk_size, "complete": False, "size": None}
+
+def write(username, name, passphrase, source, offset=0, final=True, scope=None):
+    """
+    Encrypts bytes from `source` (anything with read(n)) into the blob,
+    continuing an interrupted upload when `offset` > 0. offset 0 starts
+    over. Raises OffsetMismatch if `offset` isn't where the upload stands.
+    Returns upload_status() afterwards. Raises UploadInProgress while
+    another request writes the same blob.
+    """
+    check_name(name)
+    os.makedirs(_blob_dir(username), exist_ok=True)
+    with _blob_lock(username, name):
+        return _write(username, name, passphrase, source, offset, final, scope)
+
+def _write(username, name, passphrase, source, offset, final, scope):
+    part_path = _part_path(username, name)
+
+    if offset == 0:
+        header, key = _new_header(passphrase, scope)
+        f = open(part_path, "wb")
+        f.write(header.raw)
+        index = 0
+    else:
+        try:
+            f = open(part_path, "r+b")
+        except FileNotFoundError:
+            raise OffsetMismatch(0)
+        try:
+            header = _Header.parse(f.read(HEADER_SIZE))
+        except StreamError:
+            # Cut off before its header was complete: nothing to continue from
+            f.close()
+            raise OffsetMismatch(0)
+        key = _unlock(header, passphrase, scope)
+        stride = header.chunk_size + TAG_SIZE
+        index = (os.fstat(f.fileno()).st_size - HEADER_SIZE) // stride
+        if offset != index * header.chunk_size:
+            f.close()
+            raise OffsetMismatch(index * header.chunk_size)
+        # Drop a torn chunk left by an interrupted request
+        f.truncate(HEADER_SIZE + index * stride)
+        f.seek(0, os.SEEK_END)
+
+    cipher = ChaCha20Poly1305(key)
+    with f:
+        while True:
+            chunk = _read_full(source, header.chunk_size)
+            if len(chunk) < header.chunk_size:
+                break
+            f.write(cipher.encrypt(_nonce(header.prefix, index, False), chunk, header.raw))
+            index += 1
+        if final:
+            # The remainder (possibly empty) is sealed as the last chunk
+            f.write(cipher.encrypt(_nonce(header.prefix, index, True), chunk, header.raw))
+        f.flush()
+        os.fsync(f.fileno())
+
+    if final:
+        os.replace(part_path, _blob_path(username, name))
+        durable.fsync_dir(_blob_dir(username))
+    return upload_status(username, name)
+
+def open_blob(username, name, passphrase, scope=None):
+    """
+    Checks the passphrase and returns (size, reader) where reader(start, stop)
+    yields the plaintext of [start, stop) one chunk at a time.
+    Raises FileNotFoundError for unknown or unfinished blobs, StreamError
+    for unreadable ones; the reader raises StreamError if an upload has
+    replaced the blob since.
+    """
+    check_name(name)
+    path = _blob_path(username, name)
+    with metrics.stage("read"), open(path, "rb") as f:
+        header = _Header.parse(f.read(HEADER_SIZE))
+        st = os.fstat(f.fileno())
+        size, chunks = _plain_size(st.st_size, header.chunk_size)
+    key = _unlock(header, passphrase, scope)
+    cipher = ChaCha20Poly1305(key)
+    stride = header.chunk_size + TAG_SIZE
+
+    def reader(start=0, stop=None):
+        stop = size if stop is None else min(stop, size)
+        first = start // header.chunk_size
+        with open(path, "rb") as f:
+            now = os.fstat(f.fileno())
+            if (now.st_ino, now.st_size) != (st.st_ino, st.st_size):
+                raise StreamError("blob was replaced while being read")
+            f.seek(HEADER_SIZE + first * stride)
+            for index in range(first, chunks):
+                position = index * header.chunk_size
+                if position >= stop and index != first:
+                    break
+                with metrics.stage("read"):
+                    sealed = f.read(stride)
+                try:
+                    chunk = cipher.decrypt(_nonce(header.prefix, index, index == chunks - 1), sealed, header.raw)
+                except InvalidTag:
+                    raise aead.DecryptionError(f"chunk {index} failed authentication")
+                piece = chunk[max(0, start - position):stop - position]
+                if piece:
+                    yield piece
+
+    return size, reader
+
+def list_blobs(username):
+    base = _blob_dir(username)
+    if not os.path.isdir(base):
+        return []
+    blobs = []
+    for entry in sorted(os.listdir(base)):
+        path = os.path.join(base, entry)
+        try:
+            if entry.endswith(".blob"):
+                name = entry[:-len(".blob")]
+                st = os.stat(path)
+                try:
+                    size, _ = _plain_size(st.st_size, _read_header(path).chunk_size)
+                except StreamError as e:
+                    # Listed, so it can still be deleted, but without a size
+                    blobs.append({"name": name, "size": None, "modified": st.st_mtime, "complete": True,
+                                  "error": str(e)})
+                    continue
+                blobs.append({"name": name, "size": size, "modified": st.st_mtime, "complete": True})
+            elif entry.endswith(".blob.part") and not os.path.exists(path[:-len(".part")]):
+                name = entry[:-len(".blob.part")]
+                status = upload_status(username, name)
+                blobs.append({"name": name, "size": None, "modified": os.path.getmtime(path),
+                              "complete": False, "offset": status["offset"]})
+        except FileNotFoundError:
+            pass  # finished or deleted by another request since listdir()
+    return blobs
+
+def delete(username, name):
+    """Removes a blob and any unfinished upload; raises UploadInProgress while one is being written."""
+    check_name(name)
+    if not os.path.isdir(_blob_dir(username)):
+        return False
+    removed = False
+    with _blob_lock(username, name):
+        for path in (_blob_path(username, name), _part_path(username, name)):
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                pass
+    return removed
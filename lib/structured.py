@@ -0,0 +1,518 @@
+"""
+Structured secrets: a JSON object stored as a directory tree (the layout
+lib.fs_mapper uses: dicts are directories, everything else is a file) with
+every leaf encrypted on its own.
+
+    db/<user>/.trees/<app>/.meta            KDF parameters, salt, key check
+    db/<user>/.trees/<app>/<key>/...        nested dict
+    db/<user>/.trees/<app>/<key>.leaf       "PPT" | version | nonce[12] | ciphertext+tag
+
+One scrypt master key per tree comes from the passphrase (through the aead
+session key cache, so repeat requests skip the KDF). Each leaf gets its own
+key, derived from the master key with HKDF using the leaf's path as info.
+The path is also bound as associated data, so leaves cannot be swapped
+between positions. Reading a subtree decrypts only the leaves under it,
+and an update re-encrypts and rewrites only the leaves it changes. Key
+names are visible on disk, as in fs_mapper; values are not.
+
+An update lists only the directories on the paths its operations touch,
+and is all or nothing: new leaves are staged in <app>/.staged, then a
+journal (<app>/.journal) naming every rename is written as the commit
+point and replayed. A crash before the journal leaves the tree as it was;
+after it, the next access finishes the update.
+
+Lists are stored as single leaves. Trees live on the filesystem whatever
+config.STORAGE_BACKEND says.
+"""
+import base64
+import copy
+import datetime
+import json
+import os
+import shutil
+import struct
+import threading
+from urllib.parse import quote, unquote
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from . import aead, config, durable, metrics, storage, utils
+
+TREES_DIR = ".trees"
+META_FILE = ".meta"
+LEAF_SUFFIX = ".leaf"
+JOURNAL_FILE = ".journal"
+STAGING_DIR = ".staged"
+
+MAGIC = b"PPT"
+VERSION = 1
+_LEAF_HEADER = struct.Struct(">3sB12s")
+_CHECK_PLAINTEXT = b"payload-persist structured secret"
+
+# Serializes writers (store/update/delete); reads don't take it
+_lock = threading.Lock()
+
+class Stored:
+    """Placeholder for a leaf that is on disk and has not been decrypted."""
+    __slots__ = ("keys",)
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __deepcopy__(self, memo):
+        return self
+
+class Subtree:
+    """Placeholder for a directory (nested dict) that has not been listed."""
+    __slots__ = ("keys",)
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __deepcopy__(self, memo):
+        return self
+
+class _Dir(dict):
+    """
+    A dict listed from its directory: `path` is where that directory is (its
+    keys) and `on_disk` what it held ({key: is a directory}), to diff against.
+    """
+    __slots__ = ("path", "on_disk")
+
+    def __init__(self, path, on_disk):
+        super().__init__()
+        self.path = path
+        self.on_disk = on_disk
+
+    def __deepcopy__(self, memo):
+        copied = memo[id(self)] = _Dir(self.path, self.on_disk)
+        for key, value in self.items():
+            copied[key] = copy.deepcopy(value, memo)
+        return copied
+
+# A tree <app> is written through <app>.new and <app>.old, and locked with <app>.lock
+_RESERVED_SUFFIXES = (".new", ".old", ".lock")
+
+def check_name(app_name):
+    """Raises storage.InvalidAppName for names that are not usable as a tree name."""
+    storage.check_app_name(app_name)
+    if app_name.endswith(_RESERVED_SUFFIXES):
+        raise storage.InvalidAppName(f"Structured secret names must not end with {', '.join(_RESERVED_SUFFIXES)}")
+
+def _tree_dir(username, app_name):
+    # Every entry point builds its path here, so every one checks the name
+    check_name(app_name)
+    return os.path.join("db", username, TREES_DIR, app_name)
+
+def _writer_lock(tree_dir):
+    # Other processes (pre-fork web workers) may write the same tree
+    os.makedirs(os.path.dirname(tree_dir), exist_ok=True)
+    return durable.process_lock(tree_dir + ".lock")
+
+def _encode_key(key):
+    if not key:
+        raise utils.PatchError("Empty keys cannot be stored in a structured secret")
+    name = quote(key, safe="")
+    # Leading dots would hide entries or clash with .meta, "." and ".."
+    if name.startswith("."):
+        name = "%2E" + name[1:]
+    # A dict "x.leaf" would share its directory name with the leaf "x"
+    if name.endswith(LEAF_SUFFIX):
+        name = name[:-len(LEAF_SUFFIX)] + "%2E" + LEAF_SUFFIX[1:]
+    return name
+
+def _node_path(tree_dir, keys):
+    return os.path.join(tree_dir, *(_encode_key(key) for key in keys))
+
+def _leaf_path(tree_dir, keys):
+    return _node_path(tree_dir, keys) + LEAF_SUFFIX
+
+def _leaf_id(keys):
+    return json.dumps(list(keys), separators=(",", ":")).encode("utf-8")
+
+def _subkey(master, info):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(master)
+
+def _seal(master, keys, value):
+    nonce = os.urandom(12)
+    header = _LEAF_HEADER.pack(MAGIC, VERSION, nonce)
+    leaf_id = _leaf_id(keys)
+    cipher = ChaCha20Poly1305(_subkey(master, b"leaf\0" + leaf_id))
+    plaintext = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return header + cipher.encrypt(nonce, plaintext, header + leaf_id)
+
+def _unseal(master, keys, blob):
+    header = blob[:_LEAF_HEADER.size]
+    magic, version, nonce = _LEAF_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise aead.DecryptionError("not a structured secret leaf")
+    leaf_id = _leaf_id(keys)
+    cipher = ChaCha20Poly1305(_subkey(master, b"leaf\0" + leaf_id))
+    try:
+        plaintext = cipher.decrypt(nonce, blob[_LEAF_HEADER.size:], header + leaf_id)
+    except InvalidTag:
+        raise aead.DecryptionError(f"leaf '{'.'.join(keys)}' failed authentication")
+    return json.loads(plaintext)
+
+def _new_meta(passphrase, app_username, scope):
+    params = (config.AEAD_SCRYPT_LOG_N, config.AEAD_SCRYPT_R, config.AEAD_SCRYPT_P)
+    salt = os.urandom(16)
+    master = aead.cached_key(passphrase, salt, params, scope)
+    nonce = os.urandom(12)
+    check = ChaCha20Poly1305(_subkey(master, b"check")).encrypt(nonce, _CHECK_PLAINTEXT, None)
+    meta = {
+        "version": VERSION,
+        "kdf": "scrypt",
+        "log_n": params[0], "r": params[1], "p": params[2],
+        "salt": base64.b64encode(salt).decode("ascii"),
+        "check": base64.b64encode(nonce + check).decode("ascii"),
+        "app_username": app_username,
+        "timestamp": datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+    }
+    return meta, master
+
+def _read_meta(tree_dir):
+    try:
+        with metrics.stage("read"), open(os.path.join(tree_dir, META_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _unlock(tree_dir, passphrase, scope):
+    """Returns (meta, master key). Wrong passphrases fail here, before any leaf is touched."""
+    meta = _read_meta(tree_dir)
+    if meta is None:
+        raise FileNotFoundError(tree_dir)
+    params = (meta["log_n"], meta["r"], meta["p"])
+    master = aead.cached_key(passphrase, base64.b64decode(meta["salt"]), params, scope)
+    check = base64.b64decode(meta["check"])
+    try:
+        ChaCha20Poly1305(_subkey(master, b"check")).decrypt(check[:12], check[12:], None)
+    except InvalidTag:
+        raise aead.DecryptionError("wrong passphrase")
+    return meta, master
+
+def _list_dir(tree_dir, keys):
+    """One directory of the tree: a _Dir of Stored leaves and Subtree placeholders."""
+    node = _Dir(keys, {})
+    with metrics.stage("read"), os.scandir(_node_path(tree_dir, keys)) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith("."):
+                continue  # .meta, journal, staging: keys never encode to a leading dot
+            if entry.is_dir():
+                key = unquote(name)
+                node[key] = Subtree(keys + (key,))
+                node.on_disk[key] = True
+            elif name.endswith(LEAF_SUFFIX):
+                key = unquote(name[:-len(LEAF_SUFFIX)])
+                node[key] = Stored(keys + (key,))
+                node.on_disk[key] = False
+    return node
+
+def _skeleton(tree_dir, keys=()):
+    """The shape of the tree below `keys` from directory listings alone: dicts, with Stored leaves."""
+    node = _list_dir(tree_dir, keys)
+    for key, child in node.items():
+        if isinstance(child, Subtree):
+            node[key] = _skeleton(tree_dir, child.keys)
+    return node
+
+def _load_leaf(tree_dir, master, keys):
+    with metrics.stage("read"), open(_leaf_path(tree_dir, keys), "rb") as f:
+        blob = f.read()
+    return _unseal(master, keys, blob)
+
+def _decrypt_all(node, tree_dir, master):
+    if isinstance(node, Stored):
+        return _load_leaf(tree_dir, master, node.keys)
+    if isinstance(node, dict):
+        return {key: _decrypt_all(child, tree_dir, master) for key, child in node.items()}
+    return node
+
+def exists(username, app_name):
+    return os.path.exists(os.path.join(_tree_dir(username, app_name), META_FILE))
+
+def _write_tree(tree_dir, master, node, keys, writes):
+    os.makedirs(_node_path(tree_dir, keys), exist_ok=True)
+    for key, value in node.items():
+        child_keys = keys + (key,)
+        if isinstance(value, dict):
+            _write_tree(tree_dir, master, value, child_keys, writes)
+        else:
+            writes.append((_leaf_path(tree_dir, child_keys), _seal(master, child_keys, value)))
+
+def store(username, app_name, document, passphrase, app_username="", scope=None):
+    """(Re)writes the whole tree with a fresh salt. `document` must be a JSON object."""
+    if not isinstance(document, dict):
+        raise utils.PatchError("A structured secret must be a JSON object")
+    tree_dir = _tree_dir(username, app_name)
+    meta, master = _new_meta(passphrase, app_username, scope)
+    with _lock, _writer_lock(tree_dir):
+        staging = tree_dir + ".new"
+        shutil.rmtree(staging, ignore_errors=True)
+        writes = []
+        _write_tree(staging, master, document, (), writes)
+        writes.append((os.path.join(staging, META_FILE), json.dumps(meta)))
+        durable.atomic_write_many(writes)
+
+        # Swap the finished tree in; the old one only disappears once the new one is in place
+        old = tree_dir + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(tree_dir):
+            os.rename(tree_dir, old)
+        os.rename(staging, tree_dir)
+        durable.fsync_dir(os.path.dirname(tree_dir))
+        shutil.rmtree(old, ignore_errors=True)
+    return len(writes) - 1
+
+def _get_within(value, keys, path):
+    for key in keys:
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            raise KeyError(path)
+    return value
+
+def read(username, app_name, passphrase, path="", scope=None):
+    """
+    Returns (value at `path`, meta), decrypting only the leaves below it.
+    Raises KeyError if the path does not exist.
+    """
+    tree_dir = _tree_dir(username, app_name)
+    if _interrupted(tree_dir):
+        with _lock, _writer_lock(tree_dir):
+            _replay(tree_dir)
+    meta, master = _unlock(tree_dir, passphrase, scope)
+    keys = utils.parse_path(path)
+    for i in range(1, len(keys) + 1):
+        prefix = keys[:i]
+        if os.path.isfile(_leaf_path(tree_dir, prefix)):
+            # Paths into a list (or past a scalar) continue inside the decrypted leaf
+            return _get_within(_load_leaf(tree_dir, master, prefix), keys[i:], path), meta
+        if not os.path.isdir(_node_path(tree_dir, prefix)):
+            raise KeyError(path)
+    return _decrypt_all(_skeleton(tree_dir, keys), tree_dir, master), meta
+
+def _materialize(document, keys, subtree, tree_dir, master, decrypted):
+    """
+    Loads what an operation on `keys` needs to see: the directories on the
+    way down, any leaf on the way (the operation reaches inside it) and,
+    with `subtree`, the node at `keys` and everything below it. Missing
+    paths are left for the operation itself to report.
+    """
+    node = document
+    for i, key in enumerate(keys):
+        if not isinstance(node, dict) or key not in node:
+            return
+        child = node[key]
+        if i < len(keys) - 1 or subtree:
+            if isinstance(child, Subtree):
+                child = node[key] = _list_dir(tree_dir, child.keys)
+            elif isinstance(child, Stored):
+                value = _load_leaf(tree_dir, master, child.keys)
+                node[key] = decrypted[child.keys] = value
+                child = value
+        node = child
+    if subtree and isinstance(node, dict):
+        _load_all(node, tree_dir, master, decrypted)
+
+def _load_all(node, tree_dir, master, decrypted):
+    for key, child in list(node.items()):
+        if isinstance(child, Subtree):
+            child = node[key] = _list_dir(tree_dir, child.keys)
+        if isinstance(child, Stored):
+            node[key] = decrypted[child.keys] = _load_leaf(tree_dir, master, child.keys)
+        elif isinstance(child, dict):
+            _load_all(child, tree_dir, master, decrypted)
+
+def _directory_at(value):
+    """Keys of the on-disk directory `value` stands for, or None."""
+    if isinstance(value, _Dir):
+        return value.path
+    if isinstance(value, Subtree):
+        return value.keys
+    return None
+
+def _plan(node, keys, on_disk, tree_dir, master, decrypted, plan):
+    """
+    Diffs the dict `node`, to be stored at `keys`, against what is on disk
+    there (`on_disk`: {key: is a directory}; empty for a new directory).
+    Fills plan["retire"] (entries to remove), plan["mkdir"] and
+    plan["write"] ((keys, value) leaves to (re)write).
+    """
+    for key, was_dir in on_disk.items():
+        child = keys + (key,)
+        if key not in node:
+            kept = False
+        elif was_dir:
+            kept = _directory_at(node[key]) == child
+        else:
+            kept = not isinstance(node[key], (dict, Subtree))  # a leaf is replaced in place
+        if not kept:
+            plan["retire"].append(_node_path(tree_dir, child) if was_dir else _leaf_path(tree_dir, child))
+
+    for key, value in node.items():
+        child = keys + (key,)
+        was_dir = on_disk.get(key)  # None: nothing there
+        if isinstance(value, Subtree):
+            if was_dir and value.keys == child:
+                continue  # untouched directory
+            value = _load_all_at(value, tree_dir, master, decrypted)
+        if isinstance(value, dict):
+            if was_dir and _directory_at(value) == child:
+                _plan(value, child, value.on_disk, tree_dir, master, decrypted, plan)
+            else:
+                plan["mkdir"].append(_node_path(tree_dir, child))
+                _plan(value, child, {}, tree_dir, master, decrypted, plan)
+        elif isinstance(value, Stored):
+            if was_dir is False and value.keys == child:
+                continue  # untouched leaf
+            plan["write"].append((child, _load_leaf(tree_dir, master, value.keys)))
+        elif was_dir is False and child in decrypted and decrypted[child] == value:
+            continue  # read for a test/append but left as it was
+        else:
+            plan["write"].append((child, value))
+
+def _load_all_at(subtree, tree_dir, master, decrypted):
+    node = _list_dir(tree_dir, subtree.keys)
+    _load_all(node, tree_dir, master, decrypted)
+    return node
+
+def _interrupted(tree_dir):
+    return (os.path.exists(os.path.join(tree_dir, JOURNAL_FILE))
+            or os.path.exists(os.path.join(tree_dir, STAGING_DIR)))
+
+def _commit(tree_dir, master, plan, meta):
+    """Stages the new leaves, writes the journal (the commit point) and applies it."""
+    staging = os.path.join(tree_dir, STAGING_DIR)
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    staged = []
+    puts = []
+    for n, (keys, value) in enumerate(plan["write"]):
+        staged.append((os.path.join(staging, f"put-{n}"), _seal(master, keys, value)))
+        puts.append([f"put-{n}", os.path.relpath(_leaf_path(tree_dir, keys), tree_dir)])
+    staged.append((os.path.join(staging, "meta"), json.dumps(meta)))
+    puts.append(["meta", META_FILE])
+    durable.atomic_write_many(staged)
+    journal = {
+        "retire": [[os.path.relpath(path, tree_dir), f"retired-{n}"] for n, path in enumerate(plan["retire"])],
+        "mkdir": [os.path.relpath(path, tree_dir) for path in plan["mkdir"]],
+        "put": puts,
+    }
+    durable.atomic_write(os.path.join(tree_dir, JOURNAL_FILE), json.dumps(journal))
+    _replay(tree_dir)
+
+def _replay(tree_dir):
+    """
+    Applies a committed journal; every step can be repeated, so this also
+    finishes an update a crash interrupted. Without a journal the staged
+    files of an uncommitted update are discarded. Caller holds the writer locks.
+    """
+    staging = os.path.join(tree_dir, STAGING_DIR)
+    journal_path = os.path.join(tree_dir, JOURNAL_FILE)
+    try:
+        with open(journal_path, "r") as f:
+            journal = json.load(f)
+    except FileNotFoundError:
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+    touched = {tree_dir}
+    for rel, name in journal["retire"]:
+        # Moved aside rather than deleted: a replay must not remove what
+        # a later step already put in its place
+        path, aside = os.path.join(tree_dir, rel), os.path.join(staging, name)
+        if not os.path.lexists(aside) and os.path.lexists(path):
+            os.rename(path, aside)
+        touched.add(os.path.dirname(path))
+    for rel in journal["mkdir"]:
+        os.makedirs(os.path.join(tree_dir, rel), exist_ok=True)
+        touched.add(os.path.dirname(os.path.join(tree_dir, rel)))
+    for name, rel in journal["put"]:
+        path = os.path.join(tree_dir, rel)
+        if os.path.exists(os.path.join(staging, name)):
+            os.replace(os.path.join(staging, name), path)
+        touched.add(os.path.dirname(path))
+    for path in sorted(touched, key=len, reverse=True):
+        if os.path.isdir(path):
+            durable.fsync_dir(path)
+    os.remove(journal_path)
+    durable.fsync_dir(tree_dir)
+    shutil.rmtree(staging, ignore_errors=True)
+
+def update(username, app_name, passphrase, operations, scope=None):
+    """
+    Applies utils.apply_operations-style operations to the tree, all or
+    nothing. Only the directories on the operations' paths are listed, only
+    leaves an operation reads are decrypted, and only leaves whose value
+    changed are re-encrypted. Returns {"written": leaves written,
+    "deleted": leaves and subtrees removed or replaced}.
+    """
+    if not isinstance(operations, list):
+        raise utils.PatchError("Operations must be a list")
+    tree_dir = _tree_dir(username, app_name)
+    with _lock, _writer_lock(tree_dir):
+        if _interrupted(tree_dir):
+            _replay(tree_dir)
+        return _update(tree_dir, passphrase, operations, scope)
+
+def _update(tree_dir, passphrase, operations, scope):
+    meta, master = _unlock(tree_dir, passphrase, scope)
+    root = _list_dir(tree_dir, ())
+
+    document = root
+    decrypted = {}
+    for i, operation in enumerate(operations):
+        if isinstance(operation, dict):
+            op = operation.get("op")
+            try:
+                if "path" in operation:
+                    keys = utils.parse_path(operation["path"])
+                    _materialize(document, keys, op in ("append", "test"), tree_dir, master, decrypted)
+                if op == "move" and "from" in operation:
+                    source = utils.parse_path(operation["from"])
+                    # Moved leaves are re-keyed to their new path, so they must be decrypted
+                    _materialize(document, source, True, tree_dir, master, decrypted)
+            except utils.PatchError as e:
+                raise utils.PatchError(f"Operation {i} ({op}): {e}")
+        # One operation at a time, so each sees what the previous ones loaded.
+        # The document holds only what was loaded, so copying it is cheap.
+        document = utils.apply_operations(document, [operation], first_index=i)
+    if not isinstance(document, dict):
+        raise utils.PatchError("A structured secret must stay a JSON object")
+
+    plan = {"retire": [], "mkdir": [], "write": []}
+    _plan(document, (), root.on_disk, tree_dir, master, decrypted, plan)
+    if plan["retire"] or plan["mkdir"] or plan["write"]:
+        meta["timestamp"] = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        _commit(tree_dir, master, plan, meta)
+    return {"written": len(plan["write"]), "deleted": len(plan["retire"])}
+
+def delete(username, app_name):
+    tree_dir = _tree_dir(username, app_name)
+    if not os.path.exists(tree_dir):
+        return False
+    with _lock, _writer_lock(tree_dir):
+        if not os.path.exists(tree_dir):
+            return False
+        shutil.rmtree(tree_dir)
+    return True
+
+def list_trees(username):
+    base = os.path.join("db", username, TREES_DIR)
+    if not os.path.isdir(base):
+        return []
+    return sorted(
+        name for name in os.listdir(base)
+        if not name.endswith(_RESERVED_SUFFIXES) and exists(username, name)
+    )
+
+def metadata(username, app_name):
+    meta = _read_meta(_tree_dir(username, app_name))
+    if meta is None:
+        return None
+    return {"name": app_name, "app_username": meta.get("app_username", ""), "timestamp": meta.get("timestamp")}
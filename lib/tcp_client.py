@@ -0,0 +1,345 @@
+"""
+Client library for the TCP server (server.py).
+
+    with tcp_client.Client() as client:
+        client.store("alice", "pw", "github", protocol.create_payload("me", ciphertext))
+        payload = client.retrieve("alice", "pw", "github")
+
+Client keeps a pool of framed connections (lib.network.Connection), each
+checked out by one caller at a time; connections idle longer than
+CLIENT_IDLE_TIMEOUT are dropped before the server's own idle timeout, and
+a retrieve that fails on a pooled connection the server has since closed is
+resent on a fresh one (CLIENT_RETRIES). Stores are never resent: the
+server may have applied one before the connection failed, and a second
+copy would add another version, so their errors reach the caller. AsyncClient offers the same calls
+as coroutines; its connections are shared, with concurrent requests
+pipelined over them. Against servers that only speak the legacy protocol
+both fall back to a connection per request.
+
+Ciphertexts are opaque here: encrypt and decrypt with lib.crypto.
+"""
+import asyncio
+import itertools
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from . import config, network, protocol
+
+AUTH_FAILED = "ERR: Authentication failed"
+# Requests safe to send twice; stores (and raw bytes, which we don't parse) are not
+RETRYABLE_COMMANDS = ("REQUEST_SECRET", "REQUEST_SECRETS")
+
+class ServerError(Exception):
+    """The server answered with an error."""
+
+def _check(response):
+    # ACK / ERR text; authentication failures raise PermissionError like lib.storage
+    if isinstance(response, str) and response.startswith("ERR:"):
+        if response == AUTH_FAILED:
+            raise PermissionError(response)
+        raise ServerError(response)
+    return response
+
+def _check_summary(summary):
+    if summary is None:
+        raise ServerError("No response")
+    summary = _check(summary)
+    if "error" in summary:
+        if summary["error"] == "Authentication failed":
+            raise PermissionError(summary["error"])
+        raise ServerError(summary["error"])
+    return summary
+
+def _retryable(message):
+    return isinstance(message, dict) and message.get("command") in RETRYABLE_COMMANDS
+
+def _retrieved(response):
+    if isinstance(response, str):
+        raise ServerError(response)
+    return response
+
+# --- sync ---
+
+class Client:
+    def __init__(self, host=None, port=None, pool_size=None, idle_timeout=None, retries=None):
+        self.host = host or config.HOST
+        self.port = port or config.PORT
+        self.pool_size = config.CLIENT_POOL_SIZE if pool_size is None else pool_size
+        self.idle_timeout = config.CLIENT_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.retries = config.CLIENT_RETRIES if retries is None else retries
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                connection = self._idle.pop()
+                if connection.sock is None or now - connection.last_used < self.idle_timeout:
+                    return connection
+                connection.close()
+        return network.Connection(self.host, self.port)
+
+    def _checkin(self, connection):
+        with self._lock:
+            if not self._closed and connection.idle and len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a pooled connection for pipelining with send()/receive().
+        No retries: the caller sees connection errors.
+        """
+        connection = self._checkout()
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            raise
+        self._checkin(connection)
+
+    def request(self, message):
+        """Sends a message dict (or raw request bytes); returns protocol.parse_response() of the answer."""
+        retries = self.retries if _retryable(message) else 0
+        for attempt in range(retries + 1):
+            connection = self._checkout()
+            reused = connection.sock is not None
+            try:
+                body = connection.request(message)
+            except OSError:
+                connection.close()
+                if not reused or attempt == retries:
+                    raise
+                continue
+            self._checkin(connection)
+            return protocol.parse_response(body)
+
+    def store(self, username, user_password, app_name, payload):
+        """Returns the server's acknowledgement."""
+        return _check(self.request(protocol.store_request(username, app_name, user_password, payload)))
+
+    def retrieve(self, username, user_password, app_name):
+        """Returns the stored payload dict, or None."""
+        return _retrieved(_check(self.request(protocol.retrieve_request(username, app_name, user_password))))
+
+    def retrieve_many(self, username, user_password, app_names):
+        """Returns {app_name: payload dict or None}."""
+        response = _check(self.request(protocol.batch_retrieve_request(username, app_names, user_password)))
+        return _retrieved(response or {}).get("apps", {})
+
+    def store_batch(self, username, user_password, items):
+        """`items` is a list of (app_name, payload). Returns {"stored": n, "errors": [...]}."""
+        return _check_summary(self.request(protocol.batch_store_request(username, user_password, items)))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- asyncio ---
+
+class AsyncConnection:
+    """asyncio counterpart of network.Connection. Any number of requests may be in flight."""
+
+    def __init__(self, host=None, port=None):
+        self.host = host or config.HOST
+        self.port = port or config.PORT
+        self.framed = None
+        self.version = None
+        self.last_used = None
+        self.reader = None
+        self.writer = None
+        self._ids = itertools.count(1)
+        self._waiters = {}
+        self._read_task = None
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def binary(self):
+        return bool(self.framed) and self.version >= 2 and config.WIRE_ENCODING == "binary"
+
+    @property
+    def open(self):
+        return self._read_task is not None and not self._read_task.done()
+
+    @property
+    def pending(self):
+        return len(self._waiters)
+
+    async def _open(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), config.CLIENT_CONNECT_TIMEOUT
+        )
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return reader, writer
+
+    async def _connect(self):
+        reader, writer = await self._open()
+        writer.write(protocol.hello())
+        try:
+            reply = await reader.readexactly(protocol.HELLO_SIZE)
+        except asyncio.IncompleteReadError as e:
+            reply = e.partial
+        version = protocol.parse_hello(reply)
+        if version is None or not 1 <= version <= protocol.FRAME_VERSION:
+            writer.close()
+            if version is not None:
+                raise ConnectionError(f"Server speaks protocol version {version}")
+            self.framed = False
+            return
+        self.framed = True
+        self.version = version
+        self.reader, self.writer = reader, writer
+        self.last_used = time.monotonic()
+        self._read_task = asyncio.create_task(self._read_responses())
+
+    async def _read_responses(self):
+        try:
+            while True:
+                length, request_id = protocol.FRAME_HEADER.unpack(
+                    await self.reader.readexactly(protocol.FRAME_HEADER.size)
+                )
+                body = await self.reader.readexactly(length)
+                waiter = self._waiters.pop(request_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(body)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            for waiter in self._waiters.values():
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError("Connection lost before the response arrived"))
+            self._waiters.clear()
+
+    async def request(self, body):
+        if self.framed is not False and not self.open:
+            async with self._connect_lock:
+                if not self.open:
+                    await self.close()
+                    await self._connect()
+        if isinstance(body, dict):
+            body = protocol.encode_request(body, binary=self.binary)
+        if not self.framed:
+            return await self._legacy_request(body)
+
+        request_id = next(self._ids)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = waiter
+        try:
+            self.writer.write(protocol.encode_frame(request_id, body))
+            await self.writer.drain()
+        except OSError:
+            self._waiters.pop(request_id, None)
+            raise ConnectionError("Connection lost")
+        response = await waiter
+        self.last_used = time.monotonic()
+        return response
+
+    async def _legacy_request(self, body):
+        reader, writer = await self._open()
+        try:
+            writer.write(body)
+            try:
+                writer.write_eof()
+            except OSError:
+                pass  # the server already answered and closed
+            return await reader.read()
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
+
+class AsyncClient:
+    """
+    Requests go to the connection with the fewest in flight; a new one is
+    opened while every connection is busy, up to pool_size.
+    """
+
+    def __init__(self, host=None, port=None, pool_size=None, idle_timeout=None, retries=None):
+        self.host = host or config.HOST
+        self.port = port or config.PORT
+        self.pool_size = config.CLIENT_POOL_SIZE if pool_size is None else pool_size
+        self.idle_timeout = config.CLIENT_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.retries = config.CLIENT_RETRIES if retries is None else retries
+        self._connections = []
+
+    async def _pick(self):
+        now = time.monotonic()
+        for connection in list(self._connections):
+            stale = connection.open and not connection.pending and now - connection.last_used >= self.idle_timeout
+            if stale or (connection.framed and not connection.open):
+                self._connections.remove(connection)
+                await connection.close()
+        if self._connections:
+            connection = min(self._connections, key=lambda c: c.pending)
+            if not connection.pending or len(self._connections) >= self.pool_size:
+                return connection
+        connection = AsyncConnection(self.host, self.port)
+        self._connections.append(connection)
+        return connection
+
+    async def request(self, message):
+        """Sends a message dict (or raw request bytes); returns protocol.parse_response() of the answer."""
+        retries = self.retries if _retryable(message) else 0
+        for attempt in range(retries + 1):
+            connection = await self._pick()
+            reused = connection.open
+            try:
+                body = await connection.request(message)
+            except OSError:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+                await connection.close()
+                if not reused or attempt == retries:
+                    raise
+                continue
+            return protocol.parse_response(body)
+
+    async def store(self, username, user_password, app_name, payload):
+        return _check(await self.request(protocol.store_request(username, app_name, user_password, payload)))
+
+    async def retrieve(self, username, user_password, app_name):
+        return _retrieved(_check(await self.request(protocol.retrieve_request(username, app_name, user_password))))
+
+    async def retrieve_many(self, username, user_password, app_names):
+        response = _check(await self.request(protocol.batch_retrieve_request(username, app_names, user_password)))
+        return _retrieved(response or {}).get("apps", {})
+
+    async def store_batch(self, username, user_password, items):
+        return _check_summary(await self.request(protocol.batch_store_request(username, user_password, items)))
+
+    async def close(self):
+        connections, self._connections = self._connections, []
+        for connection in connections:
+            await connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -1,3 +1,5 @@
+import copy
+
 def deep_update(data, path, value):
     """
     Updates a nested dictionary based on a dot-notation path.
@@ -24,3 +26,172 @@ def deep_update(data, path, value):
         
     # Set the value at the final key
     current[keys[-1]] = value
+
+class PatchError(ValueError):
+    """An update operation could not be applied; nothing was changed."""
+
+PATCH_OPS = ("set", "delete", "append", "move", "test")
+
+def parse_path(path):
+    """
+    Dot-notation path -> tuple of keys ("a.b.0" -> ("a", "b", "0")). A list
+    of keys is taken as-is, for keys that contain dots. "" is the root.
+    """
+    if isinstance(path, (list, tuple)):
+        return tuple(str(key) for key in path)
+    if not isinstance(path, str):
+        raise PatchError(f"Invalid path: {path!r}")
+    return tuple(path.split('.')) if path else ()
+
+def _format_path(keys):
+    return '.'.join(keys) or '<root>'
+
+def _list_index(container, key, keys, allow_end=False):
+    try:
+        index = int(key)
+    except ValueError:
+        raise PatchError(f"'{_format_path(keys)}': '{key}' is not a list index")
+    limit = len(container) + (1 if allow_end else 0)
+    if not 0 <= index < limit:
+        raise PatchError(f"'{_format_path(keys)}': index {index} out of range")
+    return index
+
+class _PathWalker:
+    """
+    Resolves paths inside one document, remembering the containers it has
+    already walked to so a batch of operations on neighbouring fields
+    doesn't re-traverse from the root each time. Any mutation drops the
+    remembered containers at and below the touched path.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._containers = {(): root}
+
+    def container(self, keys, create=False):
+        """Returns the container found at `keys`, creating dicts along the way if asked."""
+        cached = self._containers.get(keys)
+        if cached is not None:
+            return cached
+        parent = self.container(keys[:-1], create)
+        key = keys[-1]
+        if isinstance(parent, dict):
+            if key not in parent:
+                if not create:
+                    raise PatchError(f"Path '{_format_path(keys)}' does not exist")
+                parent[key] = {}
+            child = parent[key]
+        elif isinstance(parent, list):
+            child = parent[_list_index(parent, key, keys)]
+        else:
+            raise PatchError(f"Cannot traverse '{_format_path(keys[:-1])}': not a dictionary or list")
+        if not isinstance(child, (dict, list)):
+            raise PatchError(f"Cannot traverse '{_format_path(keys)}': not a dictionary or list")
+        self._containers[keys] = child
+        return child
+
+    def forget(self, keys, include_self=True):
+        n = len(keys)
+        stale = [k for k in self._containers if k[:n] == keys and (len(k) > n or include_self)]
+        for cached in stale:
+            if cached:
+                del self._containers[cached]
+
+    def get(self, keys):
+        if not keys:
+            return self.root
+        parent = self.container(keys[:-1])
+        key = keys[-1]
+        if isinstance(parent, dict):
+            if key not in parent:
+                raise PatchError(f"Path '{_format_path(keys)}' does not exist")
+            return parent[key]
+        return parent[_list_index(parent, key, keys)]
+
+    def set(self, keys, value):
+        if not keys:
+            self.root = value
+            self._containers = {(): value}
+            return
+        parent = self.container(keys[:-1], create=True)
+        key = keys[-1]
+        self.forget(keys)
+        if isinstance(parent, dict):
+            parent[key] = value
+            return
+        index = _list_index(parent, key, keys, allow_end=True)
+        if index == len(parent):
+            parent.append(value)
+        else:
+            parent[index] = value
+
+    def delete(self, keys):
+        if not keys:
+            raise PatchError("Cannot delete the root")
+        parent = self.container(keys[:-1])
+        key = keys[-1]
+        if isinstance(parent, dict):
+            if key not in parent:
+                raise PatchError(f"Path '{_format_path(keys)}' does not exist")
+            value = parent.pop(key)
+            self.forget(keys)
+        else:
+            value = parent.pop(_list_index(parent, key, keys))
+            # Later elements shift down: everything cached below this list is stale
+            self.forget(keys[:-1], include_self=False)
+        return value
+
+def apply_operations(data, operations, first_index=0):
+    """
+    Applies an ordered list of operations to a copy of `data` and returns
+    the result. All-or-nothing: on any failure PatchError is raised and
+    `data` is untouched. Each operation is a dict:
+
+        {"op": "set",    "path": "a.b", "value": ...}   autovivifies dicts
+        {"op": "delete", "path": "a.b"}
+        {"op": "append", "path": "a.list", "value": ...} creates the list
+        {"op": "move",   "from": "a.b", "path": "c.d"}
+        {"op": "test",   "path": "a.b", "value": ...}   fails unless equal
+
+    Numeric path segments index into lists; setting index len(list) appends.
+    Errors number operations from `first_index`.
+    """
+    if not isinstance(operations, list):
+        raise PatchError("Operations must be a list")
+    walker = _PathWalker(copy.deepcopy(data))
+    for i, operation in enumerate(operations, first_index):
+        if not isinstance(operation, dict) or operation.get("op") not in PATCH_OPS:
+            raise PatchError(f"Operation {i}: 'op' must be one of {', '.join(PATCH_OPS)}")
+        op = operation["op"]
+        if "path" not in operation:
+            raise PatchError(f"Operation {i} ({op}): missing 'path'")
+        if op in ("set", "append", "test") and "value" not in operation:
+            raise PatchError(f"Operation {i} ({op}): missing 'value'")
+        try:
+            keys = parse_path(operation["path"])
+            if op == "set":
+                walker.set(keys, copy.deepcopy(operation["value"]))
+            elif op == "delete":
+                walker.delete(keys)
+            elif op == "append":
+                try:
+                    target = walker.get(keys)
+                except PatchError:
+                    target = []
+                    walker.set(keys, target)
+                if not isinstance(target, list):
+                    raise PatchError(f"'{_format_path(keys)}' is not a list")
+                target.append(copy.deepcopy(operation["value"]))
+            elif op == "move":
+                if "from" not in operation:
+                    raise PatchError("missing 'from'")
+                source = parse_path(operation["from"])
+                if keys[:len(source)] == source and keys != source:
+                    raise PatchError("cannot move a value into itself")
+                walker.set(keys, walker.delete(source))
+            elif op == "test":
+                if walker.get(keys) != operation["value"]:
+                    raise PatchError(f"test failed at '{_format_path(keys)}'")
+        except PatchError as e:
+            raise PatchError(f"Operation {i} ({op}): {e}")
+    return walker.root
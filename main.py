@@ -28,6 +28,8 @@ class ServerThread(threading.Thread):
     def run(self):
         # On Android, we need to make sure we are serving on 0.0.0.0
         # Port 5001 as usual
+        from lib import crypto
+        crypto.init_engine()
         flask_app.run(host='0.0.0.0', port=5001, debug=False, use_reloader=False)
 
 class MainInterface(BoxLayout):
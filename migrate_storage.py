@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Copies every stored payload from one storage backend to another.
+
+Usage:
+  ./migrate_storage.py <source> <target> [username ...]
+
+Backends: fs, sqlite (see lib/storage.py). Credentials stay in
+db/<user>/auth.json and are not touched. Set STORAGE_BACKEND in
+lib/config.py (or PAYLOAD_STORAGE_BACKEND) to the target afterwards.
+"""
+import json
+import sys
+from lib import storage
+
+BATCH_SIZE = 500
+
+def migrate_user(source, target, username):
+    names = [entry["name"] for entry in source.list_apps(username)]
+    copied = 0
+    for i in range(0, len(names), BATCH_SIZE):
+        chunk = names[i:i + BATCH_SIZE]
+        items = []
+        for app_name, data in source.read_many(username, chunk).items():
+            if data is not None:
+                items.append((app_name, json.loads(data)))
+        for app_name, _, error in target.write(username, items):
+            if error:
+                print(f"  {username}/{app_name}: {error}")
+            else:
+                copied += 1
+    return copied
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in storage.BACKENDS or sys.argv[2] not in storage.BACKENDS:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    source = storage.get_backend(sys.argv[1])
+    target = storage.get_backend(sys.argv[2])
+    if source is target:
+        print("Source and target are the same backend.")
+        sys.exit(1)
+
+    usernames = sys.argv[3:] or source.list_users()
+    total = 0
+    for username in usernames:
+        copied = migrate_user(source, target, username)
+        print(f"{username}: {copied} apps")
+        total += copied
+    print(f"Migrated {total} apps from {sys.argv[1]} to {sys.argv[2]}")
@@ -18,13 +18,28 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 # Semantic descriptions of each module
 MODULE_DESCRIPTIONS = {
+    "admission": "Admission Control - Bounded KDF / gpg pools that shed overload (503 / 429)",
+    "app_index": "App Index - Sorted, paginated views of a user's apps",
+    "aead": "Secrecy (in-process) - scrypt + AEAD ciphertexts with a versioned header",
     "auth": "Authentication - Manages user credentials and verification",
     "config": "Configuration - System-wide settings and paths",
-    "crypto": "Secrecy - Handles GPG encryption and decryption",
+    "crypto": "Secrecy - Encryption backends (GPG or in-process AEAD)",
+    "durable": "Durable Writes - Atomic file replacement with optional group commit",
+    "fs_backend": "Storage Backend - One record file per app on the filesystem",
     "fs_mapper": "Filesystem Mapper - Converts JSON to/from directory structures",
-    "network": "Network - Socket communication utilities",
-    "protocol": "Protocol - Message formatting for client-server communication",
-    "storage": "Storage - Persists encrypted payloads to disk",
+    "log_backend": "Storage Backend - Append-only segment log with version history",
+    "manifest": "Manifest - Cached per-user index of apps and their metadata",
+    "metrics": "Metrics - Per-route / per-stage latency histograms (Prometheus text)",
+    "network": "Network - Socket utilities and pipelined client connections",
+    "prefork": "Pre-fork Server - Multi-process HTTP/1.1 serving for the web interface",
+    "protocol": "Protocol - Message formatting and framing for client-server communication",
+    "record": "Record Format - Compact binary secret file with a metadata header",
+    "sessions": "Sessions - Server-side login sessions behind opaque cookie tokens",
+    "sqlite_backend": "Storage Backend - All payloads in one SQLite (WAL) database",
+    "storage": "Storage - Persists encrypted payloads through a pluggable backend",
+    "stream": "Streaming Secrecy - Chunked authenticated encryption for large blobs",
+    "structured": "Structured Secrets - JSON trees with each leaf encrypted separately",
+    "tcp_client": "TCP Client - Pooled sync/asyncio client library for server.py",
     "utils": "Utilities - Helper functions (autovivification, deep updates)"
 }
 
@@ -125,20 +140,32 @@ def show_semantic_map():
     
     print("1️⃣  VIVIFY (Input Layer)")
     print("    └─ web_server.py - Web interface for user input")
+    print("    └─ lib.prefork - Multi-core serving of the web interface (serve.py)")
+    print("    └─ lib.metrics - Request and stage latencies (/api/metrics)")
     print("    └─ lib.utils - Autovivification helpers\n")
     
     print("2️⃣  SECRECY (Encryption Layer)")
-    print("    └─ lib.crypto - GPG encryption/decryption")
+    print("    └─ lib.crypto - Encryption backends (GPG / AEAD)")
+    print("    └─ lib.aead - In-process scrypt + AEAD format")
     print("    └─ lib.config - Encryption settings\n")
     
     print("3️⃣  PAYLOAD (Packaging Layer)")
     print("    └─ lib.protocol - Message formatting")
-    print("    └─ lib.network - Communication utilities\n")
+    print("    └─ lib.network - Communication utilities")
+    print("    └─ lib.tcp_client - Pooled client library (sync and asyncio)\n")
     
     print("4️⃣  SERVER (Storage Layer)")
-    print("    └─ lib.storage - Payload persistence")
+    print("    └─ lib.storage - Payload persistence (backend facade)")
+    print("    └─ lib.fs_backend / lib.sqlite_backend / lib.log_backend - Storage backends")
+    print("    └─ lib.record - Binary secret file format")
+    print("    └─ lib.durable - Atomic, fsynced file writes")
+    print("    └─ lib.manifest - Per-user app index")
     print("    └─ lib.fs_mapper - Filesystem hierarchy")
-    print("    └─ lib.auth - User authentication\n")
+    print("    └─ lib.structured - Per-leaf encrypted secret trees")
+    print("    └─ lib.stream - Chunked encrypted blobs (upload/download, ranges)")
+    print("    └─ lib.auth - User authentication")
+    print("    └─ lib.sessions - Web login sessions (opaque tokens)")
+    print("    └─ lib.admission - Bounded KDF / gpg work under load\n")
     
     print("="*60 + "\n")
 
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Production mode for the web interface: web_server.py on pre-forked worker
+processes (lib/prefork.py), one per core by default, with HTTP keep-alive.
+
+Usage:
+  ./serve.py [--port N] [--workers N] [--threads N]
+
+kill -HUP <pid> reloads the code and lib/config.py without dropping
+connections; kill -TERM <pid> (or Ctrl-C) stops after in-flight requests.
+Defaults come from WEB_WORKERS / WEB_THREADS in lib/config.py.
+
+Every storage backend may be shared by several processes (workers, the
+two generations that overlap during a reload, server.py next to this).
+More workers are meant to raise KDF-bound throughput up to the core count;
+that has only been benchmarked on a single core so far, where it cannot
+show (benchmarks/bench_web_server.py).
+"""
+import sys
+from lib import prefork
+
+def parse_args(argv):
+    options = {"port": 5001, "workers": None, "threads": None}
+    args = iter(argv)
+    for arg in args:
+        name = arg[2:]
+        if not arg.startswith("--") or name not in options:
+            print(__doc__.strip())
+            sys.exit(1)
+        try:
+            options[name] = int(next(args))
+        except (StopIteration, ValueError):
+            print(f"{arg} needs a number")
+            sys.exit(1)
+    return options
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    prefork.serve("web_server:app", port=options["port"], workers=options["workers"],
+                  threads=options["threads"], init="web_server:init_worker")
@@ -1,61 +1,370 @@
-import socket
-from lib import network, storage, protocol
+"""
+TCP server for the command-line client.
 
-def handle_store(username, app_name, user_password, payload, conn):
+Two protocols share the port, told apart by the first byte. Framed
+connections (lib.protocol.hello) stay open and pipeline any number of
+requests, each answered as soon as it is done, possibly out of order.
+Legacy requests are bare JSON (optionally newline-terminated): single-shot
+commands get one response and the connection is closed; STORE_BATCH
+connections stay open for batch after batch.
+
+The default server runs on asyncio: connections are handled concurrently,
+storage and KDF work runs on a bounded thread pool so the event loop never
+blocks, reads and writes time out per connection, and SIGINT/SIGTERM let
+in-flight requests finish before exiting. `--blocking` runs the original
+one-connection-at-a-time loop, kept for comparison.
+
+Requests are timed per command (lib.metrics); with SERVER_METRICS_PORT set
+the numbers are served on that loopback port at /metrics (Prometheus text)
+and /metrics.json.
+"""
+import asyncio
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lib import auth, config, metrics, network, storage, protocol
+
+ERR_FAILED = "ERR: Failed to process request"
+ERR_AUTH = "ERR: Authentication failed"
+COMMANDS = ("REQUEST_SECRET", "REQUEST_SECRETS", "STORE_BATCH")  # anything else stores
+
+# Handlers return response bytes in the request's encoding (`binary`: see
+# lib.protocol); the JSON forms are byte-for-byte the legacy responses.
+
+def handle_store(username, app_name, user_password, payload, binary=False):
     try:
         filename = storage.store_payload(username, app_name, user_password, payload)
         print(f"Stored payload in {filename}")
-        conn.sendall(b"ACK: Payload stored")
+        return protocol.encode_text("ACK: Payload stored", binary)
+    except storage.InvalidAppName as e:
+        return protocol.encode_text(f"ERR: {e}", binary)
     except PermissionError:
         print(f"Auth failed for user {username}")
-        conn.sendall(b"ERR: Authentication failed")
+        return protocol.encode_text(ERR_AUTH, binary)
 
-def handle_retrieve(username, app_name, user_password, conn):
+def handle_retrieve(username, app_name, user_password, binary=False):
     try:
         result = storage.retrieve_latest_payload(username, app_name, user_password)
         if not result:
-            conn.sendall(b"")
-            return
+            return b""
 
         data, latest = result
         print(f"Sent payload from {latest}")
-        conn.sendall(data.encode("utf-8"))
+        return protocol.encode_payload(data, binary)
+    except storage.InvalidAppName as e:
+        return protocol.encode_text(f"ERR: {e}", binary)
+    except PermissionError:
+        print(f"Auth failed for user {username}")
+        return protocol.encode_text(ERR_AUTH, binary)
+
+def handle_batch_retrieve(username, app_names, user_password, binary=False):
+    if not isinstance(app_names, list) or not all(isinstance(app_name, str) and app_name for app_name in app_names):
+        return protocol.encode_text("ERR: apps must be a list of app names", binary)
+    if len(app_names) > config.BATCH_MAX_APPS:
+        # Refused rather than cut short: the client would report the rest as missing
+        return protocol.encode_text(f"ERR: Too many apps (max {config.BATCH_MAX_APPS})", binary)
+    try:
+        results = storage.retrieve_many_payloads(username, app_names, user_password)
+        print(f"Sent {sum(1 for r in results.values() if r)} payloads to {username}")
+        return protocol.encode_apps(results, binary)
+    except storage.InvalidAppName as e:
+        return protocol.encode_text(f"ERR: {e}", binary)
     except PermissionError:
         print(f"Auth failed for user {username}")
-        conn.sendall(b"ERR: Authentication failed")
+        return protocol.encode_text(ERR_AUTH, binary)
+
+def handle_batch_store(message, binary=False):
+    """
+    Stores one batch. Returns (summary, whether the connection should stay
+    open for the next batch).
+    """
+    username = message["username"]
+    items = [(item["app"], item["payload"]) for item in message["items"]]
+    if len(items) > config.BATCH_MAX_APPS:
+        return protocol.encode_summary({"error": f"Batch too large (max {config.BATCH_MAX_APPS})"}, binary), False
+    try:
+        results = storage.store_many_payloads(username, message["user_password"], items)
+        errors = [{"app": app_name, "error": error} for app_name, _, error in results if error]
+        response = {"stored": len(results) - len(errors), "errors": errors}
+        print(f"Stored batch of {response['stored']} payloads for {username}")
+    except PermissionError:
+        print(f"Auth failed for user {username}")
+        response = {"error": "Authentication failed"}
+    return protocol.encode_summary(response, binary), "error" not in response
+
+def dispatch(message, binary=False):
+    """Runs one request. Returns (response bytes, keep the connection open)."""
+    try:
+        command = message.get("command")
+        if command == "REQUEST_SECRET":
+            return handle_retrieve(message["username"], message["app"], message["user_password"], binary), False
+        if command == "REQUEST_SECRETS":
+            return handle_batch_retrieve(message["username"], message["apps"], message["user_password"], binary), False
+        if command == "STORE_BATCH":
+            # Import clients keep one connection open and send batch after batch
+            return handle_batch_store(message, binary)
+        return handle_store(message["username"], message["app"], message["user_password"], message["payload"], binary), False
+    except Exception as e:
+        print("Error:", e)
+        return protocol.encode_text(ERR_FAILED, binary), False
+
+def _outcome(response, binary):
+    if response is None:
+        return "closed"
+    if response == protocol.encode_text(ERR_FAILED, binary):
+        return "error"
+    if response == protocol.encode_text(ERR_AUTH, binary):
+        return "auth_failed"
+    return "ok"
+
+def respond(data, first):
+    """
+    Handles one raw request on a connection. Returns (response bytes or
+    None to close silently, keep the connection open). After the first
+    request only further STORE_BATCH requests are accepted.
+    """
+    binary = protocol.is_binary(data)
+    metrics.begin("tcp", "unparsed")
+    response, keep_open = _respond(data, first, binary)
+    metrics.end(_outcome(response, binary))
+    return response, keep_open
+
+def _respond(data, first, binary):
+    start = time.perf_counter()
+    try:
+        message = protocol.parse_message(data)
+    except ValueError as e:
+        print("Error:", e)
+        return protocol.encode_text(ERR_FAILED, binary), False
+    if not message or not (first or message.get("command") == "STORE_BATCH"):
+        return None, False
+    # Parsing is filed under the command it turned out to be
+    command = message.get("command")
+    metrics.rename(command if command in COMMANDS else "STORE")
+    metrics.observe_stage("parse", time.perf_counter() - start)
+    return dispatch(message, binary)
+
+# --- asyncio server ---
+
+async def read_request(reader, data=b""):
+    """Async counterpart of network.receive_request; `data` is what was already read."""
+    scanner = network.RequestScanner()
+    if data:
+        scanner.feed(data)
+    while not scanner.complete:
+        chunk = await reader.read(8192)
+        if not chunk:
+            break
+        scanner.feed(chunk)
+        if scanner.size > config.SERVER_MAX_REQUEST:
+            raise ValueError("request too large")
+    return scanner.data()
+
+class AsyncServer:
+    def __init__(self, host=None, port=None):
+        self.host = host or config.HOST
+        self.port = port or config.PORT
+        self.executor = ThreadPoolExecutor(max_workers=config.SERVER_WORKERS)
+        self.connections = set()
+        self.busy = set()
+        self.server = None
+        self.metrics_server = None
+        self._slots = None
+        self._closing = None
+
+    async def _run(self, data, first):
+        # The semaphore bounds work queued on the executor; extra connections wait here
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, respond, data, first)
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        addr = writer.get_extra_info("peername")
+        print(f"Connected by {addr}")
+        try:
+            first = await asyncio.wait_for(reader.read(1), config.SERVER_READ_TIMEOUT)
+            if first == protocol.FRAME_MAGIC[:1]:
+                await self._serve_framed(reader, writer, first)
+            elif first:
+                await self._serve_legacy(reader, writer, task, first)
+        except asyncio.TimeoutError:
+            print(f"Timed out: {addr}")
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            print(f"Dropped {addr}: {e}")
+        except asyncio.CancelledError:
+            pass  # shutdown
+        finally:
+            self.connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _serve_legacy(self, reader, writer, task, data):
+        first = True
+        while first or not self._closing.is_set():
+            data = await asyncio.wait_for(read_request(reader, data), config.SERVER_READ_TIMEOUT)
+            if not data:
+                break
+            self.busy.add(task)
+            try:
+                response, keep_open = await self._run(data, first)
+                if response is not None:
+                    writer.write(response)
+                    await asyncio.wait_for(writer.drain(), config.SERVER_WRITE_TIMEOUT)
+            finally:
+                self.busy.discard(task)
+            if not keep_open:
+                break
+            first = False
+            data = b""
+
+    async def _serve_framed(self, reader, writer, data):
+        data += await asyncio.wait_for(reader.readexactly(protocol.HELLO_SIZE - 1), config.SERVER_READ_TIMEOUT)
+        version = protocol.parse_hello(data)
+        if version is None:
+            writer.write(protocol.encode_text(ERR_FAILED))
+            return
+        writer.write(protocol.hello(min(version, protocol.FRAME_VERSION)))
+        await asyncio.wait_for(writer.drain(), config.SERVER_WRITE_TIMEOUT)
+
+        # Each request runs as its own task; at most SERVER_MAX_INFLIGHT per
+        # connection, after which we stop reading and the client backs up
+        inflight = set()
+        slots = asyncio.Semaphore(config.SERVER_MAX_INFLIGHT)
+        try:
+            while not self._closing.is_set():
+                try:
+                    header = await asyncio.wait_for(
+                        reader.readexactly(protocol.FRAME_HEADER.size), config.SERVER_IDLE_TIMEOUT
+                    )
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        raise
+                    break  # client closed between requests
+                length, request_id = protocol.FRAME_HEADER.unpack(header)
+                if length > config.SERVER_MAX_REQUEST:
+                    raise ValueError("request too large")
+                body = await asyncio.wait_for(reader.readexactly(length), config.SERVER_READ_TIMEOUT)
+                await slots.acquire()
+                request = asyncio.create_task(self._answer(writer, request_id, body, slots))
+                inflight.add(request)
+                request.add_done_callback(inflight.discard)
+        finally:
+            # Shutdown or a closed connection: let requests already read finish
+            if inflight:
+                await asyncio.wait(inflight)
+
+    async def _answer(self, writer, request_id, body, slots):
+        try:
+            response, _ = await self._run(body, True)
+            writer.write(protocol.encode_frame(request_id, response or b""))
+            await asyncio.wait_for(writer.drain(), config.SERVER_WRITE_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError):
+            writer.close()
+        finally:
+            slots.release()
+
+    async def _serve_metrics(self, reader, writer):
+        """A scraper's GET /metrics or /metrics.json, answered HTTP/1.0 style."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), config.SERVER_READ_TIMEOUT)
+            while (await asyncio.wait_for(reader.readline(), config.SERVER_READ_TIMEOUT)).strip():
+                pass  # headers
+            parts = request_line.split()
+            path = parts[1].decode("latin-1") if len(parts) > 1 else ""
+            status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+            if path == "/metrics":
+                body = metrics.prometheus({"auth_cache": auth.cache_stats()})
+            elif path == "/metrics.json":
+                content_type = "application/json"
+                body = json.dumps(dict(metrics.snapshot(), stats={"auth_cache": auth.cache_stats()}))
+            else:
+                status, body = "404 Not Found", "not found\n"
+            body = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await asyncio.wait_for(writer.drain(), config.SERVER_WRITE_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._slots = asyncio.Semaphore(config.SERVER_MAX_PENDING)
+        self._closing = asyncio.Event()
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=config.SERVER_BACKLOG
+        )
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._closing.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # not the main thread, or no signal support
+        if config.SERVER_METRICS_PORT:
+            self.metrics_server = await asyncio.start_server(
+                self._serve_metrics, "127.0.0.1", config.SERVER_METRICS_PORT
+            )
+            print(f"Metrics on http://127.0.0.1:{config.SERVER_METRICS_PORT}/metrics")
+        print(f"Server listening on {self.host}:{self.port}...")
+        await self._closing.wait()
+        await self.shutdown()
+
+    def close(self):
+        """Starts a graceful shutdown (safe to call from the loop's thread)."""
+        self._closing.set()
+
+    async def shutdown(self):
+        print("Shutting down: no new connections, finishing in-flight requests")
+        self.server.close()
+        await self.server.wait_closed()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        # Connections waiting for their next request are closed now (framed
+        # ones after their in-flight requests); the rest get
+        # SERVER_SHUTDOWN_TIMEOUT to finish
+        for task in self.connections - self.busy:
+            task.cancel()
+        if self.connections:
+            _, pending = await asyncio.wait(list(self.connections), timeout=config.SERVER_SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        self.executor.shutdown(wait=True)
 
 def main():
+    asyncio.run(AsyncServer().serve())
+
+# --- original blocking loop ---
+
+def main_blocking():
     with network.start_server_socket() as s:
         print(f"Server listening...")
         while True:
             conn, addr = s.accept()
             with conn:
                 print(f"Connected by {addr}")
-                data = network.receive_message(conn)
-                if not data:
-                    continue
-
-                try:
-                    message = protocol.parse_message(data)
-                    if not message:
-                        continue
-
-                    if message.get("command") == "REQUEST_SECRET":
-                        username = message["username"]
-                        user_password = message["user_password"]
-                        app_name = message["app"]
-                        handle_retrieve(username, app_name, user_password, conn)
-                    else:
-                        username = message["username"]
-                        user_password = message["user_password"]
-                        app_name = message["app"]
-                        payload = message["payload"]
-                        handle_store(username, app_name, user_password, payload, conn)
-
-                except Exception as e:
-                    print("Error:", e)
-                    conn.sendall(b"ERR: Failed to process request")
+                first = True
+                while True:
+                    data = network.receive_request(conn)
+                    if not data:
+                        break
+                    response, keep_open = respond(data, first)
+                    if response is not None:
+                        conn.sendall(response)
+                    if not keep_open:
+                        break
+                    first = False
 
 if __name__ == "__main__":
-    main()
-
+    if "--blocking" in sys.argv[1:]:
+        main_blocking()
+    else:
+        main()
@@ -5,6 +5,12 @@ const API_BASE = '';
 let currentUser = null;
 let loginPassphrase = null;
 
+// App list paging
+const APPS_PAGE_SIZE = 60;
+let appsCursor = null;
+let appsLoading = false;
+let appsRequestId = 0;
+
 // DOM Elements
 const authScreen = document.getElementById('auth-screen');
 const dashboardScreen = document.getElementById('dashboard-screen');
@@ -16,6 +22,10 @@ const logoutBtn = document.getElementById('logout-btn');
 const newSecretBtn = document.getElementById('new-secret-btn');
 const appsGrid = document.getElementById('apps-grid');
 const emptyState = document.getElementById('empty-state');
+const appsSearch = document.getElementById('apps-search');
+const appsSort = document.getElementById('apps-sort');
+const appsCount = document.getElementById('apps-count');
+const appsSentinel = document.getElementById('apps-sentinel');
 
 // Modals
 const storeModal = document.getElementById('store-modal');
@@ -36,7 +46,6 @@ async function checkAuthStatus() {
 
         if (data.authenticated) {
             currentUser = data.username;
-            loginPassphrase = data.password;
             showDashboard();
         }
     } catch (error) {
@@ -62,6 +71,19 @@ function setupEventListeners() {
     document.getElementById('update-form').addEventListener('submit', handleUpdate);
     document.getElementById('unlock-edit-btn').addEventListener('click', handleUnlockEdit);
 
+    // App list filtering, sorting and infinite scroll
+    let searchTimer = null;
+    appsSearch.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(loadApps, 250);
+    });
+    appsSort.addEventListener('change', loadApps);
+    new IntersectionObserver(entries => {
+        if (entries[0].isIntersecting) {
+            loadMoreApps();
+        }
+    }).observe(appsSentinel);
+
     // Buttons
     logoutBtn.addEventListener('click', handleLogout);
     newSecretBtn.addEventListener('click', () => openModal('store-modal'));
@@ -138,7 +160,7 @@ async function handleLogin(e) {
 
         if (response.ok) {
             currentUser = data.username;
-            loginPassphrase = data.password;
+            loginPassphrase = password;
             showDashboard();
         } else {
             showError(errorEl, data.error || 'Login failed');
@@ -172,7 +194,7 @@ async function handleRegister(e) {
 
         if (response.ok) {
             currentUser = data.username;
-            loginPassphrase = data.password;
+            loginPassphrase = password;
             showDashboard();
         } else {
             showError(errorEl, data.error || 'Registration failed');
@@ -186,6 +208,7 @@ async function handleLogout() {
     try {
         await fetch(`${API_BASE}/api/auth/logout`, { method: 'POST' });
         currentUser = null;
+        loginPassphrase = null;
         showAuth();
     } catch (error) {
         console.error('Logout failed:', error);
@@ -207,26 +230,63 @@ function showAuth() {
     registerForm.reset();
 }
 
-// Load Apps
+// Load Apps (first page; further pages load as the sentinel scrolls into view)
 async function loadApps() {
+    appsCursor = null;
+    appsRequestId++;
+    appsLoading = false;
+    appsGrid.innerHTML = '';
+    await loadMoreApps(true);
+}
+
+async function loadMoreApps(firstPage = false) {
+    if (appsLoading || (!firstPage && !appsCursor)) {
+        return;
+    }
+    appsLoading = true;
+    const requestId = appsRequestId;
+
+    const [sort, order] = appsSort.value.split(':');
+    const params = new URLSearchParams({ sort, order, limit: APPS_PAGE_SIZE });
+    if (appsSearch.value) {
+        params.set('q', appsSearch.value);
+    }
+    if (appsCursor) {
+        params.set('cursor', appsCursor);
+    }
+
     try {
-        const response = await fetch(`${API_BASE}/api/apps`);
+        const response = await fetch(`${API_BASE}/api/apps?${params}`);
         const data = await response.json();
 
-        if (data.apps && data.apps.length > 0) {
-            renderApps(data.apps);
+        // A newer search/sort started while this page was in flight
+        if (requestId !== appsRequestId) {
+            return;
+        }
+
+        appsCursor = data.next_cursor || null;
+        renderApps(data.apps || []);
+
+        const shown = appsGrid.children.length;
+        if (shown > 0) {
             emptyState.classList.remove('show');
+            appsCount.textContent = `${shown} of ${data.total}`;
         } else {
-            appsGrid.innerHTML = '';
-            emptyState.classList.add('show');
+            appsCount.textContent = '';
+            // "No secrets yet" only makes sense for an unfiltered list
+            emptyState.classList.toggle('show', !appsSearch.value);
         }
     } catch (error) {
         console.error('Failed to load apps:', error);
+    } finally {
+        if (requestId === appsRequestId) {
+            appsLoading = false;
+        }
     }
 }
 
 function renderApps(apps) {
-    appsGrid.innerHTML = apps.map(app => `
+    appsGrid.insertAdjacentHTML('beforeend', apps.map(app => `
         <div class="app-card">
             <div class="app-card-header">
                 <div class="app-icon">🔑</div>
@@ -240,7 +300,7 @@ function renderApps(apps) {
                 Updated: ${new Date(app.modified * 1000).toLocaleDateString()}
             </div>
         </div>
-    `).join('');
+    `).join(''));
 }
 
 // Secret Operations
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from lib import aead, app_index, auth, config, log_backend, manifest, sessions, sqlite_backend
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty scratch directory (the code uses ./db) with in-process, cheap crypto."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("db")
+    monkeypatch.setattr(config, "CRYPTO_BACKEND", "aead")
+    monkeypatch.setattr(config, "AEAD_SCRYPT_LOG_N", 10)
+    monkeypatch.setattr(config, "SESSIONS_PATH", os.path.join("db", "sessions.sqlite3"))
+    # Per-process caches are keyed by username, not by directory
+    for cache in (auth._cache, manifest._cache, app_index._indexes, sessions._cache, sqlite_backend._cache):
+        cache.clear()
+    log_backend._users.clear()
+    sessions._local.conn = None
+    sqlite_backend._local.conn = None
+    aead.wipe_keys()
+    yield tmp_path
+    log_backend._users.clear()
+
+@pytest.fixture
+def login():
+    """Returns a function giving a web test client logged in as a newly registered user."""
+    import web_server
+
+    def login(username, password="password"):
+        client = web_server.app.test_client()
+        response = client.post("/api/auth/register", json={"username": username, "password": password})
+        assert response.status_code == 200, response.json
+        return client
+    return login
+
+@pytest.fixture
+def tcp_server(monkeypatch):
+    """Runs server.AsyncServer on a free loopback port in a thread; yields the server."""
+    import server
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    monkeypatch.setattr(config, "SERVER_METRICS_PORT", 0)
+    running = server.AsyncServer("127.0.0.1", port)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(running.serve(),))
+    thread.start()
+    deadline = time.monotonic() + 10
+    while running.server is None or running._closing is None:
+        assert thread.is_alive() and time.monotonic() < deadline, "server did not start"
+        time.sleep(0.01)
+    yield running
+    loop.call_soon_threadsafe(running.close)
+    thread.join(timeout=10)
+    loop.close()
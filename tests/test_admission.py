@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from lib import admission, auth, config
+
+class Holder:
+    """A request thread from `peer` that takes a slot of `pool` and keeps it until release()."""
+
+    def __init__(self, pool, peer):
+        self.admitted = threading.Event()
+        self._release = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(pool, peer))
+        self.thread.start()
+
+    def _run(self, pool, peer):
+        admission.set_peer(peer)
+        try:
+            with pool.slot():
+                self.admitted.set()
+                self._release.wait(10)
+        except admission.Overloaded as e:
+            self.error = e
+
+    def release(self):
+        self._release.set()
+        self.thread.join(timeout=10)
+        assert not self.thread.is_alive()
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 10
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def _slot_in_thread(pool, peer):
+    """Takes and releases a slot from a fresh request thread; returns the exception raised, if any."""
+    holder = Holder(pool, peer)
+    holder.release()
+    return holder.error
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_TIMEOUT", 5)
+    return admission.Pool("test", workers=1, queue=1, per_peer=1)
+
+def test_full_queue_and_busy_peer_are_turned_away(pool):
+    first = Holder(pool, "10.0.0.1")
+    assert first.admitted.wait(10)
+    queued = Holder(pool, "10.0.0.2")
+    _wait_for(lambda: pool.stats()["waiting"] == 1)
+
+    error = _slot_in_thread(pool, "10.0.0.1")
+    assert isinstance(error, admission.TooManyRequests) and error.status == 429
+    error = _slot_in_thread(pool, "10.0.0.3")
+    assert type(error) is admission.Overloaded and error.status == 503 and error.retry_after >= 1
+
+    first.release()
+    assert queued.admitted.wait(10)
+    queued.release()
+    stats = pool.stats()
+    assert (stats["admitted"], stats["rejected"], stats["rejected_peer"]) == (2, 1, 1)
+    assert (stats["active"], stats["waiting"], stats["peers"]) == (0, 0, 0)
+
+def test_queue_timeout(pool, monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_TIMEOUT", 0.05)
+    first = Holder(pool, "10.0.0.1")
+    assert first.admitted.wait(10)
+    error = _slot_in_thread(pool, "10.0.0.2")
+    assert type(error) is admission.Overloaded and "timed out" in str(error)
+    first.release()
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["peers"] == 0
+    assert _slot_in_thread(pool, "10.0.0.2") is None
+
+def test_only_request_threads_are_admitted(pool):
+    first = Holder(pool, "10.0.0.1")
+    assert first.admitted.wait(10)
+    ran = []
+
+    def untagged():
+        with pool.slot():
+            ran.append(True)
+
+    thread = threading.Thread(target=untagged)
+    thread.start()
+    thread.join(timeout=10)
+    assert ran == [True]        # helper threads and command-line tools never wait
+    first.release()
+
+def test_nested_slots_count_once(pool):
+    errors = []
+
+    def nested():
+        admission.set_peer("10.0.0.1")
+        try:
+            with pool.slot(), pool.slot():
+                pass
+        except admission.Overloaded as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=nested)
+    thread.start()
+    thread.join(timeout=10)
+    assert errors == [] and pool.stats()["admitted"] == 1
+
+@pytest.mark.parametrize("peer, status", [
+    ("127.0.0.1", 429),     # the test client's own address already holds its share
+    ("10.0.0.1", 503),      # someone else has the only slot, and the queue is off
+])
+def test_web_server_sheds_load_with_retry_after(peer, status, monkeypatch):
+    import web_server
+    monkeypatch.setattr(config, "ADMISSION_CONTROL", True)
+    auth.register_user("alice", "password")
+    auth.invalidate_cache()     # the login must run PBKDF2
+    monkeypatch.setattr(admission, "AUTH", admission.Pool("auth", workers=1, queue=0, per_peer=1))
+    holder = Holder(admission.AUTH, peer)
+    assert holder.admitted.wait(10)
+    try:
+        response = web_server.app.test_client().post(
+            "/api/auth/login", json={"username": "alice", "password": "password"})
+    finally:
+        holder.release()
+    assert response.status_code == status
+    assert int(response.headers["Retry-After"]) >= 1 and "error" in response.json
+    response = web_server.app.test_client().post(
+        "/api/auth/login", json={"username": "alice", "password": "password"})
+    assert response.status_code == 200
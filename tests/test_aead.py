@@ -0,0 +1,134 @@
+import pytest
+
+from lib import aead, config, crypto
+
+@pytest.fixture
+def derivations(monkeypatch):
+    """Counts scrypt runs."""
+    runs = []
+    derive_key = aead.derive_key
+
+    def counting(passphrase, salt, log_n, r, p):
+        runs.append(salt)
+        return derive_key(passphrase, salt, log_n, r, p)
+
+    monkeypatch.setattr(aead, "derive_key", counting)
+    return runs
+
+@pytest.mark.parametrize("cipher", ["chacha20-poly1305", "aes-256-gcm"])
+def test_round_trip(cipher, monkeypatch):
+    monkeypatch.setattr(config, "AEAD_CIPHER", cipher)
+    blob = aead.encrypt(b"secret", "passphrase")
+    assert aead.decrypt(blob, "passphrase") == b"secret"
+    assert aead.encrypt(b"secret", "passphrase") != blob       # fresh salt and nonce
+    with pytest.raises(aead.DecryptionError):
+        aead.decrypt(blob, "wrong")
+
+def test_crypto_facade_dispatches_on_the_ciphertext():
+    result = crypto.encrypt_secret("secret", "passphrase", backend="aead")
+    assert result.ok and aead.is_aead_text(str(result))
+    assert crypto.backend_for(str(result)) == "aead"
+    decrypted = crypto.decrypt_secret(str(result), "passphrase")
+    assert decrypted.ok and decrypted.data == b"secret"
+    assert not crypto.decrypt_secret(str(result), "wrong").ok
+    assert not crypto.decrypt_secret(aead.TEXT_PREFIX + "not base64!", "passphrase").ok
+
+# Header offsets: magic 0-2, version 3, alg 4, kdf 5, log2(N) 6, r 7, p 8, salt 9-24, nonce 25-36
+@pytest.mark.parametrize("offset, value", [
+    (0, ord("X")),      # magic
+    (3, 2),             # version
+    (4, 9),             # cipher
+    (5, 9),             # KDF
+    (7, 4),             # r: in range, but bound to the ciphertext
+    (12, 0),            # salt
+    (30, 0),            # nonce
+    (50, 0),            # ciphertext
+])
+def test_tampering_is_detected(offset, value):
+    blob = bytearray(aead.encrypt(b"secret", "passphrase"))
+    blob[offset] = value if blob[offset] != value else value + 1
+    with pytest.raises(aead.DecryptionError):
+        aead.decrypt(bytes(blob), "passphrase")
+
+@pytest.mark.parametrize("log_n, r, p", [
+    (0, 8, 1),
+    (64, 8, 1),
+    (255, 8, 1),
+    (20, 255, 1),       # 128 * r * N far beyond MAX_SCRYPT_MEMORY
+    (10, 0, 1),
+    (10, 8, 0),
+    (10, 8, 17),
+])
+def test_out_of_range_scrypt_params_are_rejected_before_deriving(log_n, r, p, derivations):
+    blob = bytearray(aead.encrypt(b"secret", "passphrase"))
+    derivations.clear()
+    blob[6:9] = bytes([log_n, r, p])
+    with pytest.raises(aead.DecryptionError, match="out of range"):
+        aead.decrypt(bytes(blob), "passphrase")
+    with pytest.raises(aead.DecryptionError):
+        aead.cached_key("passphrase", bytes(16), (log_n, r, p))
+    assert derivations == []
+
+def test_truncated_ciphertext():
+    with pytest.raises(aead.DecryptionError):
+        aead.decrypt(aead.encrypt(b"secret", "passphrase")[:aead.HEADER_SIZE - 1], "passphrase")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def key_cache(monkeypatch):
+    monkeypatch.setattr(config, "KEY_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "KEY_CACHE_TTL", 60)
+    clock = Clock()
+    monkeypatch.setattr(aead, "time", clock)
+    yield clock
+    aead.wipe_keys()
+
+def test_key_cache_saves_derivations_within_a_scope(key_cache, derivations):
+    first = aead.encrypt(b"one", "passphrase", scope="s1")
+    second = aead.encrypt(b"two", "passphrase", scope="s1")    # reuses the cached key's salt
+    assert aead.decrypt(first, "passphrase", scope="s1") == b"one"
+    assert aead.decrypt(second, "passphrase", scope="s1") == b"two"
+    assert len(derivations) == 1
+    aead.decrypt(first, "passphrase", scope="s2")               # scopes share nothing
+    aead.decrypt(first, "passphrase")                           # no scope, no cache
+    assert len(derivations) == 3
+    with pytest.raises(aead.DecryptionError):
+        aead.decrypt(first, "wrong", scope="s1")
+    assert aead.key_cache_stats()["hits"] >= 3
+
+def test_cached_keys_expire(key_cache, derivations):
+    blob = aead.encrypt(b"secret", "passphrase", scope="s")
+    key_cache.now += 59
+    aead.decrypt(blob, "passphrase", scope="s")
+    assert len(derivations) == 1
+    key_cache.now += 2
+    aead.decrypt(blob, "passphrase", scope="s")
+    assert len(derivations) == 2
+
+def test_callers_get_copies_and_wiping_zeroes_the_cache(key_cache):
+    params = (config.AEAD_SCRYPT_LOG_N, config.AEAD_SCRYPT_R, config.AEAD_SCRYPT_P)
+    derived = aead.cached_key("passphrase", bytes(16), params, scope="s")
+    key = aead.cached_key("passphrase", bytes(16), params, scope="s")      # from the cache
+    assert key == derived
+    [(cached, _)] = aead._key_cache.values()
+    assert isinstance(key, bytes) and cached == key
+    aead.cached_key("passphrase", bytes(16), params, scope="other")
+    aead.wipe_keys("s")
+    assert cached == bytes(len(cached))       # zeroed in place...
+    assert key != bytes(len(key))              # ...while the caller's copy is intact
+    assert aead.key_cache_stats()["size"] == 1
+    aead.wipe_keys()
+    assert aead.key_cache_stats()["size"] == 0
+
+def test_key_cache_is_bounded(key_cache, monkeypatch):
+    monkeypatch.setattr(config, "KEY_CACHE_SIZE", 2)
+    blobs = [aead.encrypt(b"secret", "passphrase", scope=f"s{i}") for i in range(3)]
+    assert aead.key_cache_stats()["size"] == 2
+    assert aead.key_cache_stats()["evictions"] >= 1
+    assert all(aead.decrypt(blob, "passphrase", scope=f"s{i}") == b"secret" for i, blob in enumerate(blobs))
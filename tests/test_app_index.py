@@ -0,0 +1,59 @@
+import pytest
+
+from lib import app_index, auth, storage
+
+@pytest.fixture
+def user():
+    auth.register_user("alice", "password")
+    storage.store_many_payloads("alice", "password", [
+        (f"app{i:02d}", {"app_username": "a" * i, "password": "x", "timestamp": "20260101-000000"})
+        for i in range(25)
+    ])
+    return "alice"
+
+def _pages(username, **options):
+    names, cursor = [], None
+    while True:
+        page, cursor, total = app_index.query(username, cursor=cursor, limit=10, **options)
+        names.append([entry["name"] for entry in page])
+        if cursor is None:
+            return names, total
+
+def test_pages_cover_every_app_once(user):
+    pages, total = _pages(user)
+    assert total == 25
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == [f"app{i:02d}" for i in range(25)]
+
+def test_descending(user):
+    pages, _ = _pages(user, order="desc")
+    assert sum(pages, []) == [f"app{i:02d}" for i in reversed(range(25))]
+
+def test_sort_by_size(user):
+    pages, _ = _pages(user, sort="size")
+    sizes = [entry["size"] for entry in app_index.query(user, sort="size")[0]]
+    assert sizes == sorted(sizes)
+    assert len(sum(pages, [])) == 25
+
+def test_cursor_is_stable_while_apps_change(user):
+    page, cursor, _ = app_index.query(user, limit=10)
+    assert page[-1]["name"] == "app09"
+    storage.store_payload(user, "app00b", "password", {"password": "x"})   # before the cursor
+    storage.delete_payload(user, "app10", "password")                      # the next one
+    page, _, total = app_index.query(user, cursor=cursor, limit=3)
+    assert [entry["name"] for entry in page] == ["app11", "app12", "app13"]
+    assert total == 25
+
+def test_filters(user):
+    page, cursor, total = app_index.query(user, prefix="app1", limit=4)
+    assert [entry["name"] for entry in page] == ["app10", "app11", "app12", "app13"]
+    assert total == 10
+    page, _, total = app_index.query(user, contains="P2", cursor=cursor)
+    assert [entry["name"] for entry in page] == [f"app2{i}" for i in range(5)]
+
+def test_bad_cursor(user):
+    with pytest.raises(ValueError):
+        app_index.query(user, cursor="not a cursor")
+    _, cursor, _ = app_index.query(user, sort="size", limit=5)
+    with pytest.raises(ValueError):
+        app_index.query(user, sort="name", cursor=cursor)
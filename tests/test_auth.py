@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from lib import auth, config, storage
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def kdf_runs(monkeypatch):
+    """Counts PBKDF2 derivations."""
+    runs = []
+    hash_password = auth.hash_password
+
+    def counting(password, salt=None):
+        runs.append(password)
+        return hash_password(password, salt)
+
+    monkeypatch.setattr(auth, "hash_password", counting)
+    return runs
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+def test_cache_skips_the_kdf(kdf_runs):
+    auth.register_user("alice", "password")
+    kdf_runs.clear()
+    assert auth.check_auth("alice", "password")
+    assert auth.check_auth("alice", "password")
+    assert len(kdf_runs) == 1
+    assert not auth.check_auth("alice", "wrong")
+    assert not auth.check_auth("alice", "wrong")
+    assert len(kdf_runs) == 3          # failures are never cached
+    assert auth.cache_stats()["hits"] >= 1
+
+def test_cache_entries_expire(kdf_runs, clock, monkeypatch):
+    monkeypatch.setattr(config, "AUTH_CACHE_TTL", 60)
+    auth.register_user("alice", "password")
+    assert auth.check_auth("alice", "password")
+    kdf_runs.clear()
+    clock.now += 59
+    assert auth.check_auth("alice", "password")
+    assert kdf_runs == []
+    clock.now += 61
+    assert auth.check_auth("alice", "password")
+    assert len(kdf_runs) == 1
+
+def test_password_change_invalidates_the_cache(kdf_runs):
+    auth.register_user("alice", "password")
+    assert auth.check_auth("alice", "password")
+    assert auth.change_password("alice", "password", "new password")
+    assert not auth.check_auth("alice", "password")
+    assert auth.check_auth("alice", "new password")
+
+def test_rewritten_auth_file_invalidates_the_cache():
+    # Another process changing the password is noticed through auth.json itself
+    auth.register_user("alice", "password")
+    assert auth.check_auth("alice", "password")
+    with open("db/alice/auth.json.new", "w") as f:
+        json.dump(auth._auth_record("other"), f)
+    os.replace("db/alice/auth.json.new", "db/alice/auth.json")
+    assert not auth.check_auth("alice", "password")
+    assert auth.check_auth("alice", "other")
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(config, "AUTH_CACHE_SIZE", 2)
+    for name in ("a", "b", "c"):
+        auth.register_user(name, "password")
+        assert auth.check_auth(name, "password")
+    assert auth.cache_stats()["size"] == 2
+    assert [key[0] for key in auth._cache] == ["b", "c"]
+
+def test_register_and_change_password():
+    assert auth.register_user("alice", "password")
+    assert not auth.register_user("alice", "other")      # never overwrites an account
+    assert auth.check_auth("alice", "password")
+    assert not auth.change_password("alice", "wrong", "new password")
+    assert auth.check_auth("alice", "password")
+    assert auth.change_password("alice", "password", "new password")
+    assert auth.check_auth("alice", "new password")
+    assert not auth.check_auth("bob", "password")
+
+def test_legacy_sha256_hash_is_migrated_on_login():
+    # The format of the db/*/auth.json files that predate PBKDF2
+    os.makedirs("db/alice")
+    with open("db/alice/auth.json", "w") as f:
+        json.dump({"hash": hashlib.sha256(b"password").hexdigest()}, f)
+    assert not auth.check_auth("alice", "wrong")
+    with open("db/alice/auth.json") as f:
+        assert "salt" not in json.load(f)
+    assert auth.check_auth("alice", "password")
+    with open("db/alice/auth.json") as f:
+        record = json.load(f)
+    assert record["method"] == "pbkdf2:sha256:100000" and "salt" in record
+    auth._cache.clear()
+    assert auth.check_auth("alice", "password")
+    assert not auth.check_auth("alice", "wrong")
+
+def test_storing_does_not_rewrite_credentials():
+    storage.store_payload("alice", "mail", "password", {"password": "x"})   # registers alice
+    signature = auth.credentials_signature("alice")
+    storage.store_payload("alice", "bank", "password", {"password": "y"})
+    assert auth.credentials_signature("alice") == signature
+    with pytest.raises(PermissionError):
+        storage.store_payload("alice", "mail", "wrong", {"password": "z"})
+    assert auth.credentials_signature("alice") == signature
@@ -0,0 +1,78 @@
+import os
+import threading
+
+import pytest
+
+from lib import config, durable
+
+@pytest.fixture
+def group_commit(monkeypatch):
+    monkeypatch.setattr(config, "GROUP_COMMIT", True)
+    monkeypatch.setattr(config, "GROUP_COMMIT_WINDOW_MS", 200)
+
+def _write_concurrently(count):
+    """atomic_write from `count` threads at once; returns each thread's exception or None."""
+    errors = [None] * count
+    start = threading.Barrier(count)
+
+    def write(i):
+        start.wait()
+        try:
+            durable.atomic_write(f"file-{i}", f"data {i}")
+        except BaseException as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads), "a writer was never released"
+    return errors
+
+def _temp_files():
+    return [name for name in os.listdir(".") if name.endswith(".tmp")]
+
+def test_atomic_write_replaces():
+    durable.atomic_write("file", "old")
+    durable.atomic_write("file", b"new")
+    with open("file") as f:
+        assert f.read() == "new"
+    assert _temp_files() == []
+
+def test_atomic_create_never_replaces():
+    assert durable.atomic_create("file", "first")
+    assert not durable.atomic_create("file", "second")
+    with open("file") as f:
+        assert f.read() == "first"
+    assert _temp_files() == []
+
+def test_concurrent_writers_share_a_batch(group_commit):
+    before = durable.stats()
+    assert _write_concurrently(8) == [None] * 8
+    for i in range(8):
+        with open(f"file-{i}") as f:
+            assert f.read() == f"data {i}"
+    after = durable.stats()
+    assert after["writes"] - before["writes"] == 8
+    assert after["batches"] - before["batches"] < 8
+
+def test_failed_flush_releases_every_writer(group_commit, monkeypatch):
+    def fail(batch, use_syncfs):
+        raise RuntimeError("flush failed")
+    with monkeypatch.context() as m:
+        m.setattr(durable, "_flush_batch", fail)
+        errors = _write_concurrently(6)
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert _temp_files() == []
+    assert not any(os.path.exists(f"file-{i}") for i in range(6))
+    # The next batch gets a new leader
+    assert _write_concurrently(3) == [None] * 3
+
+def test_failed_rename_reports_to_the_whole_batch(group_commit, monkeypatch):
+    def fail(src, dst):
+        raise OSError("no space left")
+    monkeypatch.setattr(os, "replace", fail)
+    errors = _write_concurrently(4)
+    assert all(isinstance(e, OSError) for e in errors)
+    assert _temp_files() == []
@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import ROOT
+from lib import config, log_backend
+
+def _payload(i):
+    return {"app_username": "alice", "password": f"secret {i}", "timestamp": "20260101-000000"}
+
+def _latest(username, app_name):
+    result = log_backend.read(username, app_name)
+    return result and json.loads(result[0])
+
+def test_write_read_delete():
+    results = log_backend.write("alice", [("mail", _payload(1)), ("bank", _payload(2))])
+    assert [(name, error) for name, _, error in results] == [("mail", None), ("bank", None)]
+    assert _latest("alice", "mail") == _payload(1)
+    assert log_backend.read_many("alice", ["bank", "none"]) == {"bank": json.dumps(_payload(2)), "none": None}
+    assert log_backend.delete("alice", "mail")
+    assert not log_backend.delete("alice", "mail")
+    assert log_backend.read("alice", "mail") is None
+    assert sorted(log_backend.snapshot("alice")[1]) == ["bank"]
+
+def test_history_and_versions():
+    for i in range(3):
+        log_backend.write("alice", [("mail", _payload(i))])
+    history = log_backend.history("alice", "mail")
+    assert [h["version"] for h in history] == [1, 2, 3]
+    assert json.loads(log_backend.read_version("alice", "mail", 2)[0]) == _payload(1)
+    assert log_backend.read_version("alice", "mail", 9) is None
+
+def test_compaction_keeps_retained_versions(monkeypatch):
+    monkeypatch.setattr(config, "LOG_RETENTION", 2)
+    for i in range(5):
+        log_backend.write("alice", [("mail", _payload(i)), ("gone", _payload(i))])
+    log_backend.delete("alice", "gone")
+    assert log_backend.compact("alice") > 0
+    assert [h["version"] for h in log_backend.history("alice", "mail")] == [4, 5]
+    assert log_backend.read("alice", "gone") is None
+    # A fresh process (here: a fresh index) recovers the same state from disk
+    log_backend._users.clear()
+    assert [h["version"] for h in log_backend.history("alice", "mail")] == [4, 5]
+    assert _latest("alice", "mail") == _payload(4)
+
+def test_recovery_drops_torn_tail():
+    log_backend.write("alice", [("mail", _payload(1))])
+    log_backend.write("alice", [("mail", _payload(2))])
+    log_dir = os.path.join("db", "alice", "log")
+    segment = os.path.join(log_dir, sorted(n for n in os.listdir(log_dir) if n.endswith(".log"))[-1])
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - 3)
+    log_backend._users.clear()
+    assert _latest("alice", "mail") == _payload(1)
+    log_backend.write("alice", [("mail", _payload(3))])
+    assert [h["version"] for h in log_backend.history("alice", "mail")] == [1, 2]
+    assert _latest("alice", "mail") == _payload(3)
+
+WRITER = textwrap.dedent("""
+    import json, sys
+    from lib import config, log_backend
+    config.LOG_SEGMENT_SIZE = 1024      # roll often, so compaction has sealed segments to rewrite
+    worker, count = sys.argv[1], int(sys.argv[2])
+    for i in range(count):
+        payload = {"password": f"{worker}-{i}"}
+        results = log_backend.write("alice", [(f"app-{worker}", payload), ("shared", payload)])
+        assert all(error is None for _, _, error in results), results
+        data, _ = log_backend.read("alice", f"app-{worker}")
+        assert json.loads(data) == payload, (data, payload)
+        if worker == "0" and i == count // 2:
+            assert log_backend.compact("alice") > 0
+""")
+
+def test_processes_share_a_log():
+    log_backend.write("alice", [("before", _payload(0))])
+    _latest("alice", "before")    # this process holds an index while the others write
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    count = 40
+    workers = [
+        subprocess.Popen([sys.executable, "-c", WRITER, str(n), str(count)], env=env, stderr=subprocess.PIPE)
+        for n in range(3)
+    ]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=60)
+        assert worker.returncode == 0, stderr.decode()
+
+    for n in range(3):
+        assert _latest("alice", f"app-{n}") == {"password": f"{n}-{count - 1}"}
+    shared = log_backend.history("alice", "shared")
+    assert [h["version"] for h in shared] == list(range(3 * count - len(shared) + 1, 3 * count + 1))
+    assert _latest("alice", "before") == _payload(0)
+    log_backend.write("alice", [("after", _payload(1))])
+    log_backend._users.clear()
+    assert sorted(log_backend.snapshot("alice")[1]) == ["after", "app-0", "app-1", "app-2", "before", "shared"]
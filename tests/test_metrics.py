@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lib import config, metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Another serve.py worker: serves one TCP store, shares its numbers, then
+# stays alive until its stdin is closed
+WORKER = """
+from lib import config, metrics
+metrics.begin("tcp", "STORE")
+metrics.end("ok")
+metrics.share(config.METRICS_SHARED_DIR)
+print("shared", flush=True)
+import sys
+sys.stdin.read()
+"""
+
+@pytest.fixture
+def shared(monkeypatch):
+    """This process's metrics, empty, shared like a worker's (without the publishing thread)."""
+    monkeypatch.setattr(config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "_requests", {})
+    monkeypatch.setattr(metrics, "_stages", {})
+    monkeypatch.setattr(metrics, "_shared_dir", config.METRICS_SHARED_DIR)
+    os.makedirs(config.METRICS_SHARED_DIR)
+    return config.METRICS_SHARED_DIR
+
+def _start_worker():
+    worker = subprocess.Popen(
+        [sys.executable, "-c", WORKER], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        env=dict(os.environ, PYTHONPATH=ROOT, PAYLOAD_METRICS="1"),
+    )
+    assert worker.stdout.readline() == b"shared\n"
+    return worker
+
+def _stop(worker):
+    worker.stdin.close()
+    worker.wait(timeout=10)
+    worker.stdout.close()
+
+def test_prometheus_reports_every_live_worker(shared):
+    with metrics.stage("read"):
+        pass
+    metrics.begin("http", "/api/secrets/retrieve")
+    with metrics.stage("read"):
+        pass
+    metrics.end(200)
+    worker = _start_worker()
+    try:
+        text = metrics.prometheus({"auth_cache": {"hits": 3}})
+    finally:
+        _stop(worker)
+
+    this, other = f'worker="{os.getpid()}"', f'worker="{worker.pid}"'
+    assert f'payload_request_seconds_count{{{this},transport="http",name="/api/secrets/retrieve",status="200"}} 1' in text
+    assert f'payload_request_seconds_count{{{other},transport="tcp",name="STORE",status="ok"}} 1' in text
+    assert f'payload_stage_seconds_count{{{this},transport="-",name="-",stage="read"}} 1' in text
+    assert f'payload_uptime_seconds{{{other}}}' in text
+    assert f'payload_auth_cache_hits{{{this}}} 3' in text
+    assert f'payload_auth_cache_hits{{{other}}}' not in text      # gauges are this process's own
+    assert text.count("# TYPE payload_request_seconds histogram") == 1
+
+def test_exited_workers_are_dropped(shared):
+    worker = _start_worker()
+    _stop(worker)
+    path = os.path.join(shared, f"{worker.pid}.json")
+    assert os.path.exists(path)
+    assert f'worker="{worker.pid}"' not in metrics.prometheus()
+    assert not os.path.exists(path)
+
+def test_unreadable_files_are_skipped(shared):
+    with open(os.path.join(shared, f"{os.getppid()}.json"), "w") as f:
+        f.write('{"started": ')                      # a live process's torn file
+    with open(os.path.join(shared, "notes.json"), "w") as f:
+        f.write("{}")
+    metrics._publish()                               # our own file is not read back
+    workers = metrics._workers()
+    assert [pid for pid, _, _, _ in workers] == [os.getpid()]
+    assert "payload_uptime_seconds" in metrics.prometheus()
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+import server
+from lib import config, network
+
+MESSAGE = {"command": "STORE", "tricky": 'quote " brace } bracket ] backslash \\', "nested": [{"a": []}]}
+
+def _scan(data, size):
+    scanner = network.RequestScanner()
+    for i in range(0, len(data), size):
+        if scanner.feed(data[i:i + size]):
+            break
+    return scanner
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 8192])
+def test_scanner_finds_end_of_bare_json(size):
+    data = json.dumps(MESSAGE).encode("utf-8")
+    scanner = _scan(data, size)
+    assert scanner.complete
+    assert json.loads(scanner.data()) == MESSAGE
+
+def test_scanner_newline_and_incomplete():
+    assert _scan(b'{"a": "b\n', 100).complete      # newline-terminated requests end at once
+    assert not _scan(b'{"a": {"b": 1}', 1).complete
+    assert not _scan(b'{"a": "}', 1).complete
+    assert not _scan(b'{"a": "\\', 1).complete
+    assert _scan(b'"a string"', 3).complete
+
+def test_scanner_large_request_in_small_chunks():
+    data = json.dumps({"items": [MESSAGE] * 20000}).encode("utf-8")
+    scanner = network.RequestScanner()
+    chunks = [data[i:i + 512] for i in range(0, len(data), 512)]
+    assert not any(scanner.feed(chunk) for chunk in chunks[:-1])
+    assert scanner.feed(chunks[-1]) and scanner.data() == data
+
+def test_receive_request_over_a_socket():
+    ours, theirs = socket.socketpair()
+    data = json.dumps(MESSAGE).encode("utf-8")
+    sender = threading.Thread(target=lambda: [theirs.sendall(data[i:i + 5]) for i in range(0, len(data), 5)])
+    sender.start()
+    assert json.loads(network.receive_request(ours, buffer_size=7)) == MESSAGE
+    sender.join()
+    theirs.close()
+    assert network.receive_request(ours) == b""
+    ours.close()
+
+def _read_request(chunks, data=b""):
+    async def run():
+        reader = asyncio.StreamReader()
+        for chunk in chunks:
+            reader.feed_data(chunk)
+        reader.feed_eof()
+        return await server.read_request(reader, data)
+    return asyncio.run(run())
+
+def test_server_read_request():
+    data = json.dumps(MESSAGE).encode("utf-8")
+    assert _read_request([data[3:]], data[:3]) == data
+    assert _read_request([b'{"a": 1}\n']) == b'{"a": 1}\n'
+
+def test_server_refuses_oversized_requests(monkeypatch):
+    monkeypatch.setattr(config, "SERVER_MAX_REQUEST", 1000)
+    with pytest.raises(ValueError):
+        _read_request([b'{"a": "' + b"x" * 2000])
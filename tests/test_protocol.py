@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from lib import auth, config, network, protocol, record
+
+PAYLOAD = {
+    "app_username": "alice",
+    "password": record.armor_pgp(b"\x8c\x0d" + bytes(range(100))),
+    "timestamp": "20260101-120000",
+}
+
+REQUESTS = [
+    protocol.store_request("user", "mail", "pw", PAYLOAD),
+    protocol.retrieve_request("user", "mail", "pw"),
+    protocol.batch_retrieve_request("user", ["mail", "bank", "ünï"], "pw"),
+    protocol.batch_store_request("user", "pw", [("mail", PAYLOAD), ("bank", PAYLOAD)]),
+]
+
+@pytest.mark.parametrize("message", REQUESTS)
+@pytest.mark.parametrize("binary", [False, True])
+def test_request_round_trip(message, binary):
+    data = protocol.encode_request(message, binary)
+    assert protocol.is_binary(data) == binary
+    assert protocol.parse_message(data) == message
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_response_round_trip(binary):
+    assert protocol.parse_response(protocol.encode_text("ACK: Payload stored", binary)) == "ACK: Payload stored"
+    assert protocol.parse_response(protocol.encode_payload(json.dumps(PAYLOAD), binary)) == PAYLOAD
+    assert protocol.parse_response(protocol.encode_payload(None, binary)) is None
+    apps = {"mail": json.dumps(PAYLOAD), "gone": None}
+    assert protocol.parse_response(protocol.encode_apps(apps, binary)) == {"apps": {"mail": PAYLOAD, "gone": None}}
+    assert protocol.parse_response(protocol.encode_apps({}, binary)) == {"apps": {}}
+    summary = {"stored": 2, "errors": []}
+    assert protocol.parse_response(protocol.encode_summary(summary, binary)) == summary
+
+def test_json_responses_match_legacy_bytes():
+    assert protocol.encode_payload(json.dumps(PAYLOAD)) == json.dumps(PAYLOAD).encode("utf-8")
+    assert protocol.encode_summary({"stored": 1}) == b'{"stored": 1}\n'
+    assert protocol.parse_message(protocol.create_retrieve_request("user", "mail", "pw").encode()) == REQUESTS[1]
+
+def test_truncated_binary_body():
+    data = protocol.encode_request(REQUESTS[0], binary=True)
+    with pytest.raises(ValueError):
+        protocol.parse_message(data[:-5])
+
+def test_hello_and_frames():
+    assert protocol.parse_hello(protocol.hello()) == protocol.FRAME_VERSION
+    assert protocol.parse_hello(b"{\"a\": 1}\n") is None
+    frame = protocol.encode_frame(7, b"body")
+    length, request_id = protocol.FRAME_HEADER.unpack(frame[:protocol.FRAME_HEADER.size])
+    assert (length, request_id) == (4, 7)
+    assert frame[protocol.FRAME_HEADER.size:] == b"body"
+
+@pytest.mark.parametrize("encoding", ["json", "binary"])
+def test_pipelined_requests_against_the_server(tcp_server, encoding, monkeypatch):
+    monkeypatch.setattr(config, "WIRE_ENCODING", encoding)
+    auth.register_user("user", "pw")
+    connection = network.Connection("127.0.0.1", tcp_server.port)
+    try:
+        responses = connection.pipeline(REQUESTS)
+        assert connection.framed and connection.idle and connection.binary == (encoding == "binary")
+    finally:
+        connection.close()
+    assert [protocol.parse_response(r) for r in responses[:1]] == ["ACK: Payload stored"]
+    assert protocol.parse_response(responses[1]) in (None, PAYLOAD)    # may run before the store
+    apps = protocol.parse_response(responses[2])["apps"]
+    assert set(apps) == {"mail", "bank", "ünï"} and apps["ünï"] is None
+    assert protocol.parse_response(responses[3]) == {"stored": 2, "errors": []}
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from lib import aead, config, fs_backend, record
+
+PGP = record.armor_pgp(b"\x8c\x0d\x04\x09\x03\x02" + os.urandom(200))
+
+@pytest.mark.parametrize("payload", [
+    {"app_username": "alice", "password": PGP, "timestamp": "20260101-120000"},
+    {"app_username": "bob", "password": aead.to_text(os.urandom(80)), "timestamp": "20260101-120000"},
+    {"app_username": "", "password": "not a known ciphertext form"},
+    {"password": PGP.replace("\n", "\r\n")},            # armor we would not rebuild: kept as text
+    {"app_username": 7, "timestamp": "x" * 40, "note": {"a": [1, 2]}},  # odd fields go to the extra JSON
+    {},
+])
+def test_round_trip(payload):
+    assert record.decode(record.encode(payload)) == payload
+
+def test_pgp_is_stored_raw():
+    blob = record.encode({"password": PGP})
+    assert len(blob) < len(PGP)
+    assert blob[3] == 2 and blob[5] == record.ENC_PGP_CHECKSUM
+
+def test_older_encodings_keep_version_1():
+    blob = record.encode({"password": aead.to_text(os.urandom(80))})
+    assert blob[3] == 1 and blob[5] == record.ENC_AEAD
+
+def test_rejects_encoding_newer_than_version():
+    blob = bytearray(record.encode({"password": PGP}))
+    blob[3] = 1
+    with pytest.raises(record.RecordError):
+        record.decode(bytes(blob))
+
+@pytest.mark.parametrize("damage", [
+    lambda blob: blob[:10],
+    lambda blob: b"XYZ" + blob[3:],
+    lambda blob: blob + b"trailing",
+])
+def test_rejects_damaged_records(damage):
+    blob = record.encode({"app_username": "alice", "password": PGP})
+    with pytest.raises(record.RecordError):
+        record.decode(damage(blob))
+
+def test_read_metadata(tmp_path):
+    path = tmp_path / "secret.bin"
+    path.write_bytes(record.encode({"app_username": "alice", "password": PGP, "timestamp": "20260101-120000"}))
+    meta = record.read_metadata(str(path))
+    assert meta["app_username"] == "alice"
+    assert meta["timestamp"] == "20260101-120000"
+
+def test_fs_backend_reads_both_formats(monkeypatch):
+    payload = {"app_username": "alice", "password": PGP, "timestamp": "20260101-120000"}
+    monkeypatch.setattr(config, "RECORD_FORMAT", "json")
+    fs_backend.write("alice", [("mail", payload)])
+    assert os.path.exists("db/alice/mail/secret.json")
+    monkeypatch.setattr(config, "RECORD_FORMAT", "bin")
+    fs_backend.write("alice", [("mail", payload)])
+    assert os.listdir("db/alice/mail") == ["secret.bin"]      # the other format is removed
+    assert json.loads(fs_backend.read("alice", "mail")[0]) == payload
@@ -0,0 +1,78 @@
+import pytest
+
+from lib import auth, config, sessions
+
+class Clock:
+    def __init__(self):
+        self.now = 1_800_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions, "time", clock)
+    monkeypatch.setattr(config, "SESSION_IDLE_TIMEOUT", 100)
+    monkeypatch.setattr(config, "SESSION_MAX_AGE", 1000)
+    monkeypatch.setattr(config, "SESSION_TOUCH_INTERVAL", 10)
+    auth.register_user("alice", "password")
+    return clock
+
+def _other_worker():
+    """Another pre-fork worker: same table, nothing cached."""
+    sessions._cache.clear()
+
+def test_create_and_get(clock):
+    token, session = sessions.create("alice")
+    assert sessions.get(token) is session
+    assert sessions.get("not a token") is None
+    assert sessions.get("") is None
+    _other_worker()
+    assert sessions.get(token).username == "alice"
+
+def test_idle_timeout(clock):
+    token, _ = sessions.create("alice")
+    for _ in range(5):
+        clock.now += 90
+        assert sessions.get(token) is not None
+    clock.now += 101
+    assert sessions.get(token) is None
+    clock.now -= 101
+    _other_worker()
+    assert sessions.get(token) is None     # expired sessions are removed from the table too
+
+def test_activity_in_another_worker_keeps_a_session_alive(clock):
+    token, _ = sessions.create("alice")
+    here = dict(sessions._cache)
+    clock.now += 60
+    _other_worker()
+    assert sessions.get(token) is not None  # past the touch interval: last_seen is written
+    sessions._cache.update(here)           # back in the first worker, whose copy is stale
+    clock.now += 60
+    assert sessions.get(token) is not None
+
+def test_max_age(clock):
+    token, _ = sessions.create("alice")
+    for _ in range(10):
+        clock.now += 99
+        assert sessions.get(token) is not None
+    clock.now += 99
+    assert sessions.get(token) is None
+
+def test_password_change_ends_sessions(clock):
+    token, _ = sessions.create("alice")
+    kept, session = sessions.create("alice")
+    assert auth.change_password("alice", "password", "new password")
+    sessions.rekey(session)
+    assert sessions.get(token) is None
+    assert sessions.get(kept) is session
+    _other_worker()
+    assert sessions.get(kept).username == "alice"
+
+def test_end(clock):
+    token, session = sessions.create("alice")
+    sessions.end(session)
+    assert sessions.get(token) is None
+    _other_worker()
+    assert sessions.get(token) is None
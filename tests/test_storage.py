@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+from lib import auth, config, storage
+
+BACKENDS = sorted(storage.BACKENDS)
+
+TRAVERSAL_NAMES = ["../bob/gmail", "..", ".", "a/b", "a\\b", ".trees", "x\0y", "", None, ["gmail"]]
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_BACKEND", request.param)
+    auth.register_user("alice", "password")
+    auth.register_user("bob", "password")
+    return request.param
+
+def test_round_trip(backend):
+    payload = {"app_username": "alice", "password": "secret", "timestamp": "20260101-000000"}
+    storage.store_payload("alice", "mail", "password", payload)
+    data, _ = storage.retrieve_latest_payload("alice", "mail", "password")
+    assert json.loads(data) == payload
+    assert storage.retrieve_many_payloads("alice", ["mail", "none"], "password")["none"] is None
+    assert storage.get_metadata("alice", "mail")["app_username"] == "alice"
+    with pytest.raises(PermissionError):
+        storage.retrieve_latest_payload("alice", "mail", "wrong")
+    assert storage.delete_payload("alice", "mail", "password")
+    assert storage.retrieve_latest_payload("alice", "mail", "password") is None
+
+@pytest.mark.parametrize("name", TRAVERSAL_NAMES)
+def test_invalid_app_names_are_refused(backend, name):
+    storage.store_payload("bob", "gmail", "password", {"password": "bob's"})
+    before = sorted(os.listdir("db"))
+    for call in (
+        lambda: storage.store_payload("alice", name, "password", {"password": "x"}),
+        lambda: storage.retrieve_latest_payload("alice", name, "password"),
+        lambda: storage.retrieve_many_payloads("alice", ["ok", name], "password"),
+        lambda: storage.delete_payload("alice", name, "password"),
+        lambda: storage.get_metadata("alice", name),
+    ):
+        with pytest.raises(storage.InvalidAppName):
+            call()
+    [(_, location, error)] = storage.store_many_payloads("alice", "password", [(name, {"password": "x"})])
+    assert location is None and error
+    assert sorted(os.listdir("db")) == before
+    assert json.loads(storage.retrieve_latest_payload("bob", "gmail", "password")[0]) == {"password": "bob's"}
+
+def test_batch_store_keeps_the_valid_items(backend):
+    results = storage.store_many_payloads("alice", "password", [
+        ("one", {"password": "1"}), ("../bob/gmail", {"password": "x"}), ("two", {"password": "2"}),
+    ])
+    assert [(name, error is None) for name, _, error in results] == [("one", True), ("../bob/gmail", False), ("two", True)]
+    assert sorted(storage.retrieve_many_payloads("alice", ["one", "two"], "password")) == ["one", "two"]
+
+def test_web_routes_answer_400(login):
+    storage.store_payload("bob", "gmail", "password", {"password": "bob's"})
+    alice = login("alice")
+    for path, body in (
+        ("/api/secrets/delete", {"app_name": "../bob/gmail"}),
+        ("/api/secrets/retrieve", {"app_name": "../bob/gmail", "passphrase": "p"}),
+        ("/api/secrets/store", {"app_name": "../bob/gmail", "secret_text": "x", "passphrase": "p"}),
+        ("/api/secrets/batch_retrieve", {"app_names": ["../bob/gmail"], "passphrase": "p"}),
+    ):
+        response = alice.post(path, json=body)
+        assert response.status_code == 400, (path, response.json)
+    assert alice.get("/api/secrets/metadata/..").status_code == 400
+    assert json.loads(storage.retrieve_latest_payload("bob", "gmail", "password")[0]) == {"password": "bob's"}
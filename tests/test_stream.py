@@ -0,0 +1,147 @@
+import io
+import os
+
+import pytest
+
+from lib import aead, config, stream
+
+CHUNK = 64
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_CHUNK_SIZE", CHUNK)
+
+DATA = os.urandom(CHUNK * 5 + 17)
+
+def _upload(data, name="doc", offset=0, final=True, passphrase="passphrase"):
+    return stream.write("alice", name, passphrase, io.BytesIO(data), offset=offset, final=final)
+
+def _download(name="doc", start=0, stop=None, passphrase="passphrase"):
+    size, reader = stream.open_blob("alice", name, passphrase)
+    return size, b"".join(reader(start, stop))
+
+def _path(suffix=".blob", name="doc"):
+    return os.path.join("db", "alice", stream.BLOBS_DIR, name + suffix)
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, len(DATA)])
+def test_round_trip(size):
+    status = _upload(DATA[:size])
+    assert status == {"offset": size, "complete": True, "size": size}
+    assert _download() == (size, DATA[:size])
+
+def test_ranges_and_passphrase():
+    _upload(DATA)
+    assert _download(start=CHUNK - 3, stop=2 * CHUNK + 5)[1] == DATA[CHUNK - 3:2 * CHUNK + 5]
+    assert _download(start=len(DATA) - 1)[1] == DATA[-1:]
+    with pytest.raises(aead.DecryptionError):
+        _download(passphrase="wrong")
+    with pytest.raises(FileNotFoundError):
+        _download(name="missing")
+
+def test_resume():
+    # Bytes that don't fill a chunk are dropped from a non-final request
+    status = _upload(DATA[:2 * CHUNK + 10], final=False)
+    assert status == {"offset": 2 * CHUNK, "complete": False, "size": None}
+    assert stream.upload_status("alice", "doc") == status
+    with pytest.raises(FileNotFoundError):
+        _download()
+    status = _upload(DATA[2 * CHUNK:4 * CHUNK], offset=2 * CHUNK, final=False)
+    assert status["offset"] == 4 * CHUNK
+    status = _upload(DATA[4 * CHUNK:], offset=4 * CHUNK)
+    assert status["complete"] and _download() == (len(DATA), DATA)
+    assert not os.path.exists(_path(".blob.part"))
+
+def test_offset_mismatch():
+    _upload(DATA[:3 * CHUNK], final=False)
+    for offset in (CHUNK, 4 * CHUNK, 3 * CHUNK + 1):
+        with pytest.raises(stream.OffsetMismatch) as raised:
+            _upload(DATA[offset:], offset=offset)
+        assert raised.value.offset == 3 * CHUNK
+    with pytest.raises(stream.OffsetMismatch) as raised:
+        _upload(DATA, name="other", offset=CHUNK)
+    assert raised.value.offset == 0
+    with pytest.raises(aead.DecryptionError):
+        _upload(DATA[3 * CHUNK:], offset=3 * CHUNK, passphrase="wrong")
+    _upload(DATA[3 * CHUNK:], offset=3 * CHUNK)
+    assert _download()[1] == DATA
+
+def test_torn_chunk_of_an_upload_is_dropped_on_resume():
+    _upload(DATA[:2 * CHUNK], final=False)
+    with open(_path(".blob.part"), "ab") as f:
+        f.write(b"half a chunk")
+    assert stream.upload_status("alice", "doc")["offset"] == 2 * CHUNK
+    _upload(DATA[2 * CHUNK:], offset=2 * CHUNK)
+    assert _download()[1] == DATA
+
+@pytest.mark.parametrize("cut", [
+    CHUNK + stream.TAG_SIZE,        # the whole last chunk: the new last one lacks the last-flag
+    1,                              # inside the last chunk
+])
+def test_truncated_blob_is_detected(cut):
+    _upload(DATA)
+    with open(_path(), "r+b") as f:
+        f.truncate(os.path.getsize(_path()) - cut)
+    with pytest.raises(aead.DecryptionError):
+        _download()
+
+def test_torn_upload_header_restarts_at_zero():
+    _upload(DATA[:2 * CHUNK], final=False)
+    _upload(DATA, name="done")
+    with open(_path(".blob.part"), "r+b") as f:
+        f.truncate(stream.HEADER_SIZE - 5)
+    assert stream.upload_status("alice", "doc")["offset"] == 0
+    assert [(b["name"], b.get("offset")) for b in stream.list_blobs("alice")] == [("doc", 0), ("done", None)]
+    with pytest.raises(stream.OffsetMismatch) as raised:
+        _upload(DATA[2 * CHUNK:], offset=2 * CHUNK)
+    assert raised.value.offset == 0
+    _upload(DATA)
+    assert _download()[1] == DATA
+
+def test_unreadable_blob_is_listed_with_an_error():
+    _upload(DATA)
+    _upload(DATA, name="fine")
+    with open(_path(), "r+b") as f:
+        f.write(b"XXX")
+    blobs = {b["name"]: b for b in stream.list_blobs("alice")}
+    assert blobs["fine"]["size"] == len(DATA)
+    assert blobs["doc"]["size"] is None and "not a blob" in blobs["doc"]["error"]
+    with pytest.raises(stream.StreamError):
+        stream.upload_status("alice", "doc")
+    assert stream.delete("alice", "doc")
+
+def test_busy_blob():
+    os.makedirs(os.path.dirname(_path()))
+    with stream._blob_lock("alice", "doc"):
+        with pytest.raises(stream.UploadInProgress):
+            _upload(DATA)
+        with pytest.raises(stream.UploadInProgress):
+            stream.delete("alice", "doc")
+
+@pytest.mark.parametrize("name", ["", ".hidden", "-x", "a/b", "..", None, "x" * 129])
+def test_names(name):
+    with pytest.raises(ValueError):
+        _upload(DATA, name=name)
+
+def test_web_routes(login):
+    alice = login("alice")
+    headers = {"X-Passphrase": "passphrase"}
+    response = alice.post("/api/blobs/doc?final=0", data=DATA[:2 * CHUNK + 1], headers=headers)
+    assert response.json["offset"] == 2 * CHUNK
+    response = alice.post("/api/blobs/doc?offset=64", data=DATA[CHUNK:], headers=headers)
+    assert response.status_code == 409 and response.json["offset"] == 2 * CHUNK
+    assert alice.post(f"/api/blobs/doc?offset={2 * CHUNK}", data=DATA[2 * CHUNK:], headers=headers).json["complete"]
+    response = alice.get("/api/blobs/doc", headers=dict(headers, Range="bytes=10-99"))
+    assert response.status_code == 206 and response.data == DATA[10:100]
+
+    alice.post("/api/blobs/torn?final=0", data=DATA, headers=headers)
+    with open(os.path.join("db", "alice", stream.BLOBS_DIR, "torn.blob.part"), "r+b") as f:
+        f.truncate(10)
+    with open(os.path.join("db", "alice", stream.BLOBS_DIR, "doc.blob"), "r+b") as f:
+        f.write(b"XXX")
+    response = alice.get("/api/blobs")
+    assert response.status_code == 200
+    assert {b["name"]: b.get("offset") for b in response.json["blobs"]} == {"doc": None, "torn": 0}
+    assert alice.get("/api/blobs/torn/status").json["offset"] == 0
+    assert alice.get("/api/blobs/doc/status").status_code == 409
+    assert alice.get("/api/blobs/doc", headers=headers).status_code == 500
+    assert alice.post("/api/blobs/doc/delete").status_code == 200
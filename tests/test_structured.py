@@ -0,0 +1,126 @@
+import json
+import os
+
+import pytest
+
+from lib import durable, storage, structured, utils
+
+DOCUMENT = {
+    "login": {"user": "alice", "password": "hunter2"},
+    "recovery": ["code-1", "code-2"],
+    "pin": 1234,
+}
+
+def _tree():
+    return os.path.join("db", "alice", structured.TREES_DIR, "vault")
+
+def _read(path=""):
+    return structured.read("alice", "vault", "passphrase", path)[0]
+
+@pytest.fixture
+def vault():
+    structured.store("alice", "vault", DOCUMENT, "passphrase")
+
+def test_store_and_read(vault):
+    assert _read() == DOCUMENT
+    assert _read("login.password") == "hunter2"
+    assert _read("recovery.1") == "code-2"
+    with pytest.raises(KeyError):
+        _read("login.missing")
+
+def test_wrong_passphrase(vault):
+    with pytest.raises(Exception):
+        structured.read("alice", "vault", "wrong")
+
+def test_update_rewrites_only_changed_leaves(vault):
+    result = structured.update("alice", "vault", "passphrase", [
+        {"op": "set", "path": "login.password", "value": "correct horse"},
+        {"op": "set", "path": "pin", "value": 1234},
+        {"op": "delete", "path": "recovery"},
+        {"op": "set", "path": "notes.a.b", "value": True},
+    ])
+    # "pin" is set without being read, so it is rewritten even though the value is the same
+    assert result == {"written": 3, "deleted": 1}
+    assert _read() == {"login": {"user": "alice", "password": "correct horse"}, "pin": 1234, "notes": {"a": {"b": True}}}
+
+def test_failed_operation_changes_nothing(vault):
+    with pytest.raises(utils.PatchError):
+        structured.update("alice", "vault", "passphrase", [
+            {"op": "set", "path": "login.password", "value": "new"},
+            {"op": "test", "path": "pin", "value": 0},
+        ])
+    assert _read() == DOCUMENT
+
+def test_failure_before_commit_point_changes_nothing(vault, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    with monkeypatch.context() as m, pytest.raises(OSError):
+        m.setattr(durable, "atomic_write_many", fail)
+        structured.update("alice", "vault", "passphrase", [
+            {"op": "set", "path": "login.password", "value": "new"},
+            {"op": "delete", "path": "pin"},
+        ])
+    assert _read() == DOCUMENT
+    assert not os.path.exists(os.path.join(_tree(), structured.STAGING_DIR))
+
+def test_crash_after_commit_point_is_finished_by_next_access(vault, monkeypatch):
+    replace = os.replace
+    applied = []
+
+    def crash_after_first_put(src, dst):
+        staging = os.path.join(_tree(), structured.STAGING_DIR)
+        if src.startswith(staging) and not dst.startswith(staging):
+            if applied:
+                raise OSError("power loss")
+            applied.append(dst)
+        replace(src, dst)
+
+    with monkeypatch.context() as m, pytest.raises(OSError):
+        m.setattr(os, "replace", crash_after_first_put)
+        structured.update("alice", "vault", "passphrase", [
+            {"op": "set", "path": "login.password", "value": "new"},
+            {"op": "set", "path": "login.user", "value": "bob"},
+            {"op": "delete", "path": "pin"},
+        ])
+    assert len(applied) == 1
+    assert os.path.exists(os.path.join(_tree(), structured.JOURNAL_FILE))
+    assert _read() == {"login": {"user": "bob", "password": "new"}, "recovery": ["code-1", "code-2"]}
+    assert not os.path.exists(os.path.join(_tree(), structured.JOURNAL_FILE))
+
+@pytest.mark.parametrize("keys", [
+    {".tmp": "a", ".meta": "b", ".staged": {"c": 1}, ".journal": "d"},
+    {"x": "leaf", "x.leaf": {"inner": "dict"}},
+    {"x": {"inner": "dict"}, "x.leaf": "leaf"},
+    {"a/b": "slash", "%2E": "escaped", "..": "dots"},
+])
+def test_unusual_keys_round_trip(keys):
+    structured.store("alice", "vault", keys, "passphrase")
+    assert _read() == keys
+    structured.update("alice", "vault", "passphrase", [{"op": "set", "path": [k], "value": "new"} for k in keys])
+    assert _read() == {k: "new" for k in keys}
+
+@pytest.mark.parametrize("name", ["../../bob", "..", ".", "a/b", ".trees", "vault.lock", "vault.new", ""])
+def test_tree_names_cannot_leave_the_users_directory(name):
+    for call in (
+        lambda: structured.store("alice", name, DOCUMENT, "passphrase"),
+        lambda: structured.read("alice", name, "passphrase"),
+        lambda: structured.update("alice", name, "passphrase", []),
+        lambda: structured.delete("alice", name),
+        lambda: structured.metadata("alice", name),
+    ):
+        with pytest.raises(storage.InvalidAppName):
+            call()
+
+def test_web_routes_refuse_traversal(login):
+    storage.store_payload("bob", "gmail", "password", {"password": "bob's"})
+    bob_files = sorted(os.listdir("db/bob"))
+    alice = login("alice")
+    for body in ({"app_name": "../../bob"}, {"app_name": ".."}):
+        assert alice.post("/api/structured/delete", json=body).status_code == 400
+    response = alice.post("/api/structured/store", json={"app_name": "../../evil", "secret": {"a": 1}, "passphrase": "p"})
+    assert response.status_code == 400
+    assert alice.post("/api/structured/..%2F..%2Fbob/get", json={"passphrase": "p"}).status_code in (400, 404)
+    assert alice.post("/api/structured/../update", json={"passphrase": "p", "operations": []}).status_code in (400, 404)
+    assert not os.path.exists("db/evil") and not os.path.exists("db/evil.lock")
+    assert sorted(os.listdir("db/bob")) == bob_files
+    assert json.loads(storage.retrieve_latest_payload("bob", "gmail", "password")[0]) == {"password": "bob's"}
@@ -0,0 +1,102 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from lib import network, protocol, tcp_client
+
+PAYLOAD = {"app_username": "me", "password": "ciphertext", "timestamp": "20260101-120000"}
+
+class DyingServer:
+    """
+    A framed server that answers the first request on each connection and
+    drops the connection after reading the second, as a server that
+    restarts mid-request would. `received` is every request it read.
+    """
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.received = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    network.receive_exactly(conn, protocol.HELLO_SIZE)
+                    conn.sendall(protocol.hello())
+                    for answer in (True, False):
+                        request_id, body = network.receive_frame(conn)
+                        message = protocol.parse_message(body)
+                        self.received.append(message.get("command", "STORE"))
+                        if answer:
+                            conn.sendall(protocol.encode_frame(request_id, self._response(message)))
+                except ConnectionError:
+                    pass
+
+    @staticmethod
+    def _response(message):
+        if message.get("command") == "REQUEST_SECRET":
+            return protocol.encode_payload(None)
+        if message.get("command") == "STORE_BATCH":
+            return protocol.encode_summary({"stored": 1, "errors": []})
+        return protocol.encode_text("ACK: Payload stored")
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.thread.join(timeout=5)
+
+@pytest.fixture
+def dying_server():
+    server = DyingServer()
+    yield server
+    server.close()
+
+def test_retrieve_is_resent_after_a_pooled_connection_dies(dying_server):
+    with tcp_client.Client("127.0.0.1", dying_server.port, retries=1) as client:
+        assert client.retrieve("alice", "pw", "mail") is None      # pools the connection
+        assert client.retrieve("alice", "pw", "mail") is None
+    assert dying_server.received == ["REQUEST_SECRET"] * 3
+
+def test_store_is_not_resent(dying_server):
+    with tcp_client.Client("127.0.0.1", dying_server.port, retries=1) as client:
+        client.store("alice", "pw", "mail", PAYLOAD)
+        with pytest.raises(ConnectionError):
+            client.store("alice", "pw", "mail", PAYLOAD)
+        client.store_batch("alice", "pw", [("mail", PAYLOAD)])             # on a new connection
+        with pytest.raises(ConnectionError):
+            client.store_batch("alice", "pw", [("mail", PAYLOAD)])
+    assert dying_server.received == ["STORE", "STORE", "STORE_BATCH", "STORE_BATCH"]
+
+def test_async_client_resends_only_retrieves(dying_server):
+    async def run():
+        async with tcp_client.AsyncClient("127.0.0.1", dying_server.port, retries=1) as client:
+            assert await client.retrieve("alice", "pw", "mail") is None
+            assert await client.retrieve("alice", "pw", "mail") is None
+            await client.close()
+            await client.store("alice", "pw", "mail", PAYLOAD)
+            with pytest.raises(ConnectionError):
+                await client.store("alice", "pw", "mail", PAYLOAD)
+    asyncio.run(run())
+    assert dying_server.received == ["REQUEST_SECRET"] * 3 + ["STORE"] * 2
+
+def test_store_reaches_the_log_backend_once(tcp_server, monkeypatch):
+    from lib import auth, config, storage
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "log")
+    auth.register_user("alice", "pw")
+    with tcp_client.Client("127.0.0.1", tcp_server.port) as client:
+        client.store("alice", "pw", "mail", PAYLOAD)
+        client.store("alice", "pw", "mail", dict(PAYLOAD, timestamp="20260101-120001"))
+        assert client.retrieve("alice", "pw", "mail") == dict(PAYLOAD, timestamp="20260101-120001")
+    assert len(storage.payload_history("alice", "mail", "pw")) == 2
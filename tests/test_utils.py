@@ -0,0 +1,80 @@
+import copy
+
+import pytest
+
+from lib import utils
+
+DOC = {"a": {"b": 1, "list": [{"x": 1}, {"x": 2}, {"x": 3}]}, "s": "scalar"}
+
+def apply(*operations, data=DOC):
+    return utils.apply_operations(data, list(operations))
+
+def test_data_is_never_modified():
+    before = copy.deepcopy(DOC)
+    apply({"op": "set", "path": "a.b", "value": 2}, {"op": "delete", "path": "a.list.0"})
+    with pytest.raises(utils.PatchError):
+        apply({"op": "set", "path": "a.b", "value": 2}, {"op": "delete", "path": "missing"})
+    assert DOC == before
+
+def test_set_autovivifies_dicts_and_appends_at_the_end_of_lists():
+    result = apply(
+        {"op": "set", "path": "new.deep.key", "value": 1},
+        {"op": "set", "path": "a.list.3", "value": {"x": 4}},
+        {"op": "set", "path": "a.list.0.x", "value": 0},
+    )
+    assert result["new"] == {"deep": {"key": 1}}
+    assert [item["x"] for item in result["a"]["list"]] == [0, 2, 3, 4]
+
+@pytest.mark.parametrize("operation, message", [
+    ({"op": "set", "path": "a.list.4", "value": 1}, "out of range"),
+    ({"op": "set", "path": "a.list.-1", "value": 1}, "out of range"),
+    ({"op": "set", "path": "a.list.x", "value": 1}, "not a list index"),
+    ({"op": "set", "path": "s.x", "value": 1}, "not a dictionary or list"),
+    ({"op": "delete", "path": "a.missing"}, "does not exist"),
+    ({"op": "delete", "path": ""}, "root"),
+    ({"op": "append", "path": "a.b", "value": 1}, "not a list"),
+    ({"op": "move", "from": "a", "path": "a.b.c"}, "into itself"),
+    ({"op": "move", "path": "x"}, "missing 'from'"),
+    ({"op": "test", "path": "a.b", "value": 2}, "test failed"),
+    ({"op": "set", "path": "a"}, "missing 'value'"),
+    ({"op": "set", "value": 1}, "missing 'path'"),
+    ({"op": "copy", "path": "a"}, "'op' must be one of"),
+    ({"op": "set", "path": 5, "value": 1}, "Invalid path"),
+])
+def test_errors(operation, message):
+    with pytest.raises(utils.PatchError, match=message):
+        apply(operation)
+
+def test_errors_name_the_operation():
+    with pytest.raises(utils.PatchError, match=r"^Operation 11 \(delete\)"):
+        utils.apply_operations(DOC, [{"op": "test", "path": "a.b", "value": 1}, {"op": "delete", "path": "x"}],
+                               first_index=10)
+    with pytest.raises(utils.PatchError):
+        utils.apply_operations(DOC, {"op": "set"})
+
+def test_later_operations_see_earlier_ones():
+    result = apply(
+        {"op": "delete", "path": "a.list.0"},
+        {"op": "test", "path": "a.list.0.x", "value": 2},      # elements shifted down
+        {"op": "set", "path": "a", "value": {"fresh": True}},
+        {"op": "set", "path": "a.b", "value": 2},               # into the new dict
+        {"op": "append", "path": "log", "value": "one"},        # creates the list
+        {"op": "append", "path": "log", "value": "two"},
+        {"op": "move", "from": "a.fresh", "path": "moved.here"},
+        {"op": "move", "from": "s", "path": "s"},               # onto itself: a no-op
+    )
+    assert result == {"a": {"b": 2}, "log": ["one", "two"], "moved": {"here": True}, "s": "scalar"}
+
+def test_values_are_copied():
+    value = {"nested": [1]}
+    result = apply({"op": "set", "path": "v", "value": value}, {"op": "append", "path": "w", "value": value})
+    value["nested"].append(2)
+    assert result["v"] == {"nested": [1]} and result["w"] == [{"nested": [1]}]
+
+def test_paths():
+    assert utils.parse_path("a.b.0") == ("a", "b", "0")
+    assert utils.parse_path("") == ()
+    assert utils.parse_path(["a.b", 0]) == ("a.b", "0")
+    result = apply({"op": "set", "path": ["dotted.key"], "value": 1})
+    assert result["dotted.key"] == 1 and "dotted" not in result
+    assert apply({"op": "set", "path": "", "value": {"r": 1}}, {"op": "set", "path": "r", "value": 2}) == {"r": 2}
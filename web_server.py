@@ -1,21 +1,83 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 import json
 import os
-from lib import auth, storage, crypto, utils
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from lib import admission, aead, app_index, auth, config, metrics, network, prefork, sessions, storage, stream, structured, crypto, utils
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Request bodies are parsed here; time it as the json_parse stage"""
+    def loads(self, s, **kwargs):
+        with metrics.stage("json_parse"):
+            return super().loads(s, **kwargs)
 
 app = Flask(__name__, static_folder='static')
-app.secret_key = os.urandom(24)  # Generate random secret key for sessions
+app.json = TimedJSONProvider(app)
+
+def _forget_session(session_id):
+    sessions.forget(session_id)
+    crypto.wipe_key_cache(session_id)
+
+# Every worker process caches sessions and their derived keys: logout reaches all of them
+prefork.on_broadcast("logout", _forget_session)
+
+def init_worker():
+    """Per-process setup for serve.py's worker processes."""
+    os.makedirs('db', exist_ok=True)
+    crypto.init_engine()
+    if config.METRICS_ENABLED:
+        metrics.share(config.METRICS_SHARED_DIR)
+
+# Shared, bounded pool for batch decrypts (gpg subprocesses / scrypt run in parallel)
+batch_pool = ThreadPoolExecutor(max_workers=config.BATCH_WORKERS)
+
+@contextmanager
+def _batch_admission(backends):
+    """
+    Admits a batch as one unit of its client's work: the request thread holds
+    a slot of each pool the batch's backends use while batch_pool runs the
+    items (its threads are not tagged with a peer, so they don't queue again)
+    """
+    with ExitStack() as stack:
+        for backend in sorted(backends):
+            stack.enter_context(crypto.admission_pool(backend).slot())
+        yield
+
+def _stored_backends(stored):
+    backends = set()
+    for data_str in stored.values():
+        try:
+            backends.add(crypto.backend_for(json.loads(data_str)['password']))
+        except (TypeError, ValueError, KeyError):
+            pass  # no secret, or unreadable: reported per app by _decrypt_stored
+    return backends
 
 # CORS headers for development
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Passphrase, Range')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     return response
 
+@app.before_request
+def start_metrics():
+    """Time the request under its route pattern (bounded label set)"""
+    metrics.begin('http', request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def record_metrics(response):
+    # Streamed bodies (blob downloads) are timed until the last byte is sent,
+    # so the file reads and decrypts of the stream count towards the route
+    if response.is_streamed:
+        response.call_on_close(lambda: metrics.end(response.status_code))
+    else:
+        metrics.end(response.status_code)
+    return response
+
 @app.before_request
 def restrict_access():
     """
@@ -33,13 +95,11 @@ def restrict_access():
     if remote_ip == '127.0.0.1' or remote_ip == 'localhost':
         return None  # Access Granted
         
-    # 2. Allow Connected Peers (Hotspot Clients)
-    # We refresh this list on every request. For performance in high-load scenarios 
-    # we might cache, but for this use case, real-time is safer.
-    from lib import network
-    allowed_peers = network.get_connected_peers()
-    
-    if remote_ip in allowed_peers:
+    # 2. Allow Connected Peers (Hotspot Clients) and configured ranges
+    # The ARP view is cached briefly; a miss re-reads it before we deny.
+    with metrics.stage('allowlist'):
+        allowed = network.is_allowed_peer(remote_ip)
+    if allowed:
         return None  # Access Granted
         
     # 3. Deny Everyone Else
@@ -47,10 +107,41 @@ def restrict_access():
     print(f"SECURITY ALERT: Blocked access attempt from {remote_ip}")
     return jsonify({'error': 'Access Denied: You must be connected to the secure hotspot.'}), 403
 
+@app.before_request
+def admit_peer():
+    """KDF and gpg work of this request counts against its client's admission caps"""
+    admission.set_peer(request.remote_addr)
+
+@app.errorhandler(admission.Overloaded)
+def overloaded(e):
+    """Shed load: 503 when a KDF / gpg queue is full, 429 when this client holds its share"""
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(storage.InvalidAppName)
+def invalid_app_name(e):
+    """App names storage refuses (see storage.check_app_name)"""
+    return jsonify({'error': str(e)}), 400
+
+@app.before_request
+def load_session():
+    """Resolve the session cookie to the logged-in user (g.user), or None"""
+    g.user = sessions.get(request.cookies.get(config.SESSION_COOKIE))
+
 @app.route('/')
 def index():
     return send_from_directory('static', 'index.html')
 
+def _start_session(username):
+    """Log the verified user in: the cookie holds only an opaque session token"""
+    token, g.user = sessions.create(username)
+    response = jsonify({'success': True, 'username': username})
+    response.set_cookie(config.SESSION_COOKIE, token, max_age=config.SESSION_MAX_AGE,
+                        httponly=True, samesite='Strict')
+    return response
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     """Authenticate user and create session"""
@@ -62,9 +153,7 @@ def login():
         return jsonify({'error': 'Username and password required'}), 400
     
     if auth.check_auth(username, password):
-        session['username'] = username
-        session['password'] = password  # Store for backend operations
-        return jsonify({'success': True, 'username': username, 'password': password})
+        return _start_session(username)
     else:
         return jsonify({'error': 'Invalid credentials'}), 401
 
@@ -78,69 +167,107 @@ def register():
     if not username or not password:
         return jsonify({'error': 'Username and password required'}), 400
     
-    # Check if user already exists
-    auth_file = os.path.join("db", username, "auth.json")
-    if os.path.exists(auth_file):
+    # Create new user (fails if the user already exists)
+    if auth.register_user(username, password):
+        return _start_session(username)
+    else:
         return jsonify({'error': 'User already exists'}), 409
+
+@app.route('/api/auth/change_password', methods=['POST'])
+def change_password():
+    """Change the password of the authenticated user"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Create new user
-    if auth.save_auth(username, password):
-        session['username'] = username
-        session['password'] = password
-        return jsonify({'success': True, 'username': username, 'password': password})
+    data = request.json
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+    
+    if not old_password or not new_password:
+        return jsonify({'error': 'Old and new password required'}), 400
+    
+    if auth.change_password(g.user.username, old_password, new_password):
+        # The user's other sessions end with the old password; this one carries on
+        sessions.rekey(g.user)
+        return jsonify({'success': True})
     else:
-        return jsonify({'error': 'Registration failed'}), 500
+        return jsonify({'error': 'Invalid credentials'}), 401
 
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
-    """Clear session"""
-    session.clear()
-    return jsonify({'success': True})
+    """End the session and wipe its cached keys"""
+    if g.user is not None:
+        sessions.end(g.user)
+        prefork.broadcast("logout", g.user.id)
+    response = jsonify({'success': True})
+    response.delete_cookie(config.SESSION_COOKIE)
+    return response
 
 @app.route('/api/auth/check', methods=['GET'])
 def check_auth_status():
     """Check if user is authenticated"""
-    if 'username' in session:
-        return jsonify({
-            'authenticated': True, 
-            'username': session['username'],
-            'password': session.get('password')
-        })
+    if g.user is not None:
+        return jsonify({'authenticated': True, 'username': g.user.username})
     return jsonify({'authenticated': False})
 
+def _stats():
+    return {
+        'auth_cache': auth.cache_stats(),
+        'sessions': sessions.stats(),
+        'admission': admission.stats(),
+        'crypto': crypto.timing_stats(),
+        'key_cache': crypto.key_cache_stats()
+    }
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Report internal cache counters"""
+    return jsonify(_stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms of every worker (label worker=<pid>) and counters of this one, Prometheus text format"""
+    return Response(metrics.prometheus(_stats()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/metrics.json', methods=['GET'])
+def get_metrics_json():
+    """Per-route and per-stage latency summaries of this process"""
+    return jsonify(dict(metrics.snapshot(), pid=os.getpid(), stats=_stats()))
+
 @app.route('/api/apps', methods=['GET'])
 def list_apps():
-    """List all apps for the authenticated user"""
-    if 'username' not in session:
+    """List apps for the authenticated user (optionally sorted, filtered and paginated)"""
+    if g.user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    username = session['username']
-    user_dir = os.path.join('db', username)
-    
-    if not os.path.exists(user_dir):
-        return jsonify({'apps': []})
-    
-    apps = []
-    for item in os.listdir(user_dir):
-        item_path = os.path.join(user_dir, item)
-        if os.path.isdir(item_path) and item != 'auth.json':
-            # Check if secret.json exists
-            secret_file = os.path.join(item_path, 'secret.json')
-            if os.path.exists(secret_file):
-                # Get metadata
-                stat = os.stat(secret_file)
-                apps.append({
-                    'name': item,
-                    'modified': stat.st_mtime,
-                    'size': stat.st_size
-                })
-    
-    return jsonify({'apps': apps})
+    username = g.user.username
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    
+    if limit is not None:
+        limit = max(1, min(limit, config.APP_PAGE_MAX))
+    
+    try:
+        apps, next_cursor, total = app_index.query(
+            username,
+            sort=sort,
+            order=order,
+            prefix=request.args.get('prefix'),
+            contains=request.args.get('q'),
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'apps': apps, 'next_cursor': next_cursor, 'total': total})
 
 @app.route('/api/secrets/store', methods=['POST'])
 def store_secret():
     """Store a new encrypted secret"""
-    if 'username' not in session:
+    if g.user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.json
@@ -152,12 +279,11 @@ def store_secret():
     if not all([app_name, secret_text, passphrase]):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    username = session['username']
-    user_password = session['password']
+    username = g.user.username
     
     try:
         # Encrypt the secret
-        encrypted_data = crypto.encrypt_secret(secret_text, passphrase)
+        encrypted_data = crypto.encrypt_secret(secret_text, passphrase, scope=g.user.id)
         if not encrypted_data.ok:
             return jsonify({'error': f'Encryption failed: {encrypted_data.status}'}), 500
         
@@ -169,18 +295,20 @@ def store_secret():
         }
         
         # Store it
-        filename = storage.store_payload(username, app_name, user_password, payload)
+        filename = storage.store_payload(username, app_name, g.user, payload)
         return jsonify({'success': True, 'filename': filename})
         
     except PermissionError:
         return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/secrets/retrieve', methods=['POST'])
 def retrieve_secret():
     """Retrieve and decrypt a secret"""
-    if 'username' not in session:
+    if g.user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.json
@@ -190,11 +318,10 @@ def retrieve_secret():
     if not all([app_name, passphrase]):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    username = session['username']
-    user_password = session['password']
+    username = g.user.username
     
     try:
-        result = storage.retrieve_latest_payload(username, app_name, user_password)
+        result = storage.retrieve_latest_payload(username, app_name, g.user)
         if not result:
             return jsonify({'error': 'No secret found'}), 404
         
@@ -205,7 +332,7 @@ def retrieve_secret():
         timestamp = payload.get('timestamp', 'Unknown')
         
         # Decrypt
-        decrypted_data = crypto.decrypt_secret(encrypted_text, passphrase)
+        decrypted_data = crypto.decrypt_secret(encrypted_text, passphrase, scope=g.user.id)
         if decrypted_data.ok:
             return jsonify({
                 'success': True,
@@ -218,13 +345,124 @@ def retrieve_secret():
             
     except PermissionError:
         return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _decrypt_stored(app_name, data_str, passphrase, scope):
+    """Decrypts one stored payload into a per-app batch result"""
+    if data_str is None:
+        return {'app_name': app_name, 'error': 'No secret found'}
+    try:
+        payload = json.loads(data_str)
+        decrypted_data = crypto.decrypt_secret(payload['password'], passphrase, scope=scope)
+        if not decrypted_data.ok:
+            return {'app_name': app_name, 'error': f'Decryption failed: {decrypted_data.status}'}
+        return {
+            'app_name': app_name,
+            'success': True,
+            'secret': decrypted_data.data.decode('utf-8'),
+            'app_username': payload.get('app_username', 'N/A'),
+            'timestamp': payload.get('timestamp', 'Unknown')
+        }
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return {'app_name': app_name, 'error': str(e)}
+
+@app.route('/api/secrets/batch_retrieve', methods=['POST'])
+def batch_retrieve_secrets():
+    """Retrieve and decrypt several secrets with one passphrase"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    app_names = data.get('app_names')
+    passphrase = data.get('passphrase')
+    
+    if not isinstance(app_names, list) or not app_names or not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    if not all(isinstance(app_name, str) and app_name for app_name in app_names):
+        return jsonify({'error': 'app_names must be a list of app names'}), 400
+    if len(app_names) > config.BATCH_MAX_APPS:
+        return jsonify({'error': f'Too many apps (max {config.BATCH_MAX_APPS})'}), 400
+    
+    username = g.user.username
+    scope = g.user.id
+    
+    try:
+        stored = storage.retrieve_many_payloads(username, app_names, g.user)
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    
+    with _batch_admission(_stored_backends(stored)):
+        futures = [
+            batch_pool.submit(_decrypt_stored, app_name, stored[app_name], passphrase, scope)
+            for app_name in app_names
+        ]
+        results = [f.result() for f in futures]
+    return jsonify({'success': True, 'results': results})
+
+def _encrypt_item(item, passphrase, scope):
+    encrypted_data = crypto.encrypt_secret(item['secret_text'], passphrase, scope=scope)
+    if not encrypted_data.ok:
+        raise ValueError(f'Encryption failed: {encrypted_data.status}')
+    return {
+        'app_username': item.get('app_username', ''),
+        'password': str(encrypted_data),
+        'timestamp': __import__('datetime').datetime.now().strftime("%Y%m%d-%H%M%S")
+    }
+
+@app.route('/api/secrets/batch_store', methods=['POST'])
+def batch_store_secrets():
+    """Encrypt and store several secrets with one passphrase"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    items = data.get('items')
+    passphrase = data.get('passphrase')
+    
+    if not isinstance(items, list) or not items or not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    if len(items) > config.BATCH_MAX_APPS:
+        return jsonify({'error': f'Too many items (max {config.BATCH_MAX_APPS})'}), 400
+    if not all(isinstance(item, dict) and isinstance(item.get('app_name'), str) and item['app_name']
+               and isinstance(item.get('secret_text'), str) and item['secret_text'] for item in items):
+        return jsonify({'error': 'Each item needs app_name and secret_text'}), 400
+    
+    username = g.user.username
+    scope = g.user.id
+    
+    try:
+        with _batch_admission({config.CRYPTO_BACKEND}):
+            futures = [batch_pool.submit(_encrypt_item, item, passphrase, scope) for item in items]
+            payloads = [(item['app_name'], f.result()) for item, f in zip(items, futures)]
+        results = storage.store_many_payloads(username, g.user, payloads)
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except admission.Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'results': [
+            {'app_name': app_name, 'filename': filename, 'error': error}
+            for app_name, filename, error in results
+        ]
+    })
 
 @app.route('/api/secrets/update', methods=['POST'])
 def update_secret():
-    """Update a secret by overwriting with a new value (or JSON object)"""
-    if 'username' not in session:
+    """
+    Update a secret: overwrite it with `value`, set `key_path` to `value`, or
+    apply an ordered list of `operations` (see utils.apply_operations).
+    Either way it is one decrypt, one encrypt and one write.
+    """
+    if g.user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.json
@@ -232,26 +470,27 @@ def update_secret():
     passphrase = data.get('passphrase')
     key_path = data.get('key_path')
     value = data.get('value')
+    operations = data.get('operations')
     
-    if not all([app_name, passphrase, value is not None]):
+    if not all([app_name, passphrase]) or (value is None and operations is None):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    username = session['username']
-    user_password = session['password']
+    username = g.user.username
     
     try:
         # 1. Retrieve existing secret
-        result = storage.retrieve_latest_payload(username, app_name, user_password)
+        result = storage.retrieve_latest_payload(username, app_name, g.user)
         if not result:
             return jsonify({'error': 'No secret found to update'}), 404
         
         data_str, filepath = result
-        payload = json.loads(data_str)
+        with metrics.stage('json_parse'):
+            payload = json.loads(data_str)
         encrypted_text = payload['password']
         app_username = payload.get('app_username', '')
         
         # Decrypt
-        decrypted_data = crypto.decrypt_secret(encrypted_text, passphrase)
+        decrypted_data = crypto.decrypt_secret(encrypted_text, passphrase, scope=g.user.id)
         if not decrypted_data.ok:
             return jsonify({'error': f'Decryption failed: {decrypted_data.status}'}), 400
         
@@ -259,13 +498,17 @@ def update_secret():
         
         # Parse JSON
         try:
-            secret_data = json.loads(current_json_str)
+            with metrics.stage('json_parse'):
+                secret_data = json.loads(current_json_str)
         except json.JSONDecodeError:
             # Not JSON, wrap it
             secret_data = {'raw_content': current_json_str}
         
-        # 2. Apply update (Full overwrite if no key_path)
-        if not key_path:
+        # 2. Apply update (operations, key_path, or full overwrite)
+        if operations is not None:
+            # All-or-nothing: raises before anything is re-encrypted
+            secret_data = utils.apply_operations(secret_data, operations)
+        elif not key_path:
             # Full overwrite
             try:
                 secret_data = json.loads(value)
@@ -278,7 +521,7 @@ def update_secret():
         # 3. Re-encrypt and store
         new_json_str = json.dumps(secret_data, indent=2) if isinstance(secret_data, (dict, list)) else str(secret_data)
         
-        encrypted_data = crypto.encrypt_secret(new_json_str, passphrase)
+        encrypted_data = crypto.encrypt_secret(new_json_str, passphrase, scope=g.user.id)
         
         if not encrypted_data.ok:
             return jsonify({'error': f'Encryption failed: {encrypted_data.status}'}), 500
@@ -289,7 +532,7 @@ def update_secret():
             'timestamp': __import__('datetime').datetime.now().strftime("%Y%m%d-%H%M%S")
         }
         
-        filename = storage.store_payload(username, app_name, user_password, new_payload)
+        filename = storage.store_payload(username, app_name, g.user, new_payload)
         
         return jsonify({
             'success': True,
@@ -297,41 +540,357 @@ def update_secret():
             'filename': filename
         })
         
-    except TypeError as e:
+    except (TypeError, utils.PatchError) as e:
         return jsonify({'error': f'Update failed: {str(e)}'}), 400
     except PermissionError:
         return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/secrets/delete', methods=['POST'])
+def delete_secret():
+    """Delete a secret"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    app_name = data.get('app_name')
+    
+    if not app_name:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        if not storage.delete_payload(g.user.username, app_name, g.user):
+            return jsonify({'error': 'Secret not found'}), 404
+        return jsonify({'success': True})
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/secrets/metadata/<app_name>', methods=['GET'])
 def get_secret_metadata(app_name):
     """Get metadata for a specific app's secret"""
-    if 'username' not in session:
+    if g.user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    username = session['username']
-    secret_file = os.path.join('db', username, app_name, 'secret.json')
-    
-    if not os.path.exists(secret_file):
-        return jsonify({'error': 'Secret not found'}), 404
+    username = g.user.username
     
     try:
-        with open(secret_file, 'r') as f:
-            payload = json.load(f)
+        entry = storage.get_metadata(username, app_name)
+        if not entry:
+            return jsonify({'error': 'Secret not found'}), 404
         
-        stat = os.stat(secret_file)
         return jsonify({
-            'app_username': payload.get('app_username', 'N/A'),
-            'timestamp': payload.get('timestamp', 'Unknown'),
-            'modified': stat.st_mtime,
-            'size': stat.st_size
+            'app_username': entry['app_username'],
+            'timestamp': entry['timestamp'],
+            'modified': entry['modified'],
+            'size': entry['size']
         })
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/secrets/history/<app_name>', methods=['GET'])
+def get_secret_history(app_name):
+    """List the retained versions of a secret (log storage backend)"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        versions = storage.payload_history(g.user.username, app_name, g.user)
+        if not versions:
+            return jsonify({'error': 'Secret not found'}), 404
+        return jsonify({'app_name': app_name, 'versions': versions})
+    except NotImplementedError as e:
+        return jsonify({'error': str(e)}), 501
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+
+@app.route('/api/secrets/history/<app_name>/<int:version>', methods=['POST'])
+def retrieve_secret_version(app_name, version):
+    """Retrieve and decrypt one prior version of a secret"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    passphrase = request.json.get('passphrase')
+    if not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        result = storage.retrieve_payload_version(g.user.username, app_name, version, g.user)
+    except NotImplementedError as e:
+        return jsonify({'error': str(e)}), 501
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    if not result:
+        return jsonify({'error': 'Version not found'}), 404
+    
+    decrypted = _decrypt_stored(app_name, result[0], passphrase, g.user.id)
+    if 'error' in decrypted:
+        return jsonify({'error': decrypted['error']}), 400
+    decrypted['version'] = version
+    return jsonify(decrypted)
+
+@app.route('/api/structured', methods=['GET'])
+def list_structured():
+    """List structured (per-leaf encrypted) secrets"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    username = g.user.username
+    names = structured.list_trees(username)
+    return jsonify({'apps': [structured.metadata(username, name) for name in names]})
+
+@app.route('/api/structured/store', methods=['POST'])
+def store_structured():
+    """Store a JSON object as a structured secret, each leaf encrypted separately"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    app_name = data.get('app_name')
+    app_username = data.get('app_username', '')
+    secret = data.get('secret')
+    passphrase = data.get('passphrase')
+    
+    if not all([app_name, passphrase]) or secret is None:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        if isinstance(secret, str):
+            secret = json.loads(secret)
+        leaves = structured.store(g.user.username, app_name, secret, passphrase,
+                                  app_username, scope=g.user.id)
+        return jsonify({'success': True, 'leaves': leaves})
+    except storage.InvalidAppName:
+        raise
+    except (ValueError, utils.PatchError) as e:
+        return jsonify({'error': f'Invalid secret: {str(e)}'}), 400
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/structured/<app_name>/get', methods=['POST'])
+def get_structured(app_name):
+    """Decrypt the subtree at a dot path (the whole secret if no path)"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    passphrase = data.get('passphrase')
+    path = data.get('path', '')
+    
+    if not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        value, meta = structured.read(g.user.username, app_name, passphrase, path, scope=g.user.id)
+        return jsonify({
+            'success': True,
+            'path': path,
+            'value': value,
+            'app_username': meta.get('app_username', ''),
+            'timestamp': meta.get('timestamp')
+        })
+    except FileNotFoundError:
+        return jsonify({'error': 'No structured secret found'}), 404
+    except KeyError:
+        return jsonify({'error': f'Path not found: {path}'}), 404
+    except (aead.DecryptionError, utils.PatchError) as e:
+        return jsonify({'error': f'Decryption failed: {str(e)}'}), 400
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/structured/<app_name>/update', methods=['POST'])
+def update_structured(app_name):
+    """Apply update operations, re-encrypting only the leaves that change"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    passphrase = data.get('passphrase')
+    operations = data.get('operations')
+    
+    if not passphrase or operations is None:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        result = structured.update(g.user.username, app_name, passphrase, operations, scope=g.user.id)
+        return jsonify({'success': True, **result})
+    except FileNotFoundError:
+        return jsonify({'error': 'No structured secret found'}), 404
+    except utils.PatchError as e:
+        return jsonify({'error': f'Update failed: {str(e)}'}), 400
+    except aead.DecryptionError as e:
+        return jsonify({'error': f'Decryption failed: {str(e)}'}), 400
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except (admission.Overloaded, storage.InvalidAppName):
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/structured/delete', methods=['POST'])
+def delete_structured():
+    """Delete a structured secret"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    app_name = request.json.get('app_name')
+    if not app_name:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        if not structured.delete(g.user.username, app_name):
+            return jsonify({'error': 'No structured secret found'}), 404
+        return jsonify({'success': True})
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+
+@app.route('/api/blobs', methods=['GET'])
+def list_blobs():
+    """List stored blobs, including unfinished uploads"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    return jsonify({'blobs': stream.list_blobs(g.user.username)})
+
+@app.route('/api/blobs/<name>/status', methods=['GET'])
+def blob_status(name):
+    """Where an upload stands, so an interrupted one can resume"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        stream.check_name(name)
+        return jsonify(stream.upload_status(g.user.username, name))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except stream.StreamError as e:
+        return jsonify({'error': f'Unreadable blob: {str(e)}'}), 409
+
+@app.route('/api/blobs/<name>', methods=['POST'])
+def upload_blob(name):
+    """
+    Stream the raw request body into an encrypted blob. Passphrase in the
+    X-Passphrase header; ?offset=N continues an upload, ?final=0 leaves it
+    open for more parts. Responds with the offset to send next.
+    """
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    passphrase = request.headers.get('X-Passphrase')
+    offset = request.args.get('offset', 0, type=int)
+    final = request.args.get('final', '1') != '0'
+    
+    if not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        status = stream.write(g.user.username, name, passphrase, request.stream,
+                              offset=offset, final=final, scope=g.user.id)
+        return jsonify({'success': True, **status})
+    except stream.OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except stream.UploadInProgress as e:
+        return jsonify({'error': str(e)}), 409
+    except stream.StreamError as e:
+        return jsonify({'error': f'Unreadable blob: {str(e)}'}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except aead.DecryptionError as e:
+        return jsonify({'error': f'Decryption failed: {str(e)}'}), 400
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+@app.route('/api/blobs/<name>', methods=['GET'])
+def download_blob(name):
+    """Stream a decrypted blob (passphrase in X-Passphrase); honours a single Range"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    passphrase = request.headers.get('X-Passphrase')
+    if not passphrase:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    try:
+        size, reader = stream.open_blob(g.user.username, name, passphrase, scope=g.user.id)
+    except FileNotFoundError:
+        return jsonify({'error': 'Blob not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except aead.DecryptionError as e:
+        return jsonify({'error': f'Decryption failed: {str(e)}'}), 400
+    except stream.StreamError as e:
+        return jsonify({'error': f'Unreadable blob: {str(e)}'}), 500
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+    
+    start, stop, status = 0, size, 200
+    if request.range:
+        bounds = request.range.range_for_length(size)
+        if bounds is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+        start, stop = bounds
+        status = 206
+    
+    # The first chunk is read before the status is sent, so a blob that can't
+    # be read gets an error response; a later failure can only cut the stream
+    # short of its Content-Length
+    body = reader(start, stop)
+    try:
+        first = next(body, b'')
+    except (stream.StreamError, aead.DecryptionError) as e:
+        return jsonify({'error': f'Unreadable blob: {str(e)}'}), 500
+    
+    response = Response(_chain(first, body), status=status, mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return response
+
+@app.route('/api/blobs/<name>/delete', methods=['POST'])
+def delete_blob(name):
+    """Delete a blob or an unfinished upload (under the blob's own path, so no blob name collides with it)"""
+    if g.user is None:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        if not stream.delete(g.user.username, name):
+            return jsonify({'error': 'Blob not found'}), 404
+        return jsonify({'success': True})
+    except stream.UploadInProgress as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError:
+        return jsonify({'error': 'Authentication failed'}), 401
+
 if __name__ == '__main__':
     # Ensure db directory exists
     os.makedirs('db', exist_ok=True)
+    crypto.init_engine()
     print("Starting web server on http://localhost:5001")
     app.run(host='0.0.0.0', port=5001, debug=True)